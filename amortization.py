@@ -0,0 +1,229 @@
+"""
+Multi-Loan Amortization for Financial Analyzer
+Compares debt payoff strategies (avalanche, snowball, custom order) across
+all loans and many extra-payment levels at once, vectorized with NumPy.
+"""
+
+import math
+import numpy as np
+
+LOAN_FIELDS = ('balance', 'apr', 'minimum_payment')
+STRATEGIES = ('avalanche', 'snowball', 'custom')
+DEFAULT_EXTRA_PAYMENTS = (0, 50, 100, 200, 300, 500, 750, 1000)
+MAX_MONTHS = 600
+
+
+def validate_loans(loans) -> list:
+    """
+    Validate itemized loans and convert their amounts to floats.
+
+    Each loan is a dictionary with ``balance``, ``apr`` (annual percentage
+    rate, in percent) and ``minimum_payment``, and optionally a ``name``.
+
+    Raises:
+        ValueError: With a client-facing message if a loan is invalid
+    """
+    if not isinstance(loans, list):
+        raise ValueError('loans must be a list')
+
+    validated = []
+    for index, loan in enumerate(loans):
+        if not isinstance(loan, dict):
+            raise ValueError(f'loans[{index}] must be an object')
+        for field in LOAN_FIELDS:
+            if field not in loan:
+                raise ValueError(f'Missing field: loans[{index}].{field}')
+        try:
+            values = {field: float(loan[field]) for field in LOAN_FIELDS}
+        except (TypeError, ValueError) as e:
+            raise ValueError(f'Invalid number format: {str(e)}')
+        for field, value in values.items():
+            if not math.isfinite(value):
+                raise ValueError(f'loans[{index}].{field} must be a finite number')
+            if value < 0:
+                raise ValueError(f'loans[{index}].{field} must be non-negative')
+        validated.append(dict(values, name=str(loan.get('name') or f'Loan {index + 1}')))
+
+    return validated
+
+
+def simulate_payoff(balances, aprs, minimums, priority, extra_payments, max_months: int = MAX_MONTHS):
+    """
+    Amortize many loan portfolios month by month in one vectorized pass.
+
+    Every portfolio pays a fixed monthly budget: the sum of its minimum
+    payments plus its extra payment. Each month interest accrues, every open
+    loan gets its minimum, and the rest of the budget (including minimums
+    freed by loans already paid off) goes to open loans in priority order.
+
+    Args:
+        balances: Loan balances, shape (..., loans); pad unused loans with 0
+        aprs: Annual percentage rates in percent, same shape as balances
+        minimums: Minimum monthly payments, same shape as balances
+        priority: Rank of each loan for extra payments (lowest first)
+        extra_payments: Monthly extra payment per portfolio, broadcastable
+            to the portfolio shape (balances.shape[:-1])
+        max_months: Horizon after which unpaid portfolios are reported as
+            never paid off
+
+    Returns:
+        Tuple of (months_to_payoff, total_interest) arrays with the
+        portfolio shape; both are -1 and 0 where the debt is never paid off
+        within the horizon
+    """
+    balances, aprs, minimums, priority = np.broadcast_arrays(
+        np.asarray(balances, dtype=float), np.asarray(aprs, dtype=float),
+        np.asarray(minimums, dtype=float), np.asarray(priority)
+    )
+    batch_shape = balances.shape[:-1]
+    n_loans = balances.shape[-1]
+
+    # Reorder every portfolio's loans into its own priority order
+    order = np.argsort(priority, axis=-1, kind='stable')
+    balance = np.take_along_axis(balances, order, axis=-1).reshape(-1, n_loans).copy()
+    rate = np.take_along_axis(aprs, order, axis=-1).reshape(-1, n_loans) / 1200
+    minimum = np.take_along_axis(minimums, order, axis=-1).reshape(-1, n_loans)
+    extra = np.broadcast_to(np.asarray(extra_payments, dtype=float), batch_shape).reshape(-1)
+
+    budget = minimum.sum(axis=-1) + extra
+    months = np.where(balance.sum(axis=-1) > 0, -1, 0)
+    total_interest = np.zeros(balance.shape[0])
+
+    # Only portfolios with debt left are simulated; finished ones drop out
+    active = np.flatnonzero(months < 0)
+    balance, rate, minimum, budget = balance[active], rate[active], minimum[active], budget[active]
+    interest_paid = np.zeros(active.size)
+
+    for month in range(1, max_months + 1):
+        if not active.size:
+            break
+
+        interest = balance * rate
+        balance += interest
+        monthly_interest = interest.sum(axis=-1)
+        interest_paid += monthly_interest
+
+        # Minimum payments first, then the remaining budget in priority order
+        paid = np.minimum(balance, minimum)
+        leftover = np.maximum(budget - paid.sum(axis=-1), 0)
+        owed = balance - paid
+        owed_before = np.cumsum(owed, axis=-1) - owed
+        paid += np.clip(leftover[:, None] - owed_before, 0, owed)
+        balance -= paid
+
+        done = balance.sum(axis=-1) <= 0.01
+        months[active[done]] = month
+        total_interest[active[done]] = interest_paid[done]
+
+        # A portfolio whose payments don't cover its interest never pays off
+        stuck = ~done & (paid.sum(axis=-1) <= monthly_interest)
+        finished = done | stuck
+        if finished.any():
+            keep = ~finished
+            active, balance, rate, minimum, budget, interest_paid = (
+                active[keep], balance[keep], rate[keep], minimum[keep], budget[keep], interest_paid[keep]
+            )
+
+    return months.reshape(batch_shape), np.round(total_interest, 2).reshape(batch_shape)
+
+
+def strategy_priorities(loans: list, custom_order: list = None) -> dict:
+    """
+    Rank the loans for each payoff strategy.
+
+    Avalanche pays the highest APR first, snowball the smallest balance
+    first, and custom follows ``custom_order`` (loan indexes, highest
+    priority first), defaulting to the order the loans were entered.
+    """
+    aprs = np.array([loan['apr'] for loan in loans])
+    balances = np.array([loan['balance'] for loan in loans])
+
+    custom = np.arange(len(loans))
+    if custom_order is not None:
+        if sorted(custom_order) != list(range(len(loans))):
+            raise ValueError('custom_order must list every loan index exactly once')
+        custom = np.empty(len(loans), dtype=int)
+        custom[list(custom_order)] = np.arange(len(loans))
+
+    return {
+        'avalanche': np.argsort(np.argsort(-aprs, kind='stable'), kind='stable'),
+        'snowball': np.argsort(np.argsort(balances, kind='stable'), kind='stable'),
+        'custom': custom
+    }
+
+
+def compare_strategies(loans: list, extra_payments=DEFAULT_EXTRA_PAYMENTS, custom_order: list = None) -> dict:
+    """
+    Compare every payoff strategy at every extra-payment level.
+
+    Args:
+        loans: Validated loans (see validate_loans)
+        extra_payments: Monthly extra payment levels to evaluate
+        custom_order: Loan indexes for the custom strategy, highest priority first
+
+    Returns:
+        Dictionary with the evaluated ``extra_payments`` and, per strategy,
+        lists of ``months_to_payoff`` and ``total_interest`` aligned with
+        them; both are None where the debt is never paid off
+    """
+    extra_payments = [float(extra) for extra in extra_payments]
+    if not loans:
+        return {
+            'extra_payments': extra_payments,
+            **{strategy: {'months_to_payoff': [0] * len(extra_payments),
+                          'total_interest': [0.0] * len(extra_payments)}
+               for strategy in STRATEGIES}
+        }
+
+    priorities = strategy_priorities(loans, custom_order)
+    # Every (strategy, extra level) pair is one portfolio in the batch
+    shape = (len(STRATEGIES), len(extra_payments), len(loans))
+    priority = np.broadcast_to(np.stack([priorities[strategy] for strategy in STRATEGIES])[:, None, :], shape)
+
+    months, interest = simulate_payoff(
+        np.broadcast_to([loan['balance'] for loan in loans], shape),
+        [loan['apr'] for loan in loans],
+        [loan['minimum_payment'] for loan in loans],
+        priority,
+        np.array(extra_payments)[None, :]
+    )
+
+    result = {'extra_payments': extra_payments}
+    for index, strategy in enumerate(STRATEGIES):
+        result[strategy] = {
+            'months_to_payoff': [int(m) if m >= 0 else None for m in months[index]],
+            'total_interest': [float(i) if m >= 0 else None for m, i in zip(months[index], interest[index])]
+        }
+    return result
+
+
+def summarize_strategies(comparison: dict, compact: bool = False) -> str:
+    """
+    Describe a strategy comparison in a few lines for the analysis prompt.
+
+    With ``compact`` each extra-payment level is one ``extra:months/interest``
+    pair per strategy, with ``never`` for debt that is never paid off.
+    """
+    if compact:
+        def encode(strategy, position):
+            months = comparison[strategy]['months_to_payoff'][position]
+            if months is None:
+                return "never"
+            return f"{months}/{comparison[strategy]['total_interest'][position]:.0f}"
+
+        levels = " ".join(
+            f"{extra:.0f}:{encode('avalanche', position)},{encode('snowball', position)}"
+            for position, extra in enumerate(comparison['extra_payments'])
+        )
+        return f"payoff(extra/mo:avalanche,snowball months/interest): {levels}"
+
+    def describe(strategy, position):
+        months = comparison[strategy]['months_to_payoff'][position]
+        if months is None:
+            return f"{strategy} never pays off"
+        return f"{strategy} {months} months, ${comparison[strategy]['total_interest'][position]:,.0f} total interest"
+
+    lines = ["Debt payoff comparison (fixed monthly budget of minimums plus extra):"]
+    for position, extra in enumerate(comparison['extra_payments']):
+        lines.append(f"- ${extra:,.0f}/month extra: {describe('avalanche', position)}; {describe('snowball', position)}")
+    return "\n".join(lines)
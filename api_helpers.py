@@ -0,0 +1,270 @@
+"""
+Shared Request Handling for the Financial Analyzer Web Servers
+Validation and response building used by both the Flask and ASGI entry points,
+so the two servers accept the same input and return the same response shapes.
+"""
+
+import email.utils
+import hashlib
+import os
+from amortization import validate_loans, compare_strategies
+from archetypes import provisional_analysis
+from chat import build_chat_context
+from financial_analyzer import split_summary
+from projections import projection_for
+from result_cache import analyzer_cache_key
+
+# Longest follow-up chat message accepted, in characters
+MAX_CHAT_MESSAGE_LENGTH = 4000
+
+REQUIRED_FIELDS = [
+    'annual_income',
+    'total_savings',
+    'total_loans',
+    'monthly_expenses',
+    'investment_amount'
+]
+
+
+def parse_financial_data(data: dict) -> dict:
+    """
+    Validate an /api/analyze payload and convert it to financial data.
+    
+    Raises:
+        ValueError: With a client-facing message if the payload is invalid
+    """
+    if not isinstance(data, dict):
+        raise ValueError('Request body must be a JSON object')
+    
+    # Itemized loans replace the total_loans scalar, which is derived from them
+    loans = validate_loans(data['loans']) if data.get('loans') else None
+    if loans is not None:
+        data = dict(data, total_loans=sum(loan['balance'] for loan in loans))
+    
+    # Validate required fields
+    for field in REQUIRED_FIELDS:
+        if field not in data:
+            raise ValueError(f'Missing field: {field}')
+    
+    # Convert string values to float
+    try:
+        financial_data = {field: float(data[field]) for field in REQUIRED_FIELDS}
+    except (TypeError, ValueError) as e:
+        raise ValueError(f'Invalid number format: {str(e)}')
+    
+    # Validate non-negative values
+    for key, value in financial_data.items():
+        if value < 0:
+            raise ValueError(f'{key} must be non-negative')
+    
+    if loans is not None:
+        financial_data['loans'] = loans
+    
+    return financial_data
+
+
+def parse_quick_assessment_data(data: dict) -> dict:
+    """
+    Convert an /api/quick-assessment payload to financial data.
+    
+    Raises:
+        ValueError: With a client-facing message if the payload is invalid
+    """
+    try:
+        return {field: float(data[field]) for field in REQUIRED_FIELDS}
+    except (TypeError, ValueError, KeyError) as e:
+        raise ValueError(f'Invalid input: {str(e)}')
+
+
+def build_analysis_response(financial_data: dict, analysis: dict, projections: bool = True) -> dict:
+    """
+    Build the /api/analyze response body from an analyzer result.
+
+    With ``projections`` false, the projection and debt payoff comparison
+    are left out rather than computed when the result lacks them.
+    """
+    # Calculate additional metrics
+    monthly_income = financial_data['annual_income'] / 12
+    monthly_surplus = monthly_income - financial_data['monthly_expenses']
+    debt_to_savings = (
+        financial_data['total_loans'] / financial_data['total_savings']
+        if financial_data['total_savings'] > 0
+        else float('inf')
+    )
+    
+    response = {
+        'success': True,
+        'analysis': {
+            'initial_analysis': analysis['initial_analysis'],
+            'detailed_metrics': analysis['detailed_metrics'],
+            'risk_score': analysis['risk_score'],
+            'risk_level': analysis['risk_level'],
+            'risk_factors': analysis['risk_factors'],
+            'gain_opportunities': analysis['gain_opportunities'],
+            'recommendations': analysis['recommendations']
+        },
+        'metrics': {
+            'monthly_income': round(monthly_income, 2),
+            'monthly_surplus': round(monthly_surplus, 2),
+            'debt_to_savings_ratio': round(debt_to_savings, 2) if debt_to_savings != float('inf') else 'Infinity',
+            'savings_rate': round((monthly_surplus / monthly_income * 100) if monthly_income > 0 else 0, 2)
+        },
+        'input_data': financial_data
+    }
+    
+    if not projections:
+        return response
+    response['projections'] = analysis.get('projections') or projection_for(financial_data)
+    if financial_data.get('loans'):
+        response['debt_payoff'] = analysis.get('debt_payoff') or compare_strategies(financial_data['loans'])
+    
+    return response
+
+
+def build_provisional_response(financial_data: dict, match: dict) -> dict:
+    """
+    Build a provisional /api/analyze response from a similar profile's risk
+    score, found with ArchetypeIndex.nearest.
+
+    Only the risk score and level come from the similar profile; everything
+    else is computed from the request's own inputs. Projections are left out
+    to keep the answer instant; the full analysis carries them.
+    """
+    response = build_analysis_response(financial_data, provisional_analysis(financial_data, match), projections=False)
+    response['provisional'] = True
+    response['archetype_distance'] = round(match['distance'], 3)
+    return response
+
+
+def cached_result(cache, kind: str, analyzer, financial_data: dict, compute, cancel_token=None):
+    """
+    Return ``compute()``, or the shared cache's result for the same analyzer
+    and profile when a ResultCache is configured.
+    """
+    if cache is None:
+        return compute()
+    return cache.get_or_compute(analyzer_cache_key(kind, analyzer, financial_data), compute, cancel_token)
+
+
+async def cached_result_async(cache, kind: str, analyzer, financial_data: dict, compute, cancel_token=None):
+    """Asynchronous version of ``cached_result``; ``compute`` is a coroutine function."""
+    if cache is None:
+        return await compute()
+    return await cache.get_or_compute_async(analyzer_cache_key(kind, analyzer, financial_data), compute, cancel_token)
+
+
+def start_chat_session(store, financial_data: dict, analysis: dict) -> str:
+    """Open a follow-up chat session for a finished analysis and return its ID."""
+    _, summary = split_summary(analysis['initial_analysis'])
+    return store.create(build_chat_context(financial_data, analysis, summary))
+
+
+def parse_chat_message(data) -> str:
+    """
+    Extract the message from an /api/chat/<session_id> payload.
+    
+    Raises:
+        ValueError: With a client-facing message if the payload is invalid
+    """
+    if not data or 'message' not in data:
+        raise ValueError('Missing field: message')
+    message = data['message']
+    if not isinstance(message, str) or not message.strip():
+        raise ValueError('message must be a non-empty string')
+    if len(message) > MAX_CHAT_MESSAGE_LENGTH:
+        raise ValueError(f'message must be at most {MAX_CHAT_MESSAGE_LENGTH} characters')
+    return message.strip()
+
+
+def _key_digest(api_key: str) -> str:
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:32]
+
+
+def issued_api_key_digests() -> set:
+    """Digests of the client API keys listed in RATE_LIMIT_API_KEYS (comma-separated)."""
+    return {_key_digest(key.strip()) for key in os.getenv('RATE_LIMIT_API_KEYS', '').split(',') if key.strip()}
+
+
+def client_id_for(headers, remote_addr: str) -> str:
+    """
+    Identify the client for rate limiting: its API key if it is one of the
+    issued keys, else its IP address.
+
+    Unrecognized keys are ignored, so a caller can't get a fresh quota by
+    sending a new key with each request.
+    """
+    api_key = headers.get('X-API-Key')
+    if api_key:
+        digest = _key_digest(api_key)
+        if digest in issued_api_key_digests():
+            return f'key:{digest}'
+    return f'ip:{remote_addr}'
+
+
+def rate_limited_body(error) -> dict:
+    """Build the 429 response body for a RateLimitExceeded error."""
+    return {
+        'error': 'Rate limit exceeded',
+        'message': str(error),
+        'retry_after': int(error.retry_after_header)
+    }
+
+
+def server_busy_body(error) -> dict:
+    """Build the 503 response body for a SchedulerBusy error."""
+    return {
+        'error': 'Server busy',
+        'message': str(error),
+        'retry_after': int(error.retry_after_header)
+    }
+
+
+def etag_for(body: bytes) -> str:
+    """
+    A weak ETag for a response body.
+    
+    Weak, because the same entity is also served gzip- or Brotli-encoded.
+    """
+    return f'W/"{hashlib.sha256(body).hexdigest()[:32]}"'
+
+
+def file_validators(path: str) -> tuple:
+    """Return (ETag, modification time) for a file, from its size and mtime alone."""
+    stat = os.stat(path)
+    return f'W/"{stat.st_mtime_ns:x}-{stat.st_size:x}"', stat.st_mtime
+
+
+def job_last_modified(job: dict) -> float:
+    """When a job's state last changed."""
+    return job['finished_at'] or job['started_at'] or job['created_at']
+
+
+def http_date(timestamp: float) -> str:
+    """Format a Unix timestamp as an HTTP date."""
+    return email.utils.formatdate(timestamp, usegmt=True)
+
+
+def is_not_modified(headers, etag: str, last_modified: float = None) -> bool:
+    """
+    Whether a GET request's conditional headers match the current response,
+    so a 304 Not Modified can be sent instead.
+    
+    If-None-Match takes precedence over If-Modified-Since, and ETags are
+    compared weakly, as RFC 9110 specifies for GET.
+    """
+    if_none_match = headers.get('If-None-Match')
+    if if_none_match is not None:
+        if if_none_match.strip() == '*':
+            return True
+        opaque = etag.removeprefix('W/')
+        return any(tag.strip().removeprefix('W/') == opaque for tag in if_none_match.split(','))
+    
+    if_modified_since = headers.get('If-Modified-Since')
+    if if_modified_since and last_modified is not None:
+        try:
+            since = email.utils.parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        # HTTP dates have one-second resolution
+        return int(last_modified) <= since
+    return False
@@ -3,9 +3,29 @@ Flask Web Server for Financial Analyzer
 Provides a web interface for users to input financial data and get AI-powered analysis.
 """
 
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, url_for, g
 from flask_cors import CORS
 from financial_analyzer import FinancialAnalyzer
+from jobs import JobQueue, QueueFullError, validate_callback_url
+from chat import ChatSessionStore, SessionBusyError
+from cancellation import AnalysisCancelled, SupersedingRegistry
+from tracing import Tracer, span
+from archetypes import ArchetypeIndex
+from health import UpstreamMonitor, ReadinessPolicy
+from result_cache import ResultCache
+from batching import MicroBatcher
+from scheduler import PriorityScheduler, SchedulerBusy, QUICK, CHAT, ANALYSIS
+from compression import COMPRESS_MIN_BYTES, is_compressible, compress_body
+from api_helpers import (
+    parse_financial_data, parse_quick_assessment_data, build_analysis_response,
+    build_provisional_response, cached_result, client_id_for, rate_limited_body, server_busy_body, start_chat_session, parse_chat_message,
+    etag_for, file_validators, job_last_modified, http_date, is_not_modified
+)
+from rate_limit import (
+    RateLimiter, RateLimitExceeded, ANALYSIS_TOKEN_ESTIMATE, COMPACT_ANALYSIS_TOKEN_ESTIMATE,
+    QUICK_ASSESSMENT_TOKEN_ESTIMATE, CHAT_TOKEN_ESTIMATE
+)
+import time
 import os
 import traceback
 from dotenv import load_dotenv
@@ -15,31 +35,203 @@ load_dotenv()
 
 # Initialize Flask app
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=['Server-Timing'])
 
 # Check if API key exists
 if not os.getenv('ANTHROPIC_API_KEY'):
     print("WARNING: ANTHROPIC_API_KEY not set in .env file")
 
+# Rolling latency and error statistics of upstream calls, reported by
+# /api/health and judged against READY_* thresholds by /api/ready
+upstream_monitor = UpstreamMonitor()
+readiness_policy = ReadinessPolicy.from_env()
+
 # Initialize analyzer
 try:
-    analyzer = FinancialAnalyzer()
+    analyzer = FinancialAnalyzer(monitor=upstream_monitor)
 except Exception as e:
     print(f"Warning: Could not initialize analyzer: {e}")
     analyzer = None
 
+# Tokens booked with the rate limiter per analysis, lower in compact prompt mode
+analysis_token_estimate = (
+    COMPACT_ANALYSIS_TOKEN_ESTIMATE if analyzer is not None and analyzer.compact else ANALYSIS_TOKEN_ESTIMATE
+)
+
+# Background worker pool for asynchronous analyses
+job_queue = JobQueue(
+    max_workers=int(os.getenv('JOB_WORKERS', '4')),
+    max_pending=int(os.getenv('JOB_MAX_PENDING', '32'))
+)
+
+# Admission control in front of the analyzer
+rate_limiter = RateLimiter.from_env()
+
+# Slots for analyzer calls; when all are busy, quick assessments are served
+# ahead of chat turns and full analyses, and stale queued requests are dropped
+scheduler = PriorityScheduler.from_env()
+
+# Risk scores of recent analyses by profile, for instant provisional
+# answers to similar profiles
+archetype_index = ArchetypeIndex.from_env()
+
+# Finished analyses and quick assessments shared with other worker processes
+# and the Streamlit app, if RESULT_CACHE_PATH is set
+result_cache = ResultCache.from_env()
+
+
+def assess_quick_batch(profiles: list) -> list:
+    """Assess a batch of quick-assessment profiles with one analyzer call."""
+    with scheduler.slot(QUICK):
+        return analyzer.get_risk_assessments(profiles)
+
+
+# Concurrent quick assessments, sent to the analyzer together in one call
+quick_batcher = MicroBatcher.from_env(assess_quick_batch)
+
+# Follow-up chat sessions opened by finished analyses
+chat_store = ChatSessionStore.from_env()
+
+# Running analyses by (client, X-Supersede-Key), so a newer submission from
+# the same browser tab cancels the one it replaces
+active_analyses = SupersedingRegistry()
+
+# Per-request stage timings, sent as Server-Timing headers and exported
+# according to TRACE_EXPORT and TRACE_SAMPLE_RATE
+tracer = Tracer.from_env()
+
+
+@app.before_request
+def start_trace():
+    """Trace each request so its stages can be timed."""
+    g.trace = tracer.start(f"{request.method} {request.path}")
+
+
+@app.after_request
+def add_server_timing(response):
+    """Report the request's stage timings in a Server-Timing header."""
+    trace = g.get('trace')
+    if trace is not None:
+        response.headers['Server-Timing'] = trace.server_timing()
+        trace.attributes['status'] = response.status_code
+    return response
+
+
+@app.after_request
+def compress_response(response):
+    """Compress large text responses with the encoding the client prefers."""
+    if (request.method == 'HEAD' or response.direct_passthrough or response.is_streamed or
+            not is_compressible(response.status_code, response.content_type, response.content_encoding)):
+        return response
+    
+    body = response.get_data()
+    if len(body) < COMPRESS_MIN_BYTES:
+        return response
+    
+    with span('compress'):
+        body, encoding = compress_body(body, request.headers.get('Accept-Encoding'))
+    response.vary.add('Accept-Encoding')
+    if encoding is not None:
+        response.set_data(body)
+        response.content_encoding = encoding
+    return response
+
+
+@app.teardown_request
+def finish_trace(error=None):
+    """Finish and export the request's trace."""
+    trace = g.pop('trace', None)
+    if trace is not None:
+        tracer.finish(trace)
+
+
+def rate_limited(error: RateLimitExceeded):
+    """Build a 429 response for a request the rate limiter rejected."""
+    return jsonify(rate_limited_body(error)), 429, {'Retry-After': error.retry_after_header}
+
+
+def server_busy(error: SchedulerBusy):
+    """Build a 503 response for a request the scheduler dropped."""
+    return jsonify(server_busy_body(error)), 503, {'Retry-After': error.retry_after_header}
+
 
 @app.route('/')
 def index():
-    """Serve the main page."""
-    return render_template('index.html')
+    """Serve the main page, or a 304 if the browser's copy is current."""
+    etag, last_modified = file_validators(os.path.join(app.root_path, 'templates', 'index.html'))
+    headers = {'ETag': etag, 'Last-Modified': http_date(last_modified), 'Cache-Control': 'no-cache'}
+    if is_not_modified(request.headers, etag, last_modified):
+        return '', 304, headers
+    
+    return render_template('index.html'), 200, headers
+
+
+def analysis_cancelled():
+    """Response for an analysis cancelled by its client or superseded by a newer one."""
+    return jsonify({
+        'error': 'Analysis cancelled',
+        'message': 'The analysis was cancelled or superseded by a newer request'
+    }), 409
+
+
+def supersede_key(client_id: str, key: str):
+    """Registry key for a client's X-Supersede-Key, or None if it sent none."""
+    return (client_id, key) if key else None
+
+
+def run_analysis(financial_data: dict, start_delay: float = 0, client_id: str = None,
+                 cancel_token=None) -> dict:
+    """
+    Run the full analysis and build the /api/analyze response body.
+    
+    Args:
+        financial_data: Validated financial inputs
+        start_delay: Seconds to wait first, as booked with the rate limiter
+        client_id: Client whose rate limiter reservation to release
+        cancel_token: Optional CancelToken that stops the analysis
+    
+    Raises:
+        AnalysisCancelled: If ``cancel_token`` was cancelled
+        SchedulerBusy: If no analyzer slot freed up in time
+    """
+    if start_delay > 0:
+        try:
+            if cancel_token is not None:
+                cancel_token.wait(start_delay)
+            else:
+                time.sleep(start_delay)
+        finally:
+            rate_limiter.release(client_id)
+    
+    def compute():
+        with scheduler.slot(ANALYSIS, cancel_token):
+            return analyzer.analyze_financial_situation(financial_data, cancel_token=cancel_token)
+    
+    analysis = cached_result(result_cache, 'analysis', analyzer, financial_data, compute, cancel_token)
+    archetype_index.add(financial_data, analysis)
+    with span('response'):
+        response = build_analysis_response(financial_data, analysis)
+        response['session_id'] = start_chat_session(chat_store, financial_data, analysis)
+    return response
+
+
+def provisional_response(financial_data: dict):
+    """A provisional answer from the closest analyzed profile, or None if none is close."""
+    with span('archetype'):
+        matches = archetype_index.nearest(financial_data)
+    if not matches:
+        return None
+    with span('response'):
+        return build_provisional_response(financial_data, matches[0])
 
 
 @app.route('/api/analyze', methods=['POST'])
 def analyze():
     """
     Analyze financial data and return AI-powered insights.
-    Expects JSON with financial data.
+    Expects JSON with financial data. Set "async": true to enqueue the
+    analysis and get a 202 with a job ID to poll at /api/jobs/<job_id>,
+    optionally with a "callback_url" that receives the finished job.
     """
     try:
         # Validate API key
@@ -55,38 +247,18 @@ def analyze():
         if not data:
             return jsonify({'error': 'No data provided'}), 400
         
-        # Validate required fields
-        required_fields = [
-            'annual_income',
-            'total_savings',
-            'total_loans',
-            'monthly_expenses',
-            'investment_amount'
-        ]
-        
-        for field in required_fields:
-            if field not in data:
-                return jsonify({'error': f'Missing field: {field}'}), 400
-        
-        # Convert string values to float
         try:
-            financial_data = {
-                'annual_income': float(data['annual_income']),
-                'total_savings': float(data['total_savings']),
-                'total_loans': float(data['total_loans']),
-                'monthly_expenses': float(data['monthly_expenses']),
-                'investment_amount': float(data['investment_amount'])
-            }
+            with span('validate'):
+                financial_data = parse_financial_data(data)
         except ValueError as e:
-            return jsonify({'error': f'Invalid number format: {str(e)}'}), 400
+            return jsonify({'error': str(e)}), 400
         
-        # Validate non-negative values
-        for key, value in financial_data.items():
-            if value < 0:
-                return jsonify({'error': f'{key} must be non-negative'}), 400
-        
-        # Perform analysis
-        print(f"Analyzing financial data: {financial_data}")
+        callback_url = data.get('callback_url')
+        if callback_url is not None:
+            try:
+                validate_callback_url(callback_url)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
         
         # Initialize analyzer if not done
         if analyzer is None:
@@ -95,32 +267,62 @@ def analyze():
                 'message': 'Check API key and try again'
             }), 500
         
-        analysis = analyzer.analyze_financial_situation(financial_data)
+        client_id = client_id_for(request.headers, request.remote_addr)
         
-        # Calculate additional metrics
-        monthly_income = financial_data['annual_income'] / 12
-        monthly_surplus = monthly_income - financial_data['monthly_expenses']
-        debt_to_savings = (
-            financial_data['total_loans'] / financial_data['total_savings']
-            if financial_data['total_savings'] > 0
-            else float('inf')
-        )
+        if data.get('async'):
+            # Book rate limiter capacity now; the job waits out any delay so
+            # this request returns immediately
+            try:
+                wait = rate_limiter.reserve(client_id, analysis_token_estimate)
+            except RateLimitExceeded as e:
+                return rate_limited(e)
+            
+            try:
+                job_id = job_queue.submit(
+                    run_analysis, financial_data, start_delay=wait, client_id=client_id,
+                    callback_url=callback_url, cancellable=True
+                )
+            except QueueFullError as e:
+                if wait > 0:
+                    rate_limiter.release(client_id)
+                return jsonify({'error': 'Server busy', 'message': str(e)}), 503
+            
+            status_url = url_for('get_job', job_id=job_id)
+            body = {
+                'success': True,
+                'job_id': job_id,
+                'status': 'queued',
+                'status_url': status_url
+            }
+            # Answer at once from the closest analyzed profile, if any
+            provisional = provisional_response(financial_data)
+            if provisional is not None:
+                body['provisional'] = provisional
+            return jsonify(body), 202, {'Location': status_url}
         
-        return jsonify({
-            'success': True,
-            'analysis': {
-                'initial_analysis': analysis['initial_analysis'],
-                'detailed_metrics': analysis['detailed_metrics'],
-                'recommendations': analysis['recommendations']
-            },
-            'metrics': {
-                'monthly_income': round(monthly_income, 2),
-                'monthly_surplus': round(monthly_surplus, 2),
-                'debt_to_savings_ratio': round(debt_to_savings, 2) if debt_to_savings != float('inf') else 'Infinity',
-                'savings_rate': round((monthly_surplus / monthly_income * 100) if monthly_income > 0 else 0, 2)
-            },
-            'input_data': financial_data
-        }), 200
+        try:
+            with span('rate_limit'):
+                rate_limiter.acquire(client_id, analysis_token_estimate)
+        except RateLimitExceeded as e:
+            return rate_limited(e)
+        
+        # Perform analysis
+        print(f"Analyzing financial data: {financial_data}")
+        
+        key = supersede_key(client_id, request.headers.get('X-Supersede-Key'))
+        cancel_token = active_analyses.start(key) if key else None
+        try:
+            result = run_analysis(financial_data, cancel_token=cancel_token)
+        except AnalysisCancelled:
+            return analysis_cancelled()
+        except SchedulerBusy as e:
+            return server_busy(e)
+        finally:
+            if key:
+                active_analyses.finish(key, cancel_token)
+        
+        with span('serialize'):
+            return jsonify(result), 200
         
     except Exception as e:
         print(f"Error during analysis: {str(e)}")
@@ -131,6 +333,143 @@ def analyze():
         }), 500
 
 
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Get the status, and once finished the result, of an analysis job."""
+    job = job_queue.get(job_id)
+    
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    # Pollers revalidate with If-None-Match and get a 304 until the job changes
+    response = jsonify(job)
+    etag, last_modified = etag_for(response.get_data()), job_last_modified(job)
+    headers = {'ETag': etag, 'Last-Modified': http_date(last_modified), 'Cache-Control': 'private, no-cache'}
+    if is_not_modified(request.headers, etag, last_modified):
+        return '', 304, headers
+    
+    response.headers.update(headers)
+    return response, 200
+
+
+@app.route('/api/analyze/cancel', methods=['POST'])
+def cancel_analysis():
+    """
+    Cancel the client's running analysis for an X-Supersede-Key, given in
+    that header or as "supersede_key" in the JSON body (for sendBeacon).
+    """
+    data = request.get_json(silent=True, force=True)
+    if not isinstance(data, dict):
+        data = {}
+    key = supersede_key(
+        client_id_for(request.headers, request.remote_addr),
+        request.headers.get('X-Supersede-Key') or data.get('supersede_key')
+    )
+    if key is None:
+        return jsonify({'error': 'Missing field: supersede_key'}), 400
+    
+    return jsonify({'success': True, 'cancelled': active_analyses.cancel(key)}), 200
+
+
+@app.route('/api/analyze/provisional', methods=['POST'])
+def provisional_analysis():
+    """
+    Answer at once from the closest analyzed profile while the full analysis
+    runs, or 204 if no analyzed profile is close enough.
+    """
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({'error': 'No data provided'}), 400
+    
+    try:
+        with span('validate'):
+            financial_data = parse_financial_data(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    provisional = provisional_response(financial_data)
+    if provisional is None:
+        return '', 204
+    return jsonify(provisional), 200
+
+
+@app.route('/api/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    """Cancel a queued or running analysis job."""
+    job = job_queue.cancel(job_id)
+    
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    return jsonify(job), 200
+
+
+@app.route('/api/chat/<session_id>', methods=['POST'])
+def chat(session_id):
+    """
+    Answer a follow-up question about an analysis.
+    Expects JSON with a "message"; the session ID comes from the analysis response.
+    """
+    try:
+        try:
+            with span('validate'):
+                message = parse_chat_message(request.get_json(silent=True))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        if analyzer is None:
+            return jsonify({'error': 'Analyzer not initialized'}), 500
+        
+        try:
+            session = chat_store.checkout(session_id)
+        except SessionBusyError as e:
+            return jsonify({'error': 'Session busy', 'message': str(e)}), 409
+        
+        if session is None:
+            return jsonify({'error': 'Session not found'}), 404
+        
+        checked_in = False
+        try:
+            try:
+                with span('rate_limit'):
+                    rate_limiter.acquire(client_id_for(request.headers, request.remote_addr), CHAT_TOKEN_ESTIMATE)
+            except RateLimitExceeded as e:
+                return rate_limited(e)
+            
+            try:
+                with scheduler.slot(CHAT):
+                    result = analyzer.chat(session['context'], session['summary'], session['messages'], message)
+            except SchedulerBusy as e:
+                return server_busy(e)
+            turns = chat_store.checkin(session_id, result['summary'], result['messages'])
+            checked_in = True
+        finally:
+            if not checked_in:
+                chat_store.release(session_id)
+        
+        with span('serialize'):
+            return jsonify({
+                'success': True,
+                'session_id': session_id,
+                'reply': result['reply'],
+                'turns': turns
+            }), 200
+        
+    except Exception as e:
+        print(f"Error in chat: {str(e)}")
+        print(traceback.format_exc())
+        return jsonify({'error': 'Chat failed', 'message': str(e)}), 500
+
+
+@app.route('/api/chat/<session_id>', methods=['DELETE'])
+def end_chat(session_id):
+    """End a chat session and discard its history."""
+    if not chat_store.delete(session_id):
+        return jsonify({'error': 'Session not found'}), 404
+    
+    return jsonify({'success': True}), 200
+
+
 @app.route('/api/quick-assessment', methods=['POST'])
 def quick_assessment():
     """Get a quick risk assessment without full analysis."""
@@ -143,22 +482,27 @@ def quick_assessment():
         
         data = request.get_json()
         
-        # Convert to float
         try:
-            financial_data = {
-                'annual_income': float(data['annual_income']),
-                'total_savings': float(data['total_savings']),
-                'total_loans': float(data['total_loans']),
-                'monthly_expenses': float(data['monthly_expenses']),
-                'investment_amount': float(data['investment_amount'])
-            }
-        except (ValueError, KeyError) as e:
-            return jsonify({'error': f'Invalid input: {str(e)}'}), 400
+            with span('validate'):
+                financial_data = parse_quick_assessment_data(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
         if analyzer is None:
             return jsonify({'error': 'Analyzer not initialized'}), 500
         
-        assessment = analyzer.get_risk_assessment(financial_data)
+        try:
+            with span('rate_limit'):
+                rate_limiter.acquire(client_id_for(request.headers, request.remote_addr), QUICK_ASSESSMENT_TOKEN_ESTIMATE,
+                                     priority=True)
+        except RateLimitExceeded as e:
+            return rate_limited(e)
+        
+        try:
+            assessment = cached_result(result_cache, 'quick_assessment', analyzer, financial_data,
+                                       lambda: quick_batcher.submit(financial_data))
+        except SchedulerBusy as e:
+            return server_busy(e)
         
         return jsonify({
             'success': True,
@@ -170,16 +514,46 @@ def quick_assessment():
         return jsonify({'error': str(e)}), 500
 
 
+def readiness_reasons(upstream: dict, queues: dict) -> list:
+    """Why this instance should not take more traffic, or an empty list if it can."""
+    reasons = readiness_policy.reasons(upstream, queues['scheduler'])
+    if analyzer is None:
+        reasons.append('analyzer not initialized')
+    if queues['jobs']['queued'] + queues['jobs']['running'] >= job_queue.max_pending:
+        reasons.append('job queue is full')
+    return reasons
+
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
-    """Check if the API is running and configured."""
+    """Check if the API is running and configured, and report upstream and queue statistics."""
     api_key_set = bool(os.getenv('ANTHROPIC_API_KEY'))
+    upstream = upstream_monitor.snapshot()
+    queues = {'scheduler': scheduler.stats(), 'rate_limiter': rate_limiter.stats(), 'jobs': job_queue.stats(),
+              'quick_batches': quick_batcher.stats()}
     
     return jsonify({
         'status': 'healthy' if api_key_set else 'warning',
         'api_key_configured': api_key_set,
-        'message': 'Ready' if api_key_set else 'API key not configured'
-    }), 200
+        'message': 'Ready' if api_key_set else 'API key not configured',
+        'ready': not readiness_reasons(upstream, queues),
+        'upstream': upstream,
+        'queues': queues,
+        'cache': {
+            'archetypes': archetype_index.stats(),
+            'results': result_cache.stats() if result_cache is not None else None
+        }
+    }), 200, {'Cache-Control': 'no-store'}
+
+
+@app.route('/api/ready', methods=['GET'])
+def readiness_check():
+    """200 while this instance can take more traffic, 503 with the reasons while it is saturated."""
+    reasons = readiness_reasons(upstream_monitor.snapshot(), {'scheduler': scheduler.stats(), 'jobs': job_queue.stats()})
+    if reasons:
+        return jsonify({'ready': False, 'reasons': reasons}), 503, {'Cache-Control': 'no-store'}
+    
+    return jsonify({'ready': True}), 200, {'Cache-Control': 'no-store'}
 
 
 @app.errorhandler(404)
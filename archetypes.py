@@ -0,0 +1,230 @@
+"""
+Nearest-Archetype Index for Financial Analyzer
+Keeps the risk scores of recently analyzed profiles and, for a new profile,
+finds the closest one so a provisional answer can be shown at once while
+the personalized analysis runs.
+"""
+
+import json
+import os
+import threading
+import time
+import numpy as np
+from risk_scoring import compute_metrics
+
+# Analyzer result fields kept per entry. The written analysis quotes its
+# user's own figures, so only the score and level are kept and shared; the
+# rest of a provisional answer is built from the new profile's inputs.
+ANALYSIS_FIELDS = ('risk_score', 'risk_level')
+
+# General guidance shown with a provisional risk level
+LEVEL_GUIDANCE = {
+    'Low': [
+        "Keep an emergency fund of three to six months of expenses.",
+        "Invest surplus savings in low-cost diversified funds.",
+        "Review insurance and retirement contributions once a year.",
+        "Keep debt payments well below a third of income.",
+        "Set savings goals for large planned expenses."
+    ],
+    'Medium': [
+        "Build the emergency fund towards three to six months of expenses.",
+        "Pay down the highest-interest debt first.",
+        "Track spending for a month and cut the largest discretionary items.",
+        "Automate a fixed transfer to savings each payday.",
+        "Avoid new debt until existing balances are falling."
+    ],
+    'High': [
+        "Make at least the minimum payment on every debt to avoid penalties.",
+        "Direct any spare cash to the highest-interest debt.",
+        "Cut expenses so income covers them with room to spare.",
+        "Build a starter emergency fund of one month of expenses.",
+        "Ask lenders about lower rates or consolidation."
+    ],
+    'Critical': [
+        "List every debt with its rate and minimum payment.",
+        "Contact lenders early about hardship plans.",
+        "Cut all non-essential spending until income covers expenses.",
+        "Consider a nonprofit credit counselor.",
+        "Avoid new borrowing, including payday loans."
+    ]
+}
+
+# Each feature is clipped to a plausible range and divided by the change
+# that makes two profiles read differently (a decade of income, half a
+# year's income of debt, 20 points of savings rate, a quarter's emergency
+# fund, debt equal to liquid assets), so distances weigh features equally
+FEATURE_BOUNDS = np.array([(3.0, 7.0), (0.0, 3.0), (-50.0, 60.0), (0.0, 24.0), (0.0, 5.0)])
+FEATURE_SCALES = np.array([1.0, 0.5, 20.0, 3.0, 1.0])
+
+
+def profile_vector(financial_data: dict) -> np.ndarray:
+    """
+    The normalized feature vector of a profile: log income, debt to income,
+    savings rate, emergency fund months and debt to liquid assets.
+    """
+    metrics = compute_metrics(
+        financial_data['annual_income'], financial_data['total_savings'],
+        financial_data['total_loans'], financial_data['monthly_expenses'],
+        financial_data['investment_amount']
+    )
+    features = np.array([
+        np.log10(max(financial_data['annual_income'], 1.0)),
+        metrics['debt_to_income_ratio'],
+        metrics['savings_rate'],
+        metrics['emergency_fund_months'],
+        metrics['debt_to_assets_ratio']
+    ], dtype=float)
+    return np.clip(features, FEATURE_BOUNDS[:, 0], FEATURE_BOUNDS[:, 1]) / FEATURE_SCALES
+
+
+class ArchetypeIndex:
+    """
+    A bounded k-nearest-neighbor index of analyzed profiles.
+
+    Lookups scan every entry with NumPy, which takes microseconds at the
+    default capacity. A new analysis within ``merge_distance`` of an entry
+    replaces it, so near-duplicates don't crowd out other archetypes; once
+    the index is full, adding evicts the entry least recently added or used.
+    """
+
+    def __init__(self, capacity: int = 500, max_distance: float = 1.0, merge_distance: float = 0.25):
+        """
+        Initialize the index.
+
+        Args:
+            capacity: Most entries kept; 0 disables the index
+            max_distance: Farthest entry returned as a match
+            merge_distance: Distance within which a new analysis replaces an entry
+        """
+        self.capacity = capacity
+        self.max_distance = max_distance
+        self.merge_distance = merge_distance
+        self._vectors = np.empty((0, len(FEATURE_SCALES)))
+        self._entries = []
+        self._lookups = 0
+        self._hits = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """Create an index configured from ARCHETYPE_* environment variables."""
+        return cls(
+            capacity=int(os.getenv('ARCHETYPE_INDEX_CAPACITY', '500')),
+            max_distance=float(os.getenv('ARCHETYPE_MAX_DISTANCE', '1.0'))
+        )
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, financial_data: dict, analysis: dict):
+        """Add a finished analysis of a profile."""
+        if self.capacity <= 0:
+            return
+        vector = profile_vector(financial_data)
+        entry = {
+            'analysis': {field: analysis[field] for field in ANALYSIS_FIELDS},
+            'last_used': time.monotonic()
+        }
+        with self._lock:
+            if self._entries:
+                distances = np.linalg.norm(self._vectors - vector, axis=1)
+                closest = int(np.argmin(distances))
+                if distances[closest] <= self.merge_distance:
+                    self._vectors[closest] = vector
+                    self._entries[closest] = entry
+                    return
+            if len(self._entries) >= self.capacity:
+                stalest = min(range(len(self._entries)), key=lambda i: self._entries[i]['last_used'])
+                self._vectors = np.delete(self._vectors, stalest, axis=0)
+                del self._entries[stalest]
+            self._vectors = np.vstack([self._vectors, vector])
+            self._entries.append(entry)
+
+    def nearest(self, financial_data: dict, k: int = 1) -> list:
+        """
+        Return up to ``k`` entries within ``max_distance``, closest first.
+
+        Each match is a dict with the entry's ``analysis`` fields and its
+        ``distance`` from the profile.
+        """
+        vector = profile_vector(financial_data)
+        with self._lock:
+            self._lookups += 1
+            if not self._entries:
+                return []
+            distances = np.linalg.norm(self._vectors - vector, axis=1)
+            order = np.argsort(distances)[:k]
+            matches = []
+            for i in order:
+                if distances[i] > self.max_distance:
+                    break
+                entry = self._entries[i]
+                entry['last_used'] = time.monotonic()
+                matches.append({'analysis': dict(entry['analysis']), 'distance': float(distances[i])})
+            if matches:
+                self._hits += 1
+            return matches
+
+    def stats(self) -> dict:
+        """Return the entry count, capacity, lookups and the fraction of lookups that matched."""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'capacity': self.capacity,
+                'lookups': self._lookups,
+                'hit_ratio': round(self._hits / self._lookups, 4) if self._lookups else 0.0
+            }
+
+
+def provisional_analysis(financial_data: dict, match: dict) -> dict:
+    """
+    Build an analyzer-style result for a profile from a match's risk score.
+
+    The risk score and level are the matched profile's; the risk factors and
+    opportunities are read from this profile's own metrics, and the
+    recommendations are general guidance for the level.
+    """
+    metrics = {name: float(value) for name, value in compute_metrics(
+        financial_data['annual_income'], financial_data['total_savings'],
+        financial_data['total_loans'], financial_data['monthly_expenses'],
+        financial_data['investment_amount']
+    ).items()}
+    risk_score = match['analysis']['risk_score']
+    risk_level = match['analysis']['risk_level']
+    surplus = metrics['monthly_surplus']
+
+    risk_factors = []
+    if surplus < 0:
+        risk_factors.append(f"Expenses exceed income by ${-surplus:,.0f} a month")
+    if metrics['emergency_fund_months'] < 3:
+        risk_factors.append(f"Savings cover {metrics['emergency_fund_months']:.1f} months of expenses")
+    if metrics['debt_to_income_ratio'] > 0.5:
+        risk_factors.append(f"Debt is {metrics['debt_to_income_ratio']:.0%} of annual income")
+    if 0 <= metrics['savings_rate'] < 10:
+        risk_factors.append(f"Only {metrics['savings_rate']:.0f}% of income is left over each month")
+
+    gain_opportunities = []
+    if surplus > 0 and financial_data['total_loans'] > 0:
+        gain_opportunities.append(f"Put part of the ${surplus:,.0f} monthly surplus towards debt")
+    if metrics['emergency_fund_months'] >= 6:
+        gain_opportunities.append("Invest savings beyond a six-month emergency fund")
+    if surplus > 0:
+        gain_opportunities.append(f"Automate saving or investing the ${surplus:,.0f} monthly surplus")
+
+    detailed = {
+        'risk_score': risk_score,
+        'risk_level': risk_level,
+        'risk_factors': risk_factors[:3],
+        'gain_opportunities': gain_opportunities[:3]
+    }
+    return dict(
+        detailed,
+        initial_analysis=(
+            f"Provisional estimate: profiles like yours score {risk_level.lower()} risk ({risk_score}/100). "
+            f"You have a monthly surplus of ${surplus:,.0f}, a savings rate of {metrics['savings_rate']:.0f}% "
+            f"and savings covering {metrics['emergency_fund_months']:.1f} months of expenses. "
+            "Your personalized analysis is on its way."
+        ),
+        detailed_metrics=json.dumps(detailed, indent=2),
+        recommendations="\n".join(f"{i}. {line}" for i, line in enumerate(LEVEL_GUIDANCE[risk_level], 1))
+    )
@@ -0,0 +1,645 @@
+"""
+ASGI Web Server for Financial Analyzer
+Async-native alternative to app.py: the same routes, validation and response
+shapes, served from one event loop so a single worker can keep thousands of
+analyses in flight while they wait on the Anthropic API.
+
+Run with:
+    uvicorn asgi_app:app --port 8000
+"""
+
+import asyncio
+import contextlib
+import os
+import traceback
+from dotenv import load_dotenv
+from starlette.applications import Starlette
+from starlette.exceptions import HTTPException
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+from starlette.templating import Jinja2Templates
+from financial_analyzer import AsyncFinancialAnalyzer
+from chat import ChatSessionStore, SessionBusyError
+from cancellation import AnalysisCancelled, CancelToken, SupersedingRegistry
+from tracing import Tracer, ServerTimingMiddleware, span
+from archetypes import ArchetypeIndex
+from health import UpstreamMonitor, ReadinessPolicy
+from result_cache import ResultCache
+from batching import AsyncMicroBatcher
+from scheduler import PriorityScheduler, SchedulerBusy, QUICK, CHAT, ANALYSIS
+from compression import CompressionMiddleware
+from jobs import JobQueue, QueueFullError, validate_callback_url
+from api_helpers import (
+    parse_financial_data, parse_quick_assessment_data, build_analysis_response,
+    build_provisional_response, cached_result_async, client_id_for, rate_limited_body, server_busy_body, start_chat_session, parse_chat_message,
+    etag_for, file_validators, job_last_modified, http_date, is_not_modified
+)
+from rate_limit import (
+    RateLimiter, RateLimitExceeded, ANALYSIS_TOKEN_ESTIMATE, COMPACT_ANALYSIS_TOKEN_ESTIMATE,
+    QUICK_ASSESSMENT_TOKEN_ESTIMATE, CHAT_TOKEN_ESTIMATE
+)
+
+# Load environment variables
+load_dotenv()
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+templates = Jinja2Templates(directory=TEMPLATE_DIR)
+
+# Upper bound on concurrent analyses, which bounds the memory held by
+# in-flight conversations; requests beyond it are rejected with 503
+MAX_INFLIGHT = int(os.getenv('ASGI_MAX_INFLIGHT', '2000'))
+inflight = 0
+
+# Background jobs for "async": true analyses. Each job's worker thread waits
+# out its rate limiter delay, then runs the analysis on the event loop.
+job_queue = JobQueue(
+    max_workers=int(os.getenv('JOB_WORKERS', '4')),
+    max_pending=int(os.getenv('JOB_MAX_PENDING', '32'))
+)
+
+# Admission control in front of the analyzer
+rate_limiter = RateLimiter.from_env()
+
+# Slots for analyzer calls; when all are busy, quick assessments are served
+# ahead of chat turns and full analyses, and stale queued requests are dropped
+scheduler = PriorityScheduler.from_env()
+
+# Risk scores of recent analyses by profile, for instant provisional
+# answers to similar profiles
+archetype_index = ArchetypeIndex.from_env()
+
+# Finished analyses and quick assessments shared with other worker processes
+# and the Streamlit app, if RESULT_CACHE_PATH is set
+result_cache = ResultCache.from_env()
+
+
+async def assess_quick_batch(profiles: list) -> list:
+    """Assess a batch of quick-assessment profiles with one analyzer call."""
+    async with scheduler.slot_async(QUICK):
+        return await analyzer.get_risk_assessments(profiles)
+
+
+# Concurrent quick assessments, sent to the analyzer together in one call
+quick_batcher = AsyncMicroBatcher.from_env(assess_quick_batch)
+
+# Follow-up chat sessions opened by finished analyses
+chat_store = ChatSessionStore.from_env()
+
+# Running analyses by (client, X-Supersede-Key), so a newer submission from
+# the same browser tab cancels the one it replaces
+active_analyses = SupersedingRegistry()
+
+# Per-request stage timings, sent as Server-Timing headers and exported
+# according to TRACE_EXPORT and TRACE_SAMPLE_RATE
+tracer = Tracer.from_env()
+
+# Check if API key exists
+if not os.getenv('ANTHROPIC_API_KEY'):
+    print("WARNING: ANTHROPIC_API_KEY not set in .env file")
+
+# Rolling latency and error statistics of upstream calls, reported by
+# /api/health and judged against READY_* thresholds by /api/ready
+upstream_monitor = UpstreamMonitor()
+readiness_policy = ReadinessPolicy.from_env()
+
+# Initialize analyzer
+try:
+    analyzer = AsyncFinancialAnalyzer(monitor=upstream_monitor)
+except Exception as e:
+    print(f"Warning: Could not initialize analyzer: {e}")
+    analyzer = None
+
+# Tokens booked with the rate limiter per analysis, lower in compact prompt mode
+analysis_token_estimate = (
+    COMPACT_ANALYSIS_TOKEN_ESTIMATE if analyzer is not None and analyzer.compact else ANALYSIS_TOKEN_ESTIMATE
+)
+
+
+async def read_json(request):
+    """Return the parsed JSON body, or None if it is missing or malformed."""
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+
+def rate_limited(error: RateLimitExceeded):
+    """Build a 429 response for a request the rate limiter rejected."""
+    return JSONResponse(rate_limited_body(error), status_code=429,
+                        headers={'Retry-After': error.retry_after_header})
+
+
+def client_id(request) -> str:
+    """Identify the client of a request for rate limiting."""
+    return client_id_for(request.headers, request.client.host if request.client else None)
+
+
+def server_busy():
+    """Response for requests over the in-flight limit."""
+    return JSONResponse({
+        'error': 'Server busy',
+        'message': f'{MAX_INFLIGHT} analyses already in flight'
+    }, status_code=503)
+
+
+def scheduler_busy(error: SchedulerBusy):
+    """Build a 503 response for a request the scheduler dropped."""
+    return JSONResponse(server_busy_body(error), status_code=503,
+                        headers={'Retry-After': error.retry_after_header})
+
+
+def analysis_cancelled():
+    """Response for an analysis cancelled by its client or superseded by a newer one."""
+    return JSONResponse({
+        'error': 'Analysis cancelled',
+        'message': 'The analysis was cancelled or superseded by a newer request'
+    }, status_code=409)
+
+
+def supersede_key(request, key: str = None):
+    """Registry key for the request's X-Supersede-Key (or ``key``), or None if there is none."""
+    key = request.headers.get('X-Supersede-Key') or key
+    return (client_id(request), key) if key else None
+
+
+@contextlib.asynccontextmanager
+async def cancel_on_disconnect(request, cancel_token: CancelToken):
+    """Cancel ``cancel_token`` if the client disconnects while the block runs."""
+    async def watch():
+        # The body has been read, so the next message is the disconnect
+        while (await request.receive())['type'] != 'http.disconnect':
+            pass
+        cancel_token.cancel()
+
+    watcher = asyncio.ensure_future(watch())
+    try:
+        yield
+    finally:
+        watcher.cancel()
+
+
+async def index(request):
+    """Serve the main page, or a 304 if the browser's copy is current."""
+    etag, last_modified = file_validators(os.path.join(TEMPLATE_DIR, 'index.html'))
+    headers = {'ETag': etag, 'Last-Modified': http_date(last_modified), 'Cache-Control': 'no-cache'}
+    if is_not_modified(request.headers, etag, last_modified):
+        return Response(status_code=304, headers=headers)
+
+    return templates.TemplateResponse(request, 'index.html', headers=headers)
+
+
+async def run_analysis(financial_data: dict, cancel_token: CancelToken) -> dict:
+    """
+    Run the full analysis and build the /api/analyze response body.
+
+    Raises:
+        AnalysisCancelled: If ``cancel_token`` was cancelled
+        SchedulerBusy: If no analyzer slot freed up in time
+    """
+    async def compute():
+        async with scheduler.slot_async(ANALYSIS, cancel_token):
+            return await analyzer.analyze_financial_situation(financial_data, cancel_token=cancel_token)
+
+    analysis = await cached_result_async(result_cache, 'analysis', analyzer, financial_data, compute, cancel_token)
+    archetype_index.add(financial_data, analysis)
+    with span('response'):
+        # Cached analyses may lack projections; computing them is CPU-bound
+        response = await asyncio.to_thread(build_analysis_response, financial_data, analysis)
+        response['session_id'] = start_chat_session(chat_store, financial_data, analysis)
+    return response
+
+
+def run_analysis_job(loop, financial_data: dict, start_delay: float = 0, client_id: str = None,
+                     cancel_token: CancelToken = None) -> dict:
+    """
+    Run an analysis job from a JobQueue worker thread on the server's event
+    loop ``loop``, after waiting ``start_delay`` seconds as booked with the
+    rate limiter by ``client_id``.
+    """
+    if start_delay > 0:
+        try:
+            cancel_token.wait(start_delay)
+        finally:
+            rate_limiter.release(client_id)
+    return asyncio.run_coroutine_threadsafe(run_analysis(financial_data, cancel_token), loop).result()
+
+
+def provisional_response(financial_data: dict):
+    """A provisional answer from the closest analyzed profile, or None if none is close."""
+    with span('archetype'):
+        matches = archetype_index.nearest(financial_data)
+    if not matches:
+        return None
+    with span('response'):
+        return build_provisional_response(financial_data, matches[0])
+
+
+async def analyze(request):
+    """
+    Analyze financial data and return AI-powered insights.
+    Expects JSON with financial data. Set "async": true to enqueue the
+    analysis and get a 202 with a job ID to poll at /api/jobs/{job_id},
+    optionally with a "callback_url" that receives the finished job.
+    """
+    global inflight
+
+    try:
+        # Validate API key
+        if not os.getenv('ANTHROPIC_API_KEY'):
+            return JSONResponse({
+                'error': 'API key not configured',
+                'message': 'Please set ANTHROPIC_API_KEY in .env file'
+            }, status_code=500)
+
+        # Get financial data from request
+        data = await read_json(request)
+
+        if not data:
+            return JSONResponse({'error': 'No data provided'}, status_code=400)
+
+        try:
+            with span('validate'):
+                financial_data = parse_financial_data(data)
+        except ValueError as e:
+            return JSONResponse({'error': str(e)}, status_code=400)
+
+        callback_url = data.get('callback_url')
+        if callback_url is not None:
+            try:
+                # Resolves the host, so keep it off the event loop
+                await asyncio.to_thread(validate_callback_url, callback_url)
+            except ValueError as e:
+                return JSONResponse({'error': str(e)}, status_code=400)
+
+        if analyzer is None:
+            return JSONResponse({
+                'error': 'Analyzer initialization failed',
+                'message': 'Check API key and try again'
+            }, status_code=500)
+
+        if data.get('async'):
+            # Book rate limiter capacity now; the job waits out any delay so
+            # this request returns immediately
+            try:
+                wait = rate_limiter.reserve(client_id(request), analysis_token_estimate)
+            except RateLimitExceeded as e:
+                return rate_limited(e)
+
+            try:
+                job_id = job_queue.submit(
+                    run_analysis_job, asyncio.get_running_loop(), financial_data, start_delay=wait,
+                    client_id=client_id(request), callback_url=callback_url, cancellable=True
+                )
+            except QueueFullError as e:
+                if wait > 0:
+                    rate_limiter.release(client_id(request))
+                return JSONResponse({'error': 'Server busy', 'message': str(e)}, status_code=503)
+
+            status_url = str(request.app.url_path_for('get_job', job_id=job_id))
+            body = {
+                'success': True,
+                'job_id': job_id,
+                'status': 'queued',
+                'status_url': status_url
+            }
+            # Answer at once from the closest analyzed profile, if any
+            provisional = provisional_response(financial_data)
+            if provisional is not None:
+                body['provisional'] = provisional
+            return JSONResponse(body, status_code=202, headers={'Location': status_url})
+
+        if inflight >= MAX_INFLIGHT:
+            return server_busy()
+
+        # Count the request while it waits for admission, so a burst held
+        # by the rate limiter can't overshoot MAX_INFLIGHT
+        inflight += 1
+        try:
+            try:
+                with span('rate_limit'):
+                    await rate_limiter.acquire_async(client_id(request), analysis_token_estimate)
+            except RateLimitExceeded as e:
+                return rate_limited(e)
+
+            key = supersede_key(request)
+            cancel_token = active_analyses.start(key) if key else CancelToken()
+            try:
+                async with cancel_on_disconnect(request, cancel_token):
+                    response = await run_analysis(financial_data, cancel_token)
+            except AnalysisCancelled:
+                return analysis_cancelled()
+            except SchedulerBusy as e:
+                return scheduler_busy(e)
+            finally:
+                if key:
+                    active_analyses.finish(key, cancel_token)
+        finally:
+            inflight -= 1
+
+        with span('serialize'):
+            return JSONResponse(response)
+
+    except Exception as e:
+        print(f"Error during analysis: {str(e)}")
+        print(traceback.format_exc())
+        return JSONResponse({
+            'error': 'Analysis failed',
+            'message': str(e)
+        }, status_code=500)
+
+
+async def chat(request):
+    """
+    Answer a follow-up question about an analysis.
+    Expects JSON with a "message"; the session ID comes from the analysis response.
+    """
+    global inflight
+    session_id = request.path_params['session_id']
+
+    try:
+        try:
+            with span('validate'):
+                message = parse_chat_message(await read_json(request))
+        except ValueError as e:
+            return JSONResponse({'error': str(e)}, status_code=400)
+
+        if analyzer is None:
+            return JSONResponse({'error': 'Analyzer not initialized'}, status_code=500)
+
+        if inflight >= MAX_INFLIGHT:
+            return server_busy()
+
+        try:
+            session = chat_store.checkout(session_id)
+        except SessionBusyError as e:
+            return JSONResponse({'error': 'Session busy', 'message': str(e)}, status_code=409)
+
+        if session is None:
+            return JSONResponse({'error': 'Session not found'}, status_code=404)
+
+        checked_in = False
+        inflight += 1
+        try:
+            try:
+                with span('rate_limit'):
+                    await rate_limiter.acquire_async(client_id(request), CHAT_TOKEN_ESTIMATE)
+            except RateLimitExceeded as e:
+                return rate_limited(e)
+
+            cancel_token = CancelToken()
+            async with cancel_on_disconnect(request, cancel_token):
+                async with scheduler.slot_async(CHAT, cancel_token):
+                    result = await analyzer.chat(session['context'], session['summary'], session['messages'],
+                                                 message, cancel_token=cancel_token)
+            turns = chat_store.checkin(session_id, result['summary'], result['messages'])
+            checked_in = True
+        except AnalysisCancelled:
+            return analysis_cancelled()
+        except SchedulerBusy as e:
+            return scheduler_busy(e)
+        finally:
+            inflight -= 1
+            if not checked_in:
+                chat_store.release(session_id)
+
+        with span('serialize'):
+            return JSONResponse({
+                'success': True,
+                'session_id': session_id,
+                'reply': result['reply'],
+                'turns': turns
+            })
+
+    except Exception as e:
+        print(f"Error in chat: {str(e)}")
+        print(traceback.format_exc())
+        return JSONResponse({'error': 'Chat failed', 'message': str(e)}, status_code=500)
+
+
+async def cancel_analysis(request):
+    """
+    Cancel the client's running analysis for an X-Supersede-Key, given in
+    that header or as "supersede_key" in the JSON body (for sendBeacon).
+    """
+    data = await read_json(request)
+    if not isinstance(data, dict):
+        data = {}
+    key = supersede_key(request, data.get('supersede_key'))
+    if key is None:
+        return JSONResponse({'error': 'Missing field: supersede_key'}, status_code=400)
+
+    return JSONResponse({'success': True, 'cancelled': active_analyses.cancel(key)})
+
+
+async def provisional_analysis(request):
+    """
+    Answer at once from the closest analyzed profile while the full analysis
+    runs, or 204 if no analyzed profile is close enough.
+    """
+    data = await read_json(request)
+    if not data:
+        return JSONResponse({'error': 'No data provided'}, status_code=400)
+
+    try:
+        with span('validate'):
+            financial_data = parse_financial_data(data)
+    except ValueError as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
+
+    provisional = provisional_response(financial_data)
+    if provisional is None:
+        return Response(status_code=204)
+    return JSONResponse(provisional)
+
+
+async def get_job(request):
+    """Get the status, and once finished the result, of an analysis job."""
+    job = job_queue.get(request.path_params['job_id'])
+
+    if job is None:
+        return JSONResponse({'error': 'Job not found'}, status_code=404)
+
+    # Pollers revalidate with If-None-Match and get a 304 until the job changes
+    response = JSONResponse(job)
+    etag, last_modified = etag_for(response.body), job_last_modified(job)
+    headers = {'ETag': etag, 'Last-Modified': http_date(last_modified), 'Cache-Control': 'private, no-cache'}
+    if is_not_modified(request.headers, etag, last_modified):
+        return Response(status_code=304, headers=headers)
+
+    response.headers.update(headers)
+    return response
+
+
+async def cancel_job(request):
+    """Cancel a queued or running analysis job."""
+    job = job_queue.cancel(request.path_params['job_id'])
+
+    if job is None:
+        return JSONResponse({'error': 'Job not found'}, status_code=404)
+
+    return JSONResponse(job)
+
+
+async def end_chat(request):
+    """End a chat session and discard its history."""
+    if not chat_store.delete(request.path_params['session_id']):
+        return JSONResponse({'error': 'Session not found'}, status_code=404)
+
+    return JSONResponse({'success': True})
+
+
+async def quick_assessment(request):
+    """Get a quick risk assessment without full analysis."""
+    global inflight
+
+    try:
+        if not os.getenv('ANTHROPIC_API_KEY'):
+            return JSONResponse({
+                'error': 'API key not configured',
+                'message': 'Please set ANTHROPIC_API_KEY in .env file'
+            }, status_code=500)
+
+        data = await read_json(request)
+
+        try:
+            with span('validate'):
+                financial_data = parse_quick_assessment_data(data)
+        except ValueError as e:
+            return JSONResponse({'error': str(e)}, status_code=400)
+
+        if analyzer is None:
+            return JSONResponse({'error': 'Analyzer not initialized'}, status_code=500)
+
+        if inflight >= MAX_INFLIGHT:
+            return server_busy()
+
+        inflight += 1
+        try:
+            try:
+                with span('rate_limit'):
+                    await rate_limiter.acquire_async(client_id(request), QUICK_ASSESSMENT_TOKEN_ESTIMATE,
+                                                     priority=True)
+            except RateLimitExceeded as e:
+                return rate_limited(e)
+
+            assessment = await cached_result_async(result_cache, 'quick_assessment', analyzer, financial_data,
+                                                   lambda: quick_batcher.submit(financial_data))
+        except SchedulerBusy as e:
+            return scheduler_busy(e)
+        finally:
+            inflight -= 1
+
+        return JSONResponse({
+            'success': True,
+            'assessment': assessment
+        })
+
+    except Exception as e:
+        print(f"Error in quick assessment: {str(e)}")
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+
+def readiness_reasons(upstream: dict, queues: dict) -> list:
+    """Why this instance should not take more traffic, or an empty list if it can."""
+    reasons = readiness_policy.reasons(upstream, queues['scheduler'])
+    if analyzer is None:
+        reasons.append('analyzer not initialized')
+    if queues['inflight'] >= MAX_INFLIGHT:
+        reasons.append(f'{MAX_INFLIGHT} analyses already in flight')
+    if queues['jobs']['queued'] + queues['jobs']['running'] >= job_queue.max_pending:
+        reasons.append('job queue is full')
+    return reasons
+
+
+async def health_check(request):
+    """Check if the API is running and configured, and report upstream and queue statistics."""
+    api_key_set = bool(os.getenv('ANTHROPIC_API_KEY'))
+    upstream = upstream_monitor.snapshot()
+    queues = {'scheduler': scheduler.stats(), 'rate_limiter': rate_limiter.stats(), 'jobs': job_queue.stats(),
+              'inflight': inflight, 'quick_batches': quick_batcher.stats()}
+
+    return JSONResponse({
+        'status': 'healthy' if api_key_set else 'warning',
+        'api_key_configured': api_key_set,
+        'message': 'Ready' if api_key_set else 'API key not configured',
+        'ready': not readiness_reasons(upstream, queues),
+        'upstream': upstream,
+        'queues': queues,
+        'cache': {
+            'archetypes': archetype_index.stats(),
+            'results': result_cache.stats() if result_cache is not None else None
+        }
+    }, headers={'Cache-Control': 'no-store'})
+
+
+async def readiness_check(request):
+    """200 while this instance can take more traffic, 503 with the reasons while it is saturated."""
+    reasons = readiness_reasons(upstream_monitor.snapshot(), {'scheduler': scheduler.stats(), 'jobs': job_queue.stats(),
+                                                              'inflight': inflight})
+    if reasons:
+        return JSONResponse({'ready': False, 'reasons': reasons}, status_code=503,
+                            headers={'Cache-Control': 'no-store'})
+
+    return JSONResponse({'ready': True}, headers={'Cache-Control': 'no-store'})
+
+
+async def not_found(request, exc):
+    """Handle 404 errors."""
+    return JSONResponse({'error': 'Not found'}, status_code=404)
+
+
+async def internal_error(request, exc):
+    """Handle 500 errors."""
+    return JSONResponse({'error': 'Internal server error'}, status_code=500)
+
+
+async def http_error(request, exc):
+    """Handle other HTTP errors such as 405 with a JSON body."""
+    return JSONResponse({'error': exc.detail}, status_code=exc.status_code)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    """
+    When the server stops, let analysis jobs finish (they run on this event
+    loop) and cancel quick-assessment batches still pending.
+    """
+    yield
+    await asyncio.to_thread(job_queue.shutdown)
+    await quick_batcher.shutdown()
+
+
+app = Starlette(
+    lifespan=lifespan,
+    routes=[
+        Route('/', index),
+        Route('/api/analyze', analyze, methods=['POST']),
+        Route('/api/analyze/cancel', cancel_analysis, methods=['POST']),
+        Route('/api/analyze/provisional', provisional_analysis, methods=['POST']),
+        Route('/api/jobs/{job_id}', get_job, methods=['GET']),
+        Route('/api/jobs/{job_id}', cancel_job, methods=['DELETE']),
+        Route('/api/chat/{session_id}', chat, methods=['POST']),
+        Route('/api/chat/{session_id}', end_chat, methods=['DELETE']),
+        Route('/api/quick-assessment', quick_assessment, methods=['POST']),
+        Route('/api/health', health_check, methods=['GET']),
+        Route('/api/ready', readiness_check, methods=['GET']),
+    ],
+    middleware=[
+        Middleware(ServerTimingMiddleware, tracer=tracer),
+        Middleware(CompressionMiddleware),
+        Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'],
+                   expose_headers=['Server-Timing'])
+    ],
+    exception_handlers={404: not_found, 500: internal_error, HTTPException: http_error}
+)
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    print("Starting Financial Analyzer ASGI Server...")
+    print("Access the application at: http://localhost:8000")
+    print("Press Ctrl+C to stop the server")
+    uvicorn.run(app, host='localhost', port=8000)
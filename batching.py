@@ -0,0 +1,184 @@
+"""
+Micro-Batching for Financial Analyzer
+Collects requests that arrive within a short window and processes them
+together, so a burst of quick assessments costs one upstream call that
+carries the system prompt once instead of one call per profile.
+
+Configured with:
+    QUICK_BATCH_SIZE=16        most profiles per call (1 turns batching off)
+    QUICK_BATCH_WINDOW_MS=20   longest a request waits for others to join
+"""
+
+import asyncio
+import os
+import threading
+from concurrent.futures import Future
+from tracing import span
+
+
+class _Batch:
+    """Requests collected for one call, with a future for each."""
+
+    def __init__(self):
+        self.items = []
+        self.futures = []
+        self.full = threading.Event()
+
+
+class MicroBatcher:
+    """
+    Batches concurrent calls to ``process(items) -> results``.
+
+    The first request of a batch leads it: it waits up to ``max_delay``
+    seconds, or until ``max_batch`` requests have joined, then processes
+    the batch on its own thread and hands each caller its result. If
+    processing fails, every caller in the batch gets the exception.
+    """
+
+    def __init__(self, process, max_batch: int = 16, max_delay: float = 0.02):
+        """
+        Args:
+            process: Callable taking a list of items and returning a list of
+                results in the same order
+            max_batch: Most items per call
+            max_delay: Longest the first item waits for others, in seconds
+        """
+        self.process = process
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._open = None
+        self._lock = threading.Lock()
+        self._batches = 0
+        self._items = 0
+
+    @classmethod
+    def from_env(cls, process):
+        """Create a batcher configured from QUICK_BATCH_* environment variables."""
+        return cls(
+            process,
+            max_batch=int(os.getenv('QUICK_BATCH_SIZE', '16')),
+            max_delay=float(os.getenv('QUICK_BATCH_WINDOW_MS', '20')) / 1000
+        )
+
+    def submit(self, item):
+        """Add ``item`` to the open batch, wait for the batch and return its result."""
+        future = Future()
+        with self._lock:
+            batch = self._open
+            leader = batch is None
+            if leader:
+                batch = self._open = _Batch()
+            batch.items.append(item)
+            batch.futures.append(future)
+            if len(batch.items) >= self.max_batch:
+                self._open = None
+                batch.full.set()
+
+        if leader:
+            with span('batch_window'):
+                batch.full.wait(self.max_delay)
+            with self._lock:
+                if self._open is batch:
+                    self._open = None
+                self._batches += 1
+                self._items += len(batch.items)
+            self._run(batch)
+        return future.result()
+
+    def _run(self, batch: _Batch):
+        """Process a closed batch and resolve its futures."""
+        try:
+            results = self.process(list(batch.items))
+            if len(results) != len(batch.items):
+                raise ValueError(f'Expected {len(batch.items)} results, got {len(results)}')
+        except Exception as e:
+            for future in batch.futures:
+                future.set_exception(e)
+            return
+        for future, result in zip(batch.futures, results):
+            future.set_result(result)
+
+    def stats(self) -> dict:
+        """Return the number of batches processed and their mean size."""
+        with self._lock:
+            return {
+                'batches': self._batches,
+                'mean_batch_size': round(self._items / self._batches, 2) if self._batches else 0.0
+            }
+
+
+class _AsyncBatch:
+    """Asyncio variant of _Batch."""
+
+    def __init__(self):
+        self.items = []
+        self.futures = []
+        self.full = asyncio.Event()
+
+
+class AsyncMicroBatcher(MicroBatcher):
+    """
+    Asyncio variant of MicroBatcher; ``process`` is a coroutine function.
+
+    Each batch is flushed by its own task rather than by its first caller,
+    so a caller that disconnects doesn't strand the others. The batcher
+    holds those tasks, since the event loop keeps only weak references.
+    """
+
+    def __init__(self, process, max_batch: int = 16, max_delay: float = 0.02):
+        super().__init__(process, max_batch, max_delay)
+        self._tasks = set()
+
+    async def submit(self, item):
+        """Add ``item`` to the open batch, wait for the batch and return its result."""
+        future = asyncio.get_running_loop().create_future()
+        batch = self._open
+        if batch is None:
+            batch = self._open = _AsyncBatch()
+            task = asyncio.ensure_future(self._flush(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        batch.items.append(item)
+        batch.futures.append(future)
+        if len(batch.items) >= self.max_batch:
+            self._open = None
+            batch.full.set()
+        return await future
+
+    async def shutdown(self):
+        """Cancel pending batches, cancelling their callers, and wait for the flush tasks to end."""
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _flush(self, batch: _AsyncBatch):
+        """Wait out the batch window, then process the batch and resolve its futures."""
+        try:
+            with span('batch_window'):
+                try:
+                    await asyncio.wait_for(batch.full.wait(), self.max_delay)
+                except asyncio.TimeoutError:
+                    pass
+            if self._open is batch:
+                self._open = None
+            self._batches += 1
+            self._items += len(batch.items)
+
+            results = await self.process(list(batch.items))
+            if len(results) != len(batch.items):
+                raise ValueError(f'Expected {len(batch.items)} results, got {len(results)}')
+        except asyncio.CancelledError:
+            if self._open is batch:
+                self._open = None
+            for future in batch.futures:
+                future.cancel()
+            raise
+        except Exception as e:
+            for future in batch.futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for future, result in zip(batch.futures, results):
+            if not future.done():
+                future.set_result(result)
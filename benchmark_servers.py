@@ -0,0 +1,192 @@
+"""
+Benchmark the Flask and ASGI servers under many concurrent analyses.
+
+Each server runs in its own process with a stub analyzer that only waits a
+fixed upstream latency, so the numbers measure how well the server holds
+in-flight requests rather than the Anthropic API itself. With --cassette the
+servers run the real analyzers against a recorded cassette instead, replaying
+each call with its recorded latency (see cassette.py).
+
+Usage:
+    python benchmark_servers.py --concurrency 1000 --latency 2
+    python benchmark_servers.py --concurrency 200 --cassette cassettes/analysis.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+from cassette import SAMPLE_PROFILE
+
+os.environ.setdefault('ANTHROPIC_API_KEY', 'benchmark-key')
+
+STUB_ANALYSIS = {
+    'initial_analysis': 'Stub analysis',
+    'detailed_metrics': '{}',
+    'risk_score': 40,
+    'risk_level': 'Medium',
+    'risk_factors': ['Debt'],
+    'gain_opportunities': ['Invest'],
+    'recommendations': '1. Save more',
+    'conversation_turns': 5
+}
+
+PAYLOAD = json.dumps(SAMPLE_PROFILE).encode('utf-8')
+
+
+def serve(server: str, port: int, latency: float):
+    """Run one server with a stub analyzer (child process entry point)."""
+    # With a cassette the real analyzers replay it, so no stub is installed
+    stub = not os.getenv('ANTHROPIC_CASSETTE')
+    if server == 'flask':
+        import logging
+        import app as flask_app
+        from werkzeug.serving import make_server
+
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+
+        class StubAnalyzer:
+            def analyze_financial_situation(self, financial_data, cancel_token=None):
+                time.sleep(latency)
+                return dict(STUB_ANALYSIS)
+
+        if stub:
+            flask_app.analyzer = StubAnalyzer()
+        make_server('127.0.0.1', port, flask_app.app, threaded=True).serve_forever()
+    else:
+        import asgi_app
+        import uvicorn
+
+        class AsyncStubAnalyzer:
+            async def analyze_financial_situation(self, financial_data, cancel_token=None):
+                await asyncio.sleep(latency)
+                return dict(STUB_ANALYSIS)
+
+        if stub:
+            asgi_app.analyzer = AsyncStubAnalyzer()
+        uvicorn.run(asgi_app.app, host='127.0.0.1', port=port, log_level='warning', backlog=4096)
+
+
+async def post_analyze(port: int) -> tuple:
+    """Send one /api/analyze request and return (status, seconds)."""
+    start = time.perf_counter()
+    try:
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(
+            b'POST /api/analyze HTTP/1.1\r\nHost: localhost\r\n'
+            b'Content-Type: application/json\r\nConnection: close\r\n'
+            + f'Content-Length: {len(PAYLOAD)}\r\n\r\n'.encode() + PAYLOAD
+        )
+        await writer.drain()
+        status_line = await reader.readline()
+        await reader.read()
+        writer.close()
+        status = int(status_line.split()[1])
+    except (OSError, IndexError, ValueError):
+        status = 0
+    return status, time.perf_counter() - start
+
+
+async def run_load(port: int, concurrency: int) -> dict:
+    """Fire ``concurrency`` simultaneous analyses and summarize the results."""
+    start = time.perf_counter()
+    results = await asyncio.gather(*(post_analyze(port) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(seconds for status, seconds in results if status == 200)
+    ok = len(latencies)
+
+    def percentile(p):
+        return latencies[min(ok - 1, int(ok * p))] if ok else float('nan')
+
+    return {
+        'ok': ok,
+        'failed': concurrency - ok,
+        'wall_seconds': elapsed,
+        'throughput': ok / elapsed,
+        'p50': percentile(0.50),
+        'p99': percentile(0.99)
+    }
+
+
+def peak_rss_mb(pid: int) -> float:
+    """Peak resident memory of a process in MB (Linux only)."""
+    try:
+        with open(f'/proc/{pid}/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return float('nan')
+
+
+def wait_until_ready(port: int, timeout: float = 20):
+    """Wait for the server's health endpoint to answer."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/api/health', timeout=1)
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f'Server on port {port} did not start')
+
+
+def benchmark(server: str, port: int, concurrency: int, latency: float) -> dict:
+    """Start one server in a subprocess, load it and return its numbers."""
+    process = subprocess.Popen(
+        [sys.executable, __file__, '--serve', server, '--port', str(port), '--latency', str(latency)],
+        stdout=subprocess.DEVNULL,
+        # Let the servers admit every benchmark request
+        env=dict(
+            os.environ,
+            ASGI_MAX_INFLIGHT=str(concurrency), SCHEDULER_MAX_CONCURRENT=str(concurrency),
+            RATE_LIMIT_CLIENT_RPM='1e9', RATE_LIMIT_CLIENT_TPM='1e12',
+            RATE_LIMIT_UPSTREAM_RPM='1e9', RATE_LIMIT_UPSTREAM_TPM='1e12'
+        )
+    )
+    try:
+        wait_until_ready(port)
+        results = asyncio.run(run_load(port, concurrency))
+        results['peak_rss_mb'] = peak_rss_mb(process.pid)
+        return results
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    """Compare both servers and print a summary table."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--concurrency', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=2.0, help='Stub upstream latency in seconds')
+    parser.add_argument('--cassette', help='Replay this cassette with its recorded latency instead of stubbing')
+    parser.add_argument('--serve', choices=['flask', 'asgi'], help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.port, args.latency)
+        return
+
+    if args.cassette:
+        # Inherited by the server processes
+        os.environ.update(ANTHROPIC_CASSETTE=args.cassette, ANTHROPIC_CASSETTE_MODE='replay',
+                          ANTHROPIC_CASSETTE_LATENCY='1')
+        print(f"{args.concurrency} concurrent analyses, replaying {args.cassette}\n")
+    else:
+        print(f"{args.concurrency} concurrent analyses, {args.latency}s stub upstream latency\n")
+    print(f"{'Server':<8}{'OK':>7}{'Failed':>8}{'Wall s':>9}{'Req/s':>9}{'p50 s':>8}{'p99 s':>8}{'Peak MB':>9}")
+    for offset, server in enumerate(['flask', 'asgi']):
+        r = benchmark(server, args.port + offset, args.concurrency, args.latency)
+        print(f"{server:<8}{r['ok']:>7}{r['failed']:>8}{r['wall_seconds']:>9.2f}"
+              f"{r['throughput']:>9.1f}{r['p50']:>8.2f}{r['p99']:>8.2f}{r['peak_rss_mb']:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
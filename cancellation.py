@@ -0,0 +1,106 @@
+"""
+Cancellation for Financial Analyzer
+Lets the web layer stop an analysis whose client went away or sent a newer
+request, both between turns and while an upstream call is in flight.
+"""
+
+import threading
+
+
+class AnalysisCancelled(Exception):
+    """Raised inside an analysis whose cancel token was cancelled."""
+
+
+class CancelToken:
+    """
+    A thread-safe, one-way cancellation flag.
+
+    Code doing the work checks ``raise_if_cancelled`` at safe points and
+    registers callbacks, such as closing an open stream, that abort work
+    in flight the moment ``cancel`` is called.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        """Whether ``cancel`` has been called."""
+        return self._event.is_set()
+
+    def cancel(self):
+        """Cancel the work and run the registered callbacks once."""
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Cancel callback failed: {str(e)}")
+
+    def add_callback(self, callback):
+        """
+        Call ``callback()`` on cancellation, immediately if already cancelled.
+
+        Returns a function that unregisters the callback.
+        """
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return lambda: self._remove_callback(callback)
+        callback()
+        return lambda: None
+
+    def _remove_callback(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def wait(self, timeout: float) -> bool:
+        """Sleep up to ``timeout`` seconds, waking early on cancellation. Returns ``cancelled``."""
+        return self._event.wait(timeout)
+
+    def raise_if_cancelled(self):
+        """Raise AnalysisCancelled if the token was cancelled."""
+        if self._event.is_set():
+            raise AnalysisCancelled("Analysis cancelled")
+
+
+class SupersedingRegistry:
+    """
+    Tracks the active request for each key, such as a client and browser tab,
+    so a newer request for the same key cancels the older one.
+    """
+
+    def __init__(self):
+        self._active = {}
+        self._lock = threading.Lock()
+
+    def start(self, key) -> CancelToken:
+        """Cancel any active request for ``key`` and return a token for the new one."""
+        token = CancelToken()
+        with self._lock:
+            previous = self._active.get(key)
+            self._active[key] = token
+        if previous is not None:
+            previous.cancel()
+        return token
+
+    def finish(self, key, token: CancelToken):
+        """Forget a finished request, unless a newer one already replaced it."""
+        with self._lock:
+            if self._active.get(key) is token:
+                del self._active[key]
+
+    def cancel(self, key) -> bool:
+        """Cancel the active request for ``key``. Returns whether there was one."""
+        with self._lock:
+            token = self._active.pop(key, None)
+        if token is not None:
+            token.cancel()
+        return token is not None
@@ -0,0 +1,380 @@
+"""
+Record and Replay for Financial Analyzer
+Saves the Messages API calls an analysis makes, with their usage and timing,
+to a cassette file and plays them back without the network, so the analysis
+flow and the web routes can be tested and benchmarked offline and repeatably.
+
+Setting ANTHROPIC_CASSETTE makes every analyzer use the cassette:
+    ANTHROPIC_CASSETTE_MODE=record  call the API and save each call (needs a real key)
+    ANTHROPIC_CASSETTE_MODE=replay  answer from the cassette only (the default)
+    ANTHROPIC_CASSETTE_LATENCY=1    in replay, wait this multiple of each recorded latency
+
+Run with:
+    python cassette.py record cassettes/analysis.json   # one live analysis of SAMPLE_PROFILE
+    python cassette.py show cassettes/analysis.json     # calls, tokens and recorded latency
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from anthropic.types import Message
+
+CASSETTE_VERSION = 1
+
+# The profile recorded by ``python cassette.py record`` and posted by benchmark_servers.py
+SAMPLE_PROFILE = {
+    "annual_income": 85000,
+    "total_savings": 25000,
+    "total_loans": 40000,
+    "monthly_expenses": 3200,
+    "investment_amount": 8000
+}
+
+# Placeholder events a replayed stream yields while its latency elapses
+REPLAY_STREAM_EVENTS = 10
+
+
+class CassetteMismatch(Exception):
+    """Raised in replay mode for a request the cassette has no recording of."""
+
+
+def request_key(request: dict) -> str:
+    """Return a stable fingerprint of a request's keyword arguments."""
+    canonical = json.dumps(request, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:16]
+
+
+class Cassette:
+    """
+    A file of recorded Messages API calls.
+
+    Each interaction holds the request, the full response (including its
+    token usage) and the seconds the call took. Replay looks responses up by
+    request fingerprint; a request recorded several times plays its responses
+    in recorded order and then starts over, so any number of identical
+    analyses can be replayed.
+    """
+
+    def __init__(self, path: str, mode: str = "replay", latency_scale: float = 0.0):
+        """
+        Open a cassette.
+
+        Args:
+            path: JSON cassette file
+            mode: ``record`` to start a new cassette, overwriting ``path``,
+                or ``replay`` to load an existing one
+            latency_scale: In replay, wait this multiple of each recorded
+                latency before answering (0 answers immediately)
+        """
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Cassette mode must be 'record' or 'replay', got {mode!r}")
+        self.path = path
+        self.mode = mode
+        self.latency_scale = latency_scale
+        self.interactions = []
+        self._plays = {}
+        self._lock = threading.Lock()
+        if mode == "replay":
+            self.load()
+
+    @classmethod
+    def from_env(cls):
+        """Open the cassette named by ANTHROPIC_CASSETTE, or return None if it is unset."""
+        path = os.getenv("ANTHROPIC_CASSETTE")
+        if not path:
+            return None
+        return cls(
+            path,
+            mode=os.getenv("ANTHROPIC_CASSETTE_MODE", "replay").lower(),
+            latency_scale=float(os.getenv("ANTHROPIC_CASSETTE_LATENCY", "0"))
+        )
+
+    @property
+    def recording(self) -> bool:
+        """Whether calls go to the API and are saved."""
+        return self.mode == "record"
+
+    def load(self):
+        """Read the interactions from the cassette file."""
+        with open(self.path) as f:
+            data = json.load(f)
+        if data.get("version") != CASSETTE_VERSION:
+            raise ValueError(f"Unsupported cassette version in {self.path}: {data.get('version')!r}")
+        self.interactions = data["interactions"]
+
+    def save(self):
+        """Write the interactions to the cassette file, replacing it atomically."""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump({"version": CASSETTE_VERSION, "interactions": self.interactions}, f, indent=2)
+            f.write("\n")
+        os.replace(temp_path, self.path)
+
+    def record(self, request: dict, response, elapsed: float, streamed: bool = False):
+        """Add one call to the cassette and save it."""
+        interaction = {
+            "key": request_key(request),
+            "request": json.loads(json.dumps(request, default=str)),
+            "response": response.model_dump(mode="json"),
+            "elapsed": round(elapsed, 4),
+            "streamed": streamed
+        }
+        with self._lock:
+            self.interactions.append(interaction)
+            self.save()
+
+    def play(self, request: dict) -> tuple:
+        """
+        Return the recorded (response, elapsed seconds) for a request.
+
+        Raises:
+            CassetteMismatch: If the request was never recorded
+        """
+        key = request_key(request)
+        with self._lock:
+            matches = [interaction for interaction in self.interactions if interaction["key"] == key]
+            if not matches:
+                raise CassetteMismatch(
+                    f"No recording of request {key} ({request.get('model')}, "
+                    f"{len(request.get('messages', []))} messages) in {self.path}; re-record the cassette"
+                )
+            plays = self._plays.get(key, 0)
+            self._plays[key] = plays + 1
+        interaction = matches[plays % len(matches)]
+        return Message.model_validate(interaction["response"]), interaction["elapsed"]
+
+    def summary(self) -> dict:
+        """Return the number of calls, their total token usage and recorded seconds."""
+        usage = [interaction["response"]["usage"] for interaction in self.interactions]
+        return {
+            "calls": len(self.interactions),
+            "input_tokens": sum(u["input_tokens"] for u in usage),
+            "output_tokens": sum(u["output_tokens"] for u in usage),
+            "seconds": round(sum(interaction["elapsed"] for interaction in self.interactions), 4)
+        }
+
+
+class _RecordingStream:
+    """Wraps a real message stream and records its final message."""
+
+    def __init__(self, manager, cassette: Cassette, request: dict):
+        self._manager = manager
+        self._cassette = cassette
+        self._request = request
+        self._stream = None
+        self._start = None
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        self._stream = self._manager.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        return self._manager.__exit__(*exc_info)
+
+    def __iter__(self):
+        return iter(self._stream)
+
+    def close(self):
+        self._stream.close()
+
+    def get_final_message(self):
+        message = self._stream.get_final_message()
+        self._cassette.record(self._request, message, time.perf_counter() - self._start, streamed=True)
+        return message
+
+
+class _ReplayStream:
+    """
+    Replays a recorded response as a stream.
+
+    Iterating yields placeholder events spread over the replayed latency and
+    stops early once ``close`` is called, as a real stream would.
+    """
+
+    def __init__(self, message: Message, delay: float):
+        self._message = message
+        self._delay = delay
+        self._closed = threading.Event()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __iter__(self):
+        for _ in range(REPLAY_STREAM_EVENTS):
+            if self._closed.wait(self._delay / REPLAY_STREAM_EVENTS):
+                return
+            yield {"type": "ping"}
+
+    def close(self):
+        self._closed.set()
+
+    def get_final_message(self) -> Message:
+        return self._message
+
+
+class _AsyncRecordingStream(_RecordingStream):
+    """Asyncio variant of _RecordingStream, wrapping an AsyncMessageStreamManager."""
+
+    async def __aenter__(self):
+        self._start = time.perf_counter()
+        self._stream = await self._manager.__aenter__()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return await self._manager.__aexit__(*exc_info)
+
+    def __aiter__(self):
+        return self._stream.__aiter__()
+
+    async def close(self):
+        await self._stream.close()
+
+    async def get_final_message(self):
+        message = await self._stream.get_final_message()
+        self._cassette.record(self._request, message, time.perf_counter() - self._start, streamed=True)
+        return message
+
+
+class _AsyncReplayStream:
+    """Asyncio variant of _ReplayStream."""
+
+    def __init__(self, message: Message, delay: float):
+        self._message = message
+        self._delay = delay
+        self._closed = asyncio.Event()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def __aiter__(self):
+        for _ in range(REPLAY_STREAM_EVENTS):
+            try:
+                await asyncio.wait_for(self._closed.wait(), self._delay / REPLAY_STREAM_EVENTS)
+                return
+            except asyncio.TimeoutError:
+                yield {"type": "ping"}
+
+    async def close(self):
+        self._closed.set()
+
+    async def get_final_message(self) -> Message:
+        return self._message
+
+
+class _CassetteMessages:
+    """The ``messages`` resource of a CassetteClient."""
+
+    def __init__(self, cassette: Cassette, client):
+        self._cassette = cassette
+        self._client = client
+
+    def create(self, **request):
+        if self._cassette.recording:
+            snapshot = json.loads(json.dumps(request, default=str))
+            start = time.perf_counter()
+            response = self._client.messages.create(**request)
+            self._cassette.record(snapshot, response, time.perf_counter() - start)
+            return response
+        message, elapsed = self._cassette.play(request)
+        if self._cassette.latency_scale:
+            time.sleep(elapsed * self._cassette.latency_scale)
+        return message
+
+    def stream(self, **request):
+        if self._cassette.recording:
+            snapshot = json.loads(json.dumps(request, default=str))
+            return _RecordingStream(self._client.messages.stream(**request), self._cassette, snapshot)
+        message, elapsed = self._cassette.play(request)
+        return _ReplayStream(message, elapsed * self._cassette.latency_scale)
+
+    def count_tokens(self, **request):
+        return self._client.messages.count_tokens(**request)
+
+
+class _AsyncCassetteMessages(_CassetteMessages):
+    """The ``messages`` resource of an AsyncCassetteClient."""
+
+    async def create(self, **request):
+        if self._cassette.recording:
+            snapshot = json.loads(json.dumps(request, default=str))
+            start = time.perf_counter()
+            response = await self._client.messages.create(**request)
+            self._cassette.record(snapshot, response, time.perf_counter() - start)
+            return response
+        message, elapsed = self._cassette.play(request)
+        if self._cassette.latency_scale:
+            await asyncio.sleep(elapsed * self._cassette.latency_scale)
+        return message
+
+    def stream(self, **request):
+        if self._cassette.recording:
+            snapshot = json.loads(json.dumps(request, default=str))
+            return _AsyncRecordingStream(self._client.messages.stream(**request), self._cassette, snapshot)
+        message, elapsed = self._cassette.play(request)
+        return _AsyncReplayStream(message, elapsed * self._cassette.latency_scale)
+
+    async def count_tokens(self, **request):
+        return await self._client.messages.count_tokens(**request)
+
+
+class CassetteClient:
+    """
+    Stands in for an Anthropic client, recording its Messages API calls to a
+    cassette or replaying them from one.
+    """
+
+    _messages_class = _CassetteMessages
+
+    def __init__(self, cassette: Cassette, client=None):
+        """
+        Args:
+            cassette: The cassette to record to or replay from
+            client: The real client, needed to record
+        """
+        if cassette.recording and client is None:
+            raise ValueError("Recording a cassette needs a real client")
+        self.cassette = cassette
+        self.messages = self._messages_class(cassette, client)
+
+
+class AsyncCassetteClient(CassetteClient):
+    """Asyncio variant of CassetteClient, standing in for an AsyncAnthropic client."""
+
+    _messages_class = _AsyncCassetteMessages
+
+
+def main():
+    """Record a live analysis of SAMPLE_PROFILE, or summarize a cassette."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('command', choices=['record', 'show'])
+    parser.add_argument('path', help='Cassette file')
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        from financial_analyzer import FinancialAnalyzer
+
+        os.environ.update(ANTHROPIC_CASSETTE=args.path, ANTHROPIC_CASSETTE_MODE='record')
+        analysis = FinancialAnalyzer().analyze_financial_situation(SAMPLE_PROFILE)
+        print(f"Recorded an analysis with risk score {analysis['risk_score']} ({analysis['risk_level']})")
+
+    summary = Cassette(args.path).summary()
+    print(f"{args.path}: {summary['calls']} calls, {summary['input_tokens']:,} input and "
+          f"{summary['output_tokens']:,} output tokens, {summary['seconds']:.2f}s recorded")
+
+
+if __name__ == '__main__':
+    main()
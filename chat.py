@@ -0,0 +1,194 @@
+"""
+Follow-up Chat Sessions for Financial Analyzer
+Keeps the context of finished analyses so users can ask follow-up questions,
+in a store bounded by total size with least-recently-used and idle eviction.
+"""
+
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+# Once the verbatim history passes this many estimated tokens, all but the
+# last CHAT_KEEP_MESSAGES messages are folded into a running summary
+CHAT_HISTORY_TOKEN_BUDGET = 2000
+CHAT_KEEP_MESSAGES = 4
+
+
+class SessionBusyError(Exception):
+    """Raised when a session already has a turn in progress."""
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximate the tokens in a piece of text at ~4 characters per token."""
+    return len(text) // 4
+
+
+def history_tokens(messages: list) -> int:
+    """Approximate the tokens in a list of plain-text chat messages."""
+    return sum(estimate_tokens(message["content"]) for message in messages)
+
+
+def build_chat_context(financial_data: dict, analysis: dict, summary: str) -> str:
+    """
+    Describe a finished analysis for the follow-up chat's system prompt.
+
+    Args:
+        financial_data: The analyzed financial inputs
+        analysis: The analyzer result
+        summary: A short summary of the initial analysis
+    """
+    profile = ", ".join(
+        f"{key.replace('_', ' ')} ${value:,.0f}" for key, value in financial_data.items() if key != 'loans'
+    )
+    lines = [
+        f"Profile: {profile}",
+        f"Risk: {analysis['risk_score']}/100 ({analysis['risk_level']})",
+        f"Risk factors: {'; '.join(analysis['risk_factors'])}",
+        f"Gain opportunities: {'; '.join(analysis['gain_opportunities'])}",
+        f"Analysis summary: {summary}",
+        f"Recommendations given:\n{analysis['recommendations']}"
+    ]
+    for loan in financial_data.get('loans') or []:
+        lines.insert(1, f"Loan {loan['name']}: ${loan['balance']:,.0f} at {loan['apr']:g}% APR, "
+                        f"${loan['minimum_payment']:,.0f}/month minimum")
+    return "\n".join(lines)
+
+
+class ChatSessionStore:
+    """
+    An in-process store of chat sessions.
+
+    Each session holds a fixed analysis context, a running summary of older
+    turns and the most recent messages. The store evicts sessions idle for
+    longer than ``idle_ttl`` and, least recently used first, any sessions
+    beyond ``max_bytes`` of stored text in total.
+    """
+
+    def __init__(self, max_bytes: int = 20_000_000, idle_ttl: float = 1800, clock=time.time):
+        """
+        Initialize the store.
+
+        Args:
+            max_bytes: Upper bound on the text held across all sessions
+            idle_ttl: Seconds without a turn after which a session is evicted
+        """
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        self.clock = clock
+        self._sessions = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """Create a store configured from CHAT_* environment variables."""
+        return cls(
+            max_bytes=int(os.getenv('CHAT_MAX_BYTES', '20000000')),
+            idle_ttl=float(os.getenv('CHAT_IDLE_TTL', '1800'))
+        )
+
+    def create(self, context: str) -> str:
+        """Start a session for an analysis context and return its ID."""
+        session_id = uuid.uuid4().hex
+        session = {
+            "session_id": session_id,
+            "context": context,
+            "summary": "",
+            "messages": [],
+            "turns": 0,
+            "busy": False,
+            "last_active": self.clock(),
+            "size": 0
+        }
+        with self._lock:
+            self._sessions[session_id] = session
+            self._resize(session)
+            self._evict()
+        return session_id
+
+    def checkout(self, session_id: str) -> dict:
+        """
+        Claim a session for one turn and return a snapshot of its state.
+
+        Returns None if the session is unknown or evicted. The caller must
+        follow up with ``checkin`` or ``release``.
+
+        Raises:
+            SessionBusyError: If another turn on the session is in progress
+        """
+        with self._lock:
+            self._evict()
+            session = self._sessions.get(session_id)
+            if session is None:
+                return None
+            if session["busy"]:
+                raise SessionBusyError("A message in this session is still being answered")
+            session["busy"] = True
+            session["last_active"] = self.clock()
+            self._sessions.move_to_end(session_id)
+            return {
+                "context": session["context"],
+                "summary": session["summary"],
+                "messages": list(session["messages"]),
+                "turns": session["turns"]
+            }
+
+    def checkin(self, session_id: str, summary: str, messages: list) -> int:
+        """
+        Store the outcome of a turn, release the session and return its turn count.
+
+        A session evicted while the turn ran stays evicted.
+        """
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return 0
+            session.update(summary=summary, messages=messages, busy=False, last_active=self.clock())
+            session["turns"] += 1
+            self._resize(session)
+            self._sessions.move_to_end(session_id)
+            self._evict()
+            return session["turns"]
+
+    def release(self, session_id: str):
+        """Release a session after a failed turn, leaving its history unchanged."""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session["busy"] = False
+
+    def delete(self, session_id: str) -> bool:
+        """Remove a session. Returns whether it existed."""
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            if session is not None:
+                self._total_bytes -= session["size"]
+            return session is not None
+
+    def stats(self) -> dict:
+        """Return the number of sessions and the bytes of text they hold."""
+        with self._lock:
+            self._evict()
+            return {"sessions": len(self._sessions), "bytes": self._total_bytes}
+
+    def _resize(self, session: dict):
+        """Recompute a session's size. Caller holds the lock."""
+        size = len(session["context"]) + len(session["summary"]) + sum(
+            len(message["content"]) for message in session["messages"]
+        )
+        self._total_bytes += size - session["size"]
+        session["size"] = size
+
+    def _evict(self):
+        """Drop idle sessions, then LRU sessions while over budget. Caller holds the lock."""
+        cutoff = self.clock() - self.idle_ttl
+        for session_id, session in list(self._sessions.items()):
+            if self._total_bytes <= self.max_bytes and session["last_active"] >= cutoff:
+                # Sessions are in least-recently-used order, so the rest are newer
+                break
+            if session["busy"] and session["last_active"] >= cutoff:
+                continue
+            del self._sessions[session_id]
+            self._total_bytes -= session["size"]
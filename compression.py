@@ -0,0 +1,156 @@
+"""
+Response Compression for Financial Analyzer
+Compresses page and API responses above a size threshold with gzip, or with
+Brotli when the brotli package is installed, as negotiated with the client's
+Accept-Encoding header. Shared by the Flask and ASGI servers.
+"""
+
+import gzip
+import os
+from tracing import span
+
+try:
+    import brotli
+except ImportError:
+    # Brotli is optional; without it only gzip is offered
+    brotli = None
+
+# Smaller bodies gain little from compression and cost a round of CPU
+COMPRESS_MIN_BYTES = int(os.getenv('COMPRESS_MIN_BYTES', '1024'))
+
+# Levels that keep per-response compression to about a millisecond
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript')
+
+
+def supported_encodings() -> tuple:
+    """The encodings this server can produce, most preferred first."""
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def choose_encoding(accept_encoding: str) -> str:
+    """
+    Pick the encoding for a response from an Accept-Encoding header.
+
+    The client's quality values decide first and the server's preference
+    (Brotli, then gzip) breaks ties. Returns None if the client accepts
+    none of the supported encodings.
+    """
+    if not accept_encoding:
+        return None
+
+    qualities = {}
+    for entry in accept_encoding.split(','):
+        coding, _, params = entry.strip().partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        qualities[coding.strip().lower()] = quality
+
+    best, best_quality = None, 0.0
+    for encoding in supported_encodings():
+        quality = qualities.get(encoding, qualities.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def is_compressible(status: int, content_type: str, content_encoding: str = None) -> bool:
+    """Whether a response is a candidate for compression, before looking at its size."""
+    if status < 200 or status in (204, 206, 304) or content_encoding:
+        return False
+    return (content_type or '').startswith(COMPRESSIBLE_TYPES)
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    """Compress a body with ``gzip`` or ``br``."""
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    # mtime=0 keeps the output stable for identical bodies
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def compress_body(body: bytes, accept_encoding: str, minimum_size: int = None) -> tuple:
+    """
+    Compress a compressible body if it is large enough and the client accepts it.
+
+    Returns:
+        Tuple of (body, encoding), with encoding None if the body is unchanged
+    """
+    if minimum_size is None:
+        minimum_size = COMPRESS_MIN_BYTES
+    if len(body) < minimum_size:
+        return body, None
+    encoding = choose_encoding(accept_encoding)
+    if encoding is None:
+        return body, None
+    compressed = compress(body, encoding)
+    if len(compressed) >= len(body):
+        return body, None
+    return compressed, encoding
+
+
+class CompressionMiddleware:
+    """
+    ASGI middleware that compresses compressible responses above
+    ``minimum_size`` bytes.
+
+    A compressible response's body is buffered until complete, which suits
+    this app's JSON and HTML responses; anything else passes straight through.
+    """
+
+    def __init__(self, app, minimum_size: int = None):
+        self.app = app
+        self.minimum_size = COMPRESS_MIN_BYTES if minimum_size is None else minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['method'] == 'HEAD':
+            await self.app(scope, receive, send)
+            return
+
+        accept_encoding = ''
+        for name, value in scope['headers']:
+            if name == b'accept-encoding':
+                accept_encoding = value.decode('latin-1')
+        start = None
+        chunks = []
+
+        async def send_compressed(message):
+            nonlocal start
+            if message['type'] == 'http.response.start':
+                headers = {name.lower(): value.decode('latin-1') for name, value in message.get('headers', [])}
+                if is_compressible(message['status'], headers.get(b'content-type'), headers.get(b'content-encoding')):
+                    start = message
+                    return
+            elif message['type'] == 'http.response.body' and start is not None:
+                chunks.append(message.get('body', b''))
+                if message.get('more_body'):
+                    return
+                body = b''.join(chunks)
+                if len(body) >= self.minimum_size:
+                    with span('compress'):
+                        body, encoding = compress_body(body, accept_encoding, self.minimum_size)
+                    start = self._with_encoding(start, body, encoding)
+                await send(start)
+                await send({'type': 'http.response.body', 'body': body})
+                return
+            await send(message)
+
+        await self.app(scope, receive, send_compressed)
+
+    @staticmethod
+    def _with_encoding(start: dict, body: bytes, encoding: str) -> dict:
+        """Rewrite a response start message's headers for a possibly compressed body."""
+        headers = [(name, value) for name, value in start.get('headers', []) if name.lower() != b'content-length']
+        if not any(name.lower() == b'vary' and b'accept-encoding' in value.lower() for name, value in headers):
+            headers.append((b'vary', b'Accept-Encoding'))
+        headers.append((b'content-length', str(len(body)).encode('latin-1')))
+        if encoding is not None:
+            headers.append((b'content-encoding', encoding.encode('latin-1')))
+        return dict(start, headers=headers)
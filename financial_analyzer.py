@@ -3,25 +3,239 @@ Financial Risk and Gain Analysis Model using Anthropic API
 This module analyzes financial inputs (loans, savings) to provide risk and gain assessments.
 """
 
+import asyncio
 import os
 import json
-from anthropic import Anthropic
+from anthropic import Anthropic, AsyncAnthropic
 from dotenv import load_dotenv
+from amortization import validate_loans, compare_strategies, summarize_strategies
+from projections import projection_for, summarize_projection
+from risk_scoring import score_profile
+from chat import CHAT_HISTORY_TOKEN_BUDGET, CHAT_KEEP_MESSAGES, history_tokens
+from cancellation import AnalysisCancelled
+from cassette import Cassette, CassetteClient, AsyncCassetteClient
+from health import MonitoredClient, AsyncMonitoredClient
+from tracing import span
 
 # Load environment variables
 load_dotenv()
 
+# Tool schema used to get the risk metrics turn back as structured data
+RISK_METRICS_TOOL = {
+    "name": "record_risk_metrics",
+    "description": "Record the risk score, top risk factors and top gain opportunities for the analyzed financial situation.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "risk_score": {
+                "type": "integer",
+                "minimum": 0,
+                "maximum": 100,
+                "description": "Overall risk score (0=no risk, 100=maximum risk)"
+            },
+            "risk_factors": {
+                "type": "array",
+                "items": {"type": "string"},
+                "description": "Top 3 risk factors"
+            },
+            "gain_opportunities": {
+                "type": "array",
+                "items": {"type": "string"},
+                "description": "Top 3 opportunities for financial gain"
+            }
+        },
+        "required": ["risk_score", "risk_factors", "gain_opportunities"]
+    }
+}
+
+# Tool schema used to get a batch of quick assessments back, one per profile
+RISK_ASSESSMENTS_TOOL = {
+    "name": "record_risk_assessments",
+    "description": "Record a quick risk assessment for each numbered financial profile.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "assessments": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "profile": {
+                            "type": "integer",
+                            "description": "Number of the profile, as given"
+                        },
+                        "risk_level": {
+                            "type": "string",
+                            "enum": ["Low", "Medium", "High", "Critical"]
+                        },
+                        "explanation": {
+                            "type": "string",
+                            "description": "Brief 1-2 sentence explanation"
+                        }
+                    },
+                    "required": ["profile", "risk_level", "explanation"]
+                }
+            }
+        },
+        "required": ["assessments"]
+    }
+}
+
+# Output tokens allowed per profile in a batched quick assessment
+RISK_ASSESSMENT_TOKENS_PER_PROFILE = 100
+
+
+# Shorter instructions used by the compact prompt mode
+COMPACT_SYSTEM_PROMPT = """Expert financial advisor. Assess the user's debt, risk level (Low/Medium/High/Critical), \
+gain opportunities and short- and long-term actions. Inputs are terse key=value lines in USD; \
+derived metrics and projections are precomputed, so use them rather than recalculating. \
+Be structured and concise."""
+
+# Marker the compact first turn ends with, so later turns can resend just the summary
+SUMMARY_MARKER = "SUMMARY:"
+
+
+def get_risk_level(score: float) -> str:
+    """Map a 0-100 risk score to a risk level."""
+    if score < 25:
+        return "Low"
+    elif score < 50:
+        return "Medium"
+    elif score < 75:
+        return "High"
+    else:
+        return "Critical"
+
+
+def parse_risk_metrics(tool_input: dict) -> dict:
+    """
+    Validate the input of a record_risk_metrics tool call.
+    
+    Args:
+        tool_input: The ``input`` of the tool_use block
+        
+    Returns:
+        Dictionary with a typed risk score, its risk level, and the risk
+        factors and gain opportunities as lists of strings
+    
+    Raises:
+        ValueError: If the tool input does not match the schema
+    """
+    if not isinstance(tool_input, dict):
+        raise ValueError("Risk metrics must be an object")
+    
+    try:
+        # Round rather than truncate, so 6.9 scores as 7; reject booleans
+        if isinstance(tool_input["risk_score"], bool):
+            raise TypeError
+        risk_score = round(float(tool_input["risk_score"]))
+    except KeyError:
+        raise ValueError("Risk metrics missing field: risk_score")
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError(f"Invalid risk_score: {tool_input['risk_score']!r}")
+    if not 0 <= risk_score <= 100:
+        raise ValueError(f"risk_score must be between 0 and 100, got {risk_score}")
+    
+    lists = {}
+    for field in ("risk_factors", "gain_opportunities"):
+        items = tool_input.get(field)
+        if not isinstance(items, list) or not all(isinstance(item, str) for item in items):
+            raise ValueError(f"{field} must be a list of strings")
+        lists[field] = [item.strip() for item in items if item.strip()]
+    
+    return {
+        "risk_score": risk_score,
+        "risk_level": get_risk_level(risk_score),
+        "risk_factors": lists["risk_factors"],
+        "gain_opportunities": lists["gain_opportunities"]
+    }
+
+
+def parse_risk_assessments(tool_input: dict, count: int) -> list:
+    """
+    Split the input of a record_risk_assessments tool call into one
+    assessment per profile.
+    
+    Args:
+        tool_input: The ``input`` of the tool_use block
+        count: Number of profiles in the request, numbered from 1
+    
+    Returns:
+        List of ``count`` assessments formatted like get_risk_assessment's
+        ("RISK_LEVEL. Explanation"), with None for a profile the model
+        skipped or answered invalidly
+    
+    Raises:
+        ValueError: If the tool input has no list of assessments
+    """
+    if not isinstance(tool_input, dict) or not isinstance(tool_input.get("assessments"), list):
+        raise ValueError("Risk assessments must be an object with a list of assessments")
+    
+    results = [None] * count
+    for item in tool_input["assessments"]:
+        if not isinstance(item, dict):
+            continue
+        profile, risk_level, explanation = item.get("profile"), item.get("risk_level"), item.get("explanation")
+        if (not isinstance(profile, int) or not 1 <= profile <= count or
+                risk_level not in ("Low", "Medium", "High", "Critical") or not isinstance(explanation, str)):
+            continue
+        results[profile - 1] = f"{risk_level}. {explanation.strip()}"
+    return results
+
+
+def split_summary(text: str, max_chars: int = 600) -> tuple:
+    """
+    Split a compact-mode reply into its body and its closing summary line.
+    
+    If the model left out the summary line, the summary falls back to the
+    opening sentences of the reply, cut to at most ``max_chars`` characters.
+    
+    Returns:
+        Tuple of (body, summary)
+    """
+    position = text.upper().rfind(SUMMARY_MARKER)
+    if position >= 0:
+        summary = text[position + len(SUMMARY_MARKER):].strip()
+        if summary:
+            return text[:position].rstrip(), summary
+    
+    body = text.strip()
+    summary = " ".join(body.split())[:max_chars]
+    if len(summary) == max_chars and ". " in summary:
+        summary = summary[:summary.rfind(". ") + 1]
+    return body, summary
+
+
 class FinancialAnalyzer:
     """A financial analysis model that uses Claude to analyze risk and gain potential."""
     
-    def __init__(self):
-        """Initialize the Anthropic client."""
+    def __init__(self, compact: bool = None, monitor=None):
+        """
+        Initialize the Anthropic client.
+        
+        Args:
+            compact: Use the compact prompt mode, which encodes the inputs
+                tersely with precomputed metrics and resends a summary of
+                earlier replies instead of their full text. Defaults to the
+                COMPACT_PROMPTS environment variable.
+            monitor: Optional health.UpstreamMonitor that records the
+                latency and outcome of every API call
+        """
         api_key = os.getenv('ANTHROPIC_API_KEY')
         if not api_key:
             raise ValueError("ANTHROPIC_API_KEY environment variable not set")
-        self.client = Anthropic(api_key=api_key)
+        self.client = self._create_client(api_key)
+        cassette = Cassette.from_env()
+        if cassette is not None:
+            # Record or replay every call through the ANTHROPIC_CASSETTE file
+            self.client = self._create_cassette_client(cassette)
+        if monitor is not None:
+            self.client = self._create_monitored_client(monitor)
         self.model = "claude-3-5-sonnet-20241022"
         self.conversation_history = []
+        if compact is None:
+            compact = os.getenv('COMPACT_PROMPTS', '').lower() in ('1', 'true', 'yes')
+        self.compact = compact
         
         # System prompt that guides Claude for financial analysis
         self.system_prompt = """You are an expert financial advisor with deep knowledge of risk assessment, 
@@ -36,119 +250,572 @@ When analyzing financial data, you should:
 5. Consider both short-term and long-term financial implications
 
 Always provide structured analysis with clear metrics and explanations."""
+        if self.compact:
+            self.system_prompt = COMPACT_SYSTEM_PROMPT
     
-    def analyze_financial_situation(self, financial_data: dict) -> dict:
+    def _create_client(self, api_key: str):
+        """Create the Anthropic client used for all requests."""
+        return Anthropic(api_key=api_key)
+    
+    def _create_cassette_client(self, cassette: Cassette):
+        """Wrap the client so its calls are recorded to or replayed from a cassette."""
+        return CassetteClient(cassette, self.client)
+    
+    def _create_monitored_client(self, monitor):
+        """Wrap the client so each call's latency and outcome are recorded."""
+        return MonitoredClient(self.client, monitor)
+    
+    def analyze_financial_situation(self, financial_data: dict, cancel_token=None) -> dict:
         """
         Analyze a person's financial situation using multi-turn conversation.
         
         Args:
             financial_data: Dictionary containing financial inputs
+            cancel_token: Optional CancelToken; cancelling it stops the
+                analysis between turns and aborts the call in flight
             
         Returns:
             Dictionary with analysis results including risk level and gain potential
+        
+        Raises:
+            AnalysisCancelled: If ``cancel_token`` was cancelled
         """
-        # Reset conversation for new analysis
-        self.conversation_history = []
+        return self._run_steps(self._analysis_steps(financial_data), cancel_token)
+    
+    def _run_steps(self, steps, cancel_token=None):
+        """
+        Send each request a conversation generator yields and return its result.
+        
+        With a cancel token, every call is streamed so cancelling can close
+        the connection mid-response instead of waiting for the whole reply.
+        Each call is traced as an ``llm_<turn>`` span, and the local work
+        between calls as ``prepare``.
+        """
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+        with span('prepare'):
+            request = next(steps)
+        turn = 0
+        while True:
+            turn += 1
+            with span(f'llm_{turn}'):
+                if cancel_token is None:
+                    response = self.client.messages.create(**request)
+                else:
+                    cancel_token.raise_if_cancelled()
+                    response = self._stream_message(request, cancel_token)
+            try:
+                with span('prepare'):
+                    request = steps.send(response)
+            except StopIteration as done:
+                return done.value
+    
+    def _stream_message(self, request: dict, cancel_token):
+        """Make one call as a stream that ``cancel_token`` can abort, returning the final message."""
+        with self.client.messages.stream(**request) as stream:
+            unregister = cancel_token.add_callback(stream.close)
+            try:
+                for _ in stream:
+                    if cancel_token.cancelled:
+                        break
+            except Exception:
+                # Closing the stream from another thread fails the read
+                if cancel_token.cancelled:
+                    raise AnalysisCancelled("Analysis cancelled") from None
+                raise
+            finally:
+                unregister()
+            cancel_token.raise_if_cancelled()
+            return stream.get_final_message()
+    
+    @staticmethod
+    def _local_projections(financial_data: dict) -> tuple:
+        """
+        Project outcomes locally so the model reasons from computed numbers
+        instead of estimating compounding itself. Returns the Monte Carlo
+        projection and, for itemized loans, the payoff strategy comparison.
+        """
+        with span('projections'):
+            projection = projection_for(financial_data)
+            debt_payoff = compare_strategies(financial_data['loans']) if financial_data.get('loans') else None
+        return projection, debt_payoff
+    
+    def _analysis_steps(self, financial_data: dict, local_projections: tuple = None):
+        """
+        Drive the three-turn analysis conversation.
+        
+        This generator yields the keyword arguments for each ``messages.create``
+        call and expects the response to be sent back, so the sync and async
+        analyzers share one definition of the conversation. Its return value
+        is the compiled analysis.
+        
+        Args:
+            local_projections: The result of ``_local_projections``, if the
+                caller already computed it (off the event loop, say)
+        """
+        # Reset conversation for new analysis. The history is kept in a local
+        # list so concurrent analyses on a shared analyzer don't interleave.
+        history = []
+        self.conversation_history = history
+        
+        projection, debt_payoff = local_projections or self._local_projections(financial_data)
         
         # First message: Present the financial data for analysis
-        initial_message = self._format_financial_data(financial_data)
-        self.conversation_history.append({
+        if self.compact:
+            initial_message = self._format_compact_data(financial_data, projection, debt_payoff)
+            initial_message += f"\n\nAnalyze this situation. End with one line: {SUMMARY_MARKER} <key findings in under 60 words>"
+        else:
+            initial_message = self._format_financial_data(financial_data, projection, debt_payoff)
+        history.append({
             "role": "user",
             "content": initial_message
         })
         
         # Get initial analysis from Claude
-        response = self.client.messages.create(
+        response = yield dict(
             model=self.model,
             max_tokens=1000,
             system=self.system_prompt,
-            messages=self.conversation_history
+            messages=history
         )
         
-        initial_analysis = response.content[0].text
-        self.conversation_history.append({
+        initial_analysis = self._response_text(response)
+        if self.compact:
+            # Later turns carry only the summary of the first reply
+            initial_analysis, summary = split_summary(initial_analysis)
+        history.append({
             "role": "assistant",
-            "content": initial_analysis
+            "content": summary if self.compact else initial_analysis
         })
         
-        # Follow-up for specific risk metrics
-        risk_question = """Based on your analysis, please provide:
+        # Follow-up for specific risk metrics, returned through a tool so the
+        # result arrives as validated structured data instead of free text
+        if self.compact:
+            risk_question = "Record risk_score (0-100), top 3 risk_factors and top 3 gain_opportunities."
+        else:
+            risk_question = """Based on your analysis, please provide:
 1. A risk score from 0-100 (0=no risk, 100=maximum risk)
 2. Top 3 risk factors
 3. Top 3 opportunities for financial gain
-Please format this as JSON."""
+Record them using the record_risk_metrics tool."""
         
-        self.conversation_history.append({
+        history.append({
             "role": "user",
             "content": risk_question
         })
         
-        response = self.client.messages.create(
+        response = yield dict(
             model=self.model,
             max_tokens=1000,
             system=self.system_prompt,
-            messages=self.conversation_history
+            messages=history,
+            tools=[RISK_METRICS_TOOL],
+            tool_choice={"type": "tool", "name": RISK_METRICS_TOOL["name"]}
         )
         
-        detailed_analysis = response.content[0].text
-        self.conversation_history.append({
+        tool_use = self._find_tool_use(response, RISK_METRICS_TOOL["name"])
+        risk_metrics = parse_risk_metrics(tool_use.input)
+        detailed_analysis = json.dumps(risk_metrics, indent=2)
+        
+        if self.compact:
+            # Restate the metrics as text so the last turn needs neither the
+            # tool blocks nor the tool definition
+            history.append({
+                "role": "assistant",
+                "content": (
+                    f"risk_score={risk_metrics['risk_score']} ({risk_metrics['risk_level']}); "
+                    f"risk_factors: {'; '.join(risk_metrics['risk_factors'])}; "
+                    f"gain_opportunities: {'; '.join(risk_metrics['gain_opportunities'])}"
+                )
+            })
+            history.append({
+                "role": "user",
+                "content": "Give 5 specific, actionable recommendations to cut risk and grow gains, "
+                           "as a numbered list, one or two sentences each."
+            })
+            response = yield dict(
+                model=self.model,
+                max_tokens=1000,
+                system=self.system_prompt,
+                messages=history
+            )
+            return self._compile_analysis(initial_analysis, detailed_analysis, risk_metrics,
+                                          self._response_text(response), projection, debt_payoff, history)
+        
+        history.append({
             "role": "assistant",
-            "content": detailed_analysis
+            "content": [{
+                "type": "tool_use",
+                "id": tool_use.id,
+                "name": tool_use.name,
+                "input": tool_use.input
+            }]
         })
         
         # Follow-up for recommendations
         recommendation_question = """Please provide 5 specific, actionable recommendations 
 to reduce risk and maximize gain potential. Format as a numbered list with brief explanations."""
         
-        self.conversation_history.append({
+        history.append({
             "role": "user",
-            "content": recommendation_question
+            "content": [
+                {
+                    "type": "tool_result",
+                    "tool_use_id": tool_use.id,
+                    "content": "Risk metrics recorded."
+                },
+                {"type": "text", "text": recommendation_question}
+            ]
         })
         
-        response = self.client.messages.create(
+        # The history now contains tool blocks, so the tool must stay defined,
+        # but the model must answer in text rather than call it again
+        response = yield dict(
             model=self.model,
             max_tokens=1000,
             system=self.system_prompt,
-            messages=self.conversation_history
+            messages=history,
+            tools=[RISK_METRICS_TOOL],
+            tool_choice={"type": "none"}
         )
         
-        recommendations = response.content[0].text
+        recommendations = self._response_text(response)
         
-        # Compile the complete analysis
+        return self._compile_analysis(initial_analysis, detailed_analysis, risk_metrics,
+                                      recommendations, projection, debt_payoff, history)
+    
+    @staticmethod
+    def _compile_analysis(initial_analysis: str, detailed_analysis: str, risk_metrics: dict,
+                          recommendations: str, projection: dict, debt_payoff: dict, history: list) -> dict:
+        """Compile the complete analysis from the results of each turn."""
         return {
             "initial_analysis": initial_analysis,
             "detailed_metrics": detailed_analysis,
+            "risk_score": risk_metrics["risk_score"],
+            "risk_level": risk_metrics["risk_level"],
+            "risk_factors": risk_metrics["risk_factors"],
+            "gain_opportunities": risk_metrics["gain_opportunities"],
             "recommendations": recommendations,
-            "conversation_turns": len(self.conversation_history)
+            "projections": projection,
+            "debt_payoff": debt_payoff,
+            "conversation_turns": len(history)
         }
     
-    def _format_financial_data(self, financial_data: dict) -> str:
-        """Format financial data for Claude analysis."""
+    @staticmethod
+    def _response_text(response) -> str:
+        """Return the text of a response, skipping any non-text blocks."""
+        return "".join(block.text for block in response.content if block.type == "text")
+    
+    @staticmethod
+    def _find_tool_use(response, tool_name: str):
+        """Return the tool_use block for ``tool_name`` from a response."""
+        for block in response.content:
+            if block.type == "tool_use" and block.name == tool_name:
+                return block
+        raise ValueError(f"Model did not call the {tool_name} tool")
+    
+    def _format_financial_data(self, financial_data: dict, projection: dict = None,
+                               debt_payoff: dict = None) -> str:
+        """Format financial data, and optionally its projections, for Claude analysis."""
         formatted = "Please analyze the following financial situation:\n\n"
         
         for key, value in financial_data.items():
+            if key == 'loans':
+                continue
             # Convert snake_case to readable format
             readable_key = key.replace('_', ' ').title()
             formatted += f"- {readable_key}: ${value:,.2f}\n"
+            
+            # Itemized loans are listed under their total
+            if key == 'total_loans':
+                for loan in financial_data.get('loans') or []:
+                    formatted += (
+                        f"  - {loan['name']}: ${loan['balance']:,.2f} at {loan['apr']:.2f}% APR, "
+                        f"${loan['minimum_payment']:,.2f} minimum payment\n"
+                    )
+        
+        if projection is not None:
+            formatted += "\n" + summarize_projection(projection) + "\n"
+        
+        if debt_payoff is not None:
+            formatted += "\n" + summarize_strategies(debt_payoff) + "\n"
         
         formatted += "\nProvide a comprehensive financial analysis of this situation."
         return formatted
     
+    def _format_compact_data(self, financial_data: dict, projection: dict = None,
+                             debt_payoff: dict = None) -> str:
+        """
+        Encode financial data tersely as key=value lines, with the derived
+        metrics computed locally and optional one-line projection summaries.
+        """
+        lines = [
+            f"income={financial_data['annual_income']:.0f}/yr expenses={financial_data['monthly_expenses']:.0f}/mo "
+            f"savings={financial_data['total_savings']:.0f} loans={financial_data['total_loans']:.0f} "
+            f"investments={financial_data['investment_amount']:.0f}"
+        ]
+        
+        loans = financial_data.get('loans')
+        if loans:
+            lines.append("loans(balance@apr%,min/mo): " + "; ".join(
+                f"{loan['name']} {loan['balance']:.0f}@{loan['apr']:g}%,{loan['minimum_payment']:.0f}"
+                for loan in loans
+            ))
+        
+        scores = score_profile(financial_data)
+        lines.append(
+            f"surplus={scores['monthly_surplus']:.0f}/mo savings_rate={scores['savings_rate']:.1f}% "
+            f"debt/income={scores['debt_to_income_ratio']:.2f} debt/savings={scores['debt_to_savings_ratio']:.2f} "
+            f"debt/assets={scores['debt_to_assets_ratio']:.2f} emergency_fund={scores['emergency_fund_months']:.1f}mo "
+            f"rule_based_risk={scores['risk_score']:.0f}"
+        )
+        
+        if projection is not None:
+            lines.append(summarize_projection(projection, compact=True))
+        
+        if debt_payoff is not None:
+            lines.append(summarize_strategies(debt_payoff, compact=True))
+        
+        return "\n".join(lines)
+    
+    def chat(self, context: str, summary: str, messages: list, question: str, cancel_token=None) -> dict:
+        """
+        Answer a follow-up question about a finished analysis.
+        
+        Args:
+            context: The analysis context (see chat.build_chat_context)
+            summary: Running summary of earlier turns, or an empty string
+            messages: Recent user/assistant messages with plain-text content
+            question: The user's new message
+            cancel_token: Optional CancelToken, as for analyze_financial_situation
+            
+        Returns:
+            Dictionary with the ``reply`` and the session's updated
+            ``summary`` and ``messages``
+        """
+        return self._run_steps(self._chat_steps(context, summary, messages, question), cancel_token)
+    
+    def _chat_steps(self, context: str, summary: str, messages: list, question: str):
+        """
+        Drive one follow-up chat turn, in the style of ``_analysis_steps``.
+        
+        When the verbatim history is over CHAT_HISTORY_TOKEN_BUDGET, the
+        older messages are first folded into the summary with an extra
+        request, so every answer is sent a bounded amount of history.
+        """
+        messages = list(messages)
+        if history_tokens(messages) > CHAT_HISTORY_TOKEN_BUDGET and len(messages) > CHAT_KEEP_MESSAGES:
+            older, messages = messages[:-CHAT_KEEP_MESSAGES], messages[-CHAT_KEEP_MESSAGES:]
+            transcript = "\n".join(f"{message['role']}: {message['content']}" for message in older)
+            response = yield dict(
+                model=self.model,
+                max_tokens=300,
+                system="Summarize financial advice conversations concisely, keeping every figure, decision and open question.",
+                messages=[{
+                    "role": "user",
+                    "content": f"Earlier summary: {summary or '(none)'}\n\nNew conversation:\n{transcript}\n\n"
+                               "Write an updated summary in under 150 words."
+                }]
+            )
+            summary = self._response_text(response).strip()
+        
+        system = f"{self.system_prompt}\n\nThe user's completed analysis:\n{context}"
+        if summary:
+            system += f"\n\nSummary of the earlier conversation:\n{summary}"
+        messages.append({"role": "user", "content": question})
+        
+        response = yield dict(
+            model=self.model,
+            max_tokens=1000,
+            system=system,
+            messages=messages
+        )
+        
+        reply = self._response_text(response)
+        messages.append({"role": "assistant", "content": reply})
+        return {"reply": reply, "summary": summary, "messages": messages}
+    
     def get_risk_assessment(self, financial_data: dict) -> str:
         """Get a quick risk assessment without full analysis."""
-        message = f"""Quickly assess the risk level for this financial profile:
+        request = self._risk_assessment_request(financial_data)
+        with span('llm_1'):
+            response = self.client.messages.create(**request)
+        
+        return self._response_text(response)
+    
+    def get_risk_assessments(self, profiles: list) -> list:
+        """
+        Get quick risk assessments for several profiles in one request.
+        
+        The system prompt and instructions are sent once for the whole batch
+        and the model records one structured assessment per profile. Any
+        profile it skips is assessed on its own.
+        
+        Returns:
+            One assessment per profile, in order
+        """
+        if len(profiles) == 1:
+            return [self.get_risk_assessment(profiles[0])]
+        
+        request = self._risk_assessments_request(profiles)
+        with span('llm_1'):
+            response = self.client.messages.create(**request)
+        results = parse_risk_assessments(
+            self._find_tool_use(response, RISK_ASSESSMENTS_TOOL["name"]).input, len(profiles)
+        )
+        return [result if result is not None else self.get_risk_assessment(profile)
+                for profile, result in zip(profiles, results)]
+    
+    def _risk_assessments_request(self, profiles: list) -> dict:
+        """Build the ``messages.create`` arguments for a batch of quick risk assessments."""
+        if self.compact:
+            listed = "\n".join(f"#{number} {self._format_compact_data(profile)}"
+                                for number, profile in enumerate(profiles, start=1))
+        else:
+            listed = "\n\n".join(f"Profile {number}:\n{json.dumps(profile, indent=2)}"
+                                 for number, profile in enumerate(profiles, start=1))
+        message = (f"Quickly assess the risk level of each of these {len(profiles)} financial profiles:\n\n"
+                   f"{listed}\n\nRecord one assessment per profile, by number, using the "
+                   f"{RISK_ASSESSMENTS_TOOL['name']} tool.")
+        
+        return dict(
+            model=self.model,
+            max_tokens=RISK_ASSESSMENT_TOKENS_PER_PROFILE * len(profiles),
+            system=self.system_prompt,
+            messages=[{"role": "user", "content": message}],
+            tools=[RISK_ASSESSMENTS_TOOL],
+            tool_choice={"type": "tool", "name": RISK_ASSESSMENTS_TOOL["name"]}
+        )
+    
+    def _risk_assessment_request(self, financial_data: dict) -> dict:
+        """Build the ``messages.create`` arguments for a quick risk assessment."""
+        if self.compact:
+            message = (self._format_compact_data(financial_data) +
+                       "\nReply: RISK_LEVEL (Low/Medium/High/Critical), then 1-2 sentences why.")
+        else:
+            message = f"""Quickly assess the risk level for this financial profile:
 {json.dumps(financial_data, indent=2)}
 
 Respond with ONLY: RISK_LEVEL (Low/Medium/High/Critical), then a brief 1-2 sentence explanation."""
         
-        response = self.client.messages.create(
+        return dict(
             model=self.model,
             max_tokens=200,
             system=self.system_prompt,
             messages=[{"role": "user", "content": message}]
         )
+
+
+class AsyncFinancialAnalyzer(FinancialAnalyzer):
+    """Asyncio variant of FinancialAnalyzer for async servers."""
+    
+    def _create_client(self, api_key: str):
+        """Create the asynchronous Anthropic client."""
+        return AsyncAnthropic(api_key=api_key)
+    
+    def _create_cassette_client(self, cassette: Cassette):
+        """Wrap the asynchronous client for a cassette."""
+        return AsyncCassetteClient(cassette, self.client)
+    
+    def _create_monitored_client(self, monitor):
+        """Wrap the asynchronous client for a monitor."""
+        return AsyncMonitoredClient(self.client, monitor)
+    
+    async def analyze_financial_situation(self, financial_data: dict, cancel_token=None) -> dict:
+        """Asynchronous version of FinancialAnalyzer.analyze_financial_situation."""
+        # The projection is CPU-bound NumPy work, so keep it off the event loop
+        local_projections = await asyncio.to_thread(self._local_projections, financial_data)
+        return await self._run_steps(self._analysis_steps(financial_data, local_projections), cancel_token)
+    
+    async def chat(self, context: str, summary: str, messages: list, question: str, cancel_token=None) -> dict:
+        """Asynchronous version of FinancialAnalyzer.chat."""
+        return await self._run_steps(self._chat_steps(context, summary, messages, question), cancel_token)
+    
+    async def _run_steps(self, steps, cancel_token=None):
+        """
+        Asynchronous version of FinancialAnalyzer._run_steps.
+        
+        Cancelling the token cancels the running task, which aborts the call
+        in flight without needing a stream.
+        """
+        unregister = None
+        finished = False
+        if cancel_token is not None:
+            task = asyncio.current_task()
+            loop = asyncio.get_running_loop()
+            
+            def cancel_task():
+                # Runs on the loop, so it can't race with the finally below
+                if not finished:
+                    task.cancel()
+            
+            unregister = cancel_token.add_callback(lambda: loop.call_soon_threadsafe(cancel_task))
         
-        return response.content[0].text
+        try:
+            with span('prepare'):
+                request = next(steps)
+            turn = 0
+            while True:
+                turn += 1
+                if cancel_token is not None:
+                    cancel_token.raise_if_cancelled()
+                with span(f'llm_{turn}'):
+                    response = await self.client.messages.create(**request)
+                try:
+                    with span('prepare'):
+                        request = steps.send(response)
+                except StopIteration as done:
+                    return done.value
+        except asyncio.CancelledError:
+            if cancel_token is None or not cancel_token.cancelled:
+                raise
+            # The cancellation was ours, so stop it propagating any further
+            asyncio.current_task().uncancel()
+            raise AnalysisCancelled("Analysis cancelled") from None
+        finally:
+            finished = True
+            if unregister is not None:
+                unregister()
+    
+    async def get_risk_assessment(self, financial_data: dict) -> str:
+        """Asynchronous version of FinancialAnalyzer.get_risk_assessment."""
+        request = self._risk_assessment_request(financial_data)
+        with span('llm_1'):
+            response = await self.client.messages.create(**request)
+        
+        return self._response_text(response)
+    
+    async def get_risk_assessments(self, profiles: list) -> list:
+        """Asynchronous version of FinancialAnalyzer.get_risk_assessments."""
+        if len(profiles) == 1:
+            return [await self.get_risk_assessment(profiles[0])]
+        
+        request = self._risk_assessments_request(profiles)
+        with span('llm_1'):
+            response = await self.client.messages.create(**request)
+        results = parse_risk_assessments(
+            self._find_tool_use(response, RISK_ASSESSMENTS_TOOL["name"]).input, len(profiles)
+        )
+        return [result if result is not None else await self.get_risk_assessment(profile)
+                for profile, result in zip(profiles, results)]
+
+
+def get_loan_input(index: int) -> dict:
+    """Get one itemized loan from the user interactively."""
+    print(f"\nLoan {index + 1}:")
+    name = input("  Name (e.g. Car, Credit Card): ").strip() or f"Loan {index + 1}"
+    
+    while True:
+        try:
+            loan = {
+                "name": name,
+                "balance": input("  Balance ($): "),
+                "apr": input("  APR (%): "),
+                "minimum_payment": input("  Minimum Monthly Payment ($): ")
+            }
+            return validate_loans([loan])[0]
+        except ValueError as e:
+            print(f"  {str(e).replace('loans[0].', '')}. Try again.")
 
 
 def get_financial_inputs() -> dict:
@@ -184,6 +851,21 @@ def get_financial_inputs() -> dict:
             print("Please enter a valid number.")
     
     while True:
+        try:
+            loan_count = int(input("Number of loans to itemize (0 to enter a total): ") or 0)
+            if loan_count < 0:
+                print("Number of loans must be non-negative. Try again.")
+                continue
+            break
+        except ValueError:
+            print("Please enter a whole number.")
+    
+    if loan_count:
+        loans = [get_loan_input(index) for index in range(loan_count)]
+        financial_data["total_loans"] = sum(loan["balance"] for loan in loans)
+        financial_data["loans"] = loans
+    
+    while not loan_count:
         try:
             total_loans = float(input("Total Loans/Debt ($): "))
             if total_loans < 0:
@@ -0,0 +1,215 @@
+"""
+Health and Readiness for the Financial Analyzer Web Servers
+Records the latency and outcome of every upstream API call over a rolling
+window, and combines them with the servers' queue depths into the health
+report and the readiness check a load balancer polls.
+"""
+
+import contextlib
+import os
+import threading
+import time
+from collections import deque
+import anthropic
+import numpy as np
+
+OK = 'ok'
+ERROR = 'error'
+RATE_LIMITED = 'rate_limited'
+
+
+class UpstreamMonitor:
+    """Rolling latency percentiles and error and 429 rates of upstream calls."""
+
+    def __init__(self, window: float = 300, max_samples: int = 10000, clock=time.monotonic):
+        """
+        Args:
+            window: Seconds of calls the statistics cover
+            max_samples: Most calls kept, bounding memory under heavy load
+        """
+        self.window = window
+        self.clock = clock
+        self._samples = deque(maxlen=max_samples)
+        self._lock = threading.Lock()
+
+    def record(self, latency: float, outcome: str):
+        """Record one call's latency in seconds and its outcome."""
+        with self._lock:
+            self._samples.append((self.clock(), latency, outcome))
+
+    @contextlib.contextmanager
+    def observe(self):
+        """
+        Time the enclosed call and record its outcome.
+
+        API errors count as errors (429s separately); other exceptions, such
+        as cancellation, are not the upstream's doing and are not recorded.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        except anthropic.RateLimitError:
+            self.record(time.perf_counter() - start, RATE_LIMITED)
+            raise
+        except anthropic.APIError:
+            self.record(time.perf_counter() - start, ERROR)
+            raise
+        self.record(time.perf_counter() - start, OK)
+
+    def snapshot(self) -> dict:
+        """Return the call count, latency percentiles and error and 429 rates in the window."""
+        with self._lock:
+            cutoff = self.clock() - self.window
+            while self._samples and self._samples[0][0] < cutoff:
+                self._samples.popleft()
+            samples = list(self._samples)
+
+        calls = len(samples)
+        if not calls:
+            return {'calls': 0, 'window_s': self.window, 'latency_ms': None,
+                    'error_rate': 0.0, 'rate_limited_rate': 0.0}
+        latencies = np.array([latency for _, latency, _ in samples]) * 1000
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        outcomes = [outcome for _, _, outcome in samples]
+        return {
+            'calls': calls,
+            'window_s': self.window,
+            'latency_ms': {'p50': round(p50, 1), 'p95': round(p95, 1), 'p99': round(p99, 1)},
+            'error_rate': round(outcomes.count(ERROR) / calls, 4),
+            'rate_limited_rate': round(outcomes.count(RATE_LIMITED) / calls, 4)
+        }
+
+
+class _MonitoredStream:
+    """Wraps a message stream, recording the call when the stream is exited."""
+
+    def __init__(self, manager, monitor: UpstreamMonitor):
+        self._manager = manager
+        self._monitor = monitor
+        self._stream = None
+        self._start = None
+        self._closed = False
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        self._stream = self._manager.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # A stream closed on purpose fails its read; that isn't an upstream error
+        if not self._closed:
+            if exc is None:
+                outcome = OK
+            elif isinstance(exc, anthropic.RateLimitError):
+                outcome = RATE_LIMITED
+            elif isinstance(exc, anthropic.APIError):
+                outcome = ERROR
+            else:
+                outcome = None
+            if outcome is not None:
+                self._monitor.record(time.perf_counter() - self._start, outcome)
+        return self._manager.__exit__(exc_type, exc, tb)
+
+    def __iter__(self):
+        return iter(self._stream)
+
+    def close(self):
+        self._closed = True
+        self._stream.close()
+
+    def get_final_message(self):
+        return self._stream.get_final_message()
+
+
+class _MonitoredMessages:
+    """The ``messages`` resource of a MonitoredClient."""
+
+    def __init__(self, client, monitor: UpstreamMonitor):
+        self._client = client
+        self._monitor = monitor
+
+    def create(self, **request):
+        with self._monitor.observe():
+            return self._client.messages.create(**request)
+
+    def stream(self, **request):
+        return _MonitoredStream(self._client.messages.stream(**request), self._monitor)
+
+    def count_tokens(self, **request):
+        return self._client.messages.count_tokens(**request)
+
+
+class _AsyncMonitoredMessages(_MonitoredMessages):
+    """The ``messages`` resource of an AsyncMonitoredClient."""
+
+    async def create(self, **request):
+        with self._monitor.observe():
+            return await self._client.messages.create(**request)
+
+    async def count_tokens(self, **request):
+        return await self._client.messages.count_tokens(**request)
+
+
+class MonitoredClient:
+    """Stands in for an Anthropic client, recording each Messages API call with a monitor."""
+
+    _messages_class = _MonitoredMessages
+
+    def __init__(self, client, monitor: UpstreamMonitor):
+        self.messages = self._messages_class(client, monitor)
+
+
+class AsyncMonitoredClient(MonitoredClient):
+    """Asyncio variant of MonitoredClient."""
+
+    _messages_class = _AsyncMonitoredMessages
+
+
+class ReadinessPolicy:
+    """
+    Thresholds past which an instance reports itself not ready, so the load
+    balancer sends traffic elsewhere until it recovers.
+
+    Error and 429 rates are only judged once the window holds ``min_calls``
+    calls, so a single failure after a quiet spell doesn't flip readiness.
+    """
+
+    def __init__(self, max_queued: int = 32, max_error_rate: float = 0.5,
+                 max_rate_limited_rate: float = 0.25, max_p95_ms: float = 60000, min_calls: int = 10):
+        self.max_queued = max_queued
+        self.max_error_rate = max_error_rate
+        self.max_rate_limited_rate = max_rate_limited_rate
+        self.max_p95_ms = max_p95_ms
+        self.min_calls = min_calls
+
+    @classmethod
+    def from_env(cls):
+        """Create a policy configured from READY_* environment variables."""
+        return cls(
+            max_queued=int(os.getenv('READY_MAX_QUEUED', '32')),
+            max_error_rate=float(os.getenv('READY_MAX_ERROR_RATE', '0.5')),
+            max_rate_limited_rate=float(os.getenv('READY_MAX_RATE_LIMITED_RATE', '0.25')),
+            max_p95_ms=float(os.getenv('READY_MAX_P95_MS', '60000')),
+            min_calls=int(os.getenv('READY_MIN_CALLS', '10'))
+        )
+
+    def reasons(self, upstream: dict, scheduler: dict) -> list:
+        """
+        Return why the instance is not ready, or an empty list if it is.
+
+        Args:
+            upstream: UpstreamMonitor.snapshot()
+            scheduler: PriorityScheduler.stats()
+        """
+        reasons = []
+        queued = sum(scheduler['queued'].values())
+        if queued >= self.max_queued:
+            reasons.append(f'{queued} requests waiting for analyzer slots')
+        if upstream['calls'] >= self.min_calls:
+            if upstream['error_rate'] > self.max_error_rate:
+                reasons.append(f"upstream error rate {upstream['error_rate']:.0%}")
+            if upstream['rate_limited_rate'] > self.max_rate_limited_rate:
+                reasons.append(f"upstream 429 rate {upstream['rate_limited_rate']:.0%}")
+        if upstream['latency_ms'] and upstream['latency_ms']['p95'] > self.max_p95_ms:
+            reasons.append(f"upstream p95 latency {upstream['latency_ms']['p95']:.0f}ms")
+        return reasons
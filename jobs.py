@@ -0,0 +1,230 @@
+"""
+Background Job Queue for Financial Analyzer
+Runs long analyses on a bounded worker pool so web requests return immediately.
+"""
+
+import ipaddress
+import json
+import os
+import socket
+import threading
+import time
+import urllib.parse
+import urllib.request
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from cancellation import AnalysisCancelled, CancelToken
+
+
+class QueueFullError(Exception):
+    """Raised when the job queue has no room for another job."""
+
+
+def validate_callback_url(url) -> str:
+    """
+    Check that a client-supplied callback URL is safe for the server to POST to.
+
+    The URL must be http(s). If CALLBACK_ALLOWED_HOSTS (comma-separated host
+    names) is set, its host must be one of them; otherwise every address the
+    host resolves to must be public, so clients can't make the server reach
+    loopback, private, link-local (cloud metadata) or other internal targets.
+
+    Raises:
+        ValueError: If the URL is not a string, not http(s) or not allowed
+    """
+    if not isinstance(url, str):
+        raise ValueError("callback_url must be a string")
+    parsed = urllib.parse.urlsplit(url)
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        raise ValueError("callback_url must be an http(s) URL")
+    host = parsed.hostname.lower()
+
+    allowed = {h.strip().lower() for h in os.getenv("CALLBACK_ALLOWED_HOSTS", "").split(",") if h.strip()}
+    if allowed:
+        if host not in allowed:
+            raise ValueError("callback_url host is not allowed")
+        return url
+
+    try:
+        port = parsed.port or (443 if parsed.scheme == "https" else 80)
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP)}
+    except (OSError, ValueError):
+        raise ValueError("callback_url host could not be resolved")
+    for address in addresses:
+        # Drop any IPv6 zone suffix before parsing
+        if not ipaddress.ip_address(address.split("%")[0]).is_global:
+            raise ValueError("callback_url must not point to a private or internal address")
+    return url
+
+
+class _NoRedirects(urllib.request.HTTPRedirectHandler):
+    """Refuses redirects, which could lead a callback to an internal address."""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+class JobQueue:
+    """A bounded in-process job queue with result retention and eviction."""
+
+    def __init__(self, max_workers: int = 4, max_pending: int = 32,
+                 max_results: int = 500, result_ttl: float = 3600, callback_workers: int = 2):
+        """
+        Initialize the worker pool.
+
+        Args:
+            max_workers: Number of jobs that run at the same time
+            max_pending: Maximum number of unfinished (queued or running) jobs
+            max_results: Maximum number of finished jobs kept for polling
+            result_ttl: Seconds a finished job is kept before eviction
+            callback_workers: Threads delivering callbacks, kept apart from
+                the job workers so a slow receiver doesn't hold up analyses
+        """
+        self.max_pending = max_pending
+        self.max_results = max_results
+        self.result_ttl = result_ttl
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="analysis-job")
+        self._callback_executor = ThreadPoolExecutor(max_workers=callback_workers, thread_name_prefix="job-callback")
+        self._jobs = OrderedDict()
+        self._tokens = {}
+        self._lock = threading.Lock()
+
+    def submit(self, func, *args, callback_url: str = None, cancellable: bool = False, **kwargs) -> str:
+        """
+        Enqueue ``func(*args, **kwargs)`` and return its job ID.
+
+        Args:
+            func: Callable producing a JSON-serializable result
+            callback_url: Optional URL that receives the finished job as a
+                POST; check client-supplied URLs with validate_callback_url
+            cancellable: Pass ``func`` a ``cancel_token`` keyword argument
+                that ``cancel`` cancels while the job runs
+
+        Raises:
+            QueueFullError: If ``max_pending`` jobs are already unfinished
+        """
+        with self._lock:
+            self._evict()
+            pending = sum(1 for job in self._jobs.values() if job["status"] in ("queued", "running"))
+            if pending >= self.max_pending:
+                raise QueueFullError(f"Job queue is full ({pending} jobs pending)")
+
+            job_id = uuid.uuid4().hex
+            self._jobs[job_id] = {
+                "job_id": job_id,
+                "status": "queued",
+                "created_at": time.time(),
+                "started_at": None,
+                "finished_at": None,
+                "result": None,
+                "error": None
+            }
+            if cancellable:
+                kwargs["cancel_token"] = self._tokens[job_id] = CancelToken()
+
+        self._executor.submit(self._run, job_id, func, args, kwargs, callback_url)
+        return job_id
+
+    def cancel(self, job_id: str) -> dict:
+        """
+        Cancel a job and return its snapshot, or None if it is unknown.
+
+        A cancellable job, queued or running, is told to stop through its
+        token and reports ``cancelled`` once it has, so it can still release
+        anything it holds. Any other queued job is cancelled outright and
+        never starts. A finished job is unchanged.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            token = self._tokens.get(job_id)
+            if job["status"] == "queued" and token is None:
+                job.update(status="cancelled", finished_at=time.time())
+            snapshot = dict(job)
+        if token is not None:
+            token.cancel()
+        return snapshot
+
+    def get(self, job_id: str) -> dict:
+        """Return a snapshot of a job, or None if it is unknown or evicted."""
+        with self._lock:
+            self._evict()
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def stats(self) -> dict:
+        """Return the number of jobs in each status."""
+        with self._lock:
+            counts = {"queued": 0, "running": 0, "succeeded": 0, "failed": 0, "cancelled": 0}
+            for job in self._jobs.values():
+                counts[job["status"]] += 1
+            return counts
+
+    def shutdown(self, wait: bool = True):
+        """Stop accepting jobs and optionally wait for running ones and their callbacks."""
+        self._executor.shutdown(wait=wait)
+        self._callback_executor.shutdown(wait=wait)
+
+    def _run(self, job_id, func, args, kwargs, callback_url):
+        """Execute a job in a worker thread and record its outcome."""
+        with self._lock:
+            job = self._jobs[job_id]
+            if job["status"] == "cancelled":
+                return
+            job["status"] = "running"
+            job["started_at"] = time.time()
+
+        try:
+            result = func(*args, **kwargs)
+            update = {"status": "succeeded", "result": result}
+        except AnalysisCancelled:
+            update = {"status": "cancelled"}
+        except Exception as e:
+            print(f"Error in job {job_id}: {str(e)}")
+            update = {"status": "failed", "error": str(e)}
+
+        with self._lock:
+            self._tokens.pop(job_id, None)
+            job.update(update, finished_at=time.time())
+            # Keep finished jobs ordered by completion time for eviction
+            self._jobs.move_to_end(job_id)
+            snapshot = dict(job)
+
+        if callback_url:
+            self._callback_executor.submit(self._send_callback, callback_url, snapshot)
+
+    def _evict(self):
+        """Drop expired finished jobs and trim to ``max_results``. Caller holds the lock."""
+        now = time.time()
+        finished = [
+            job_id for job_id, job in self._jobs.items()
+            if job["finished_at"] is not None
+        ]
+        overflow = len(finished) - self.max_results
+        for job_id in finished:
+            if overflow > 0 or now - self._jobs[job_id]["finished_at"] > self.result_ttl:
+                del self._jobs[job_id]
+                overflow -= 1
+
+    @staticmethod
+    def _send_callback(url: str, job: dict):
+        """POST the finished job to the client's callback URL."""
+        try:
+            # Resolve again, in case the host's DNS changed since submission
+            validate_callback_url(url)
+        except ValueError as e:
+            print(f"Callback to {url} refused for job {job['job_id']}: {str(e)}")
+            return
+        request = urllib.request.Request(
+            url,
+            data=json.dumps(job).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            method="POST"
+        )
+        try:
+            with urllib.request.build_opener(_NoRedirects).open(request, timeout=10):
+                pass
+        except Exception as e:
+            print(f"Callback to {url} failed for job {job['job_id']}: {str(e)}")
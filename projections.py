@@ -0,0 +1,218 @@
+"""
+Monte Carlo Projections for Financial Analyzer
+Simulates many possible paths of savings, debt paydown and investment growth
+from the five financial inputs, vectorized across paths with NumPy.
+"""
+
+import functools
+import json
+import numpy as np
+
+# Paths simulated by default. Percentile bands are stable to within about a
+# percent at this count, and a projection takes ~15 ms and well under 1 MB.
+DEFAULT_PATHS = 2000
+
+# Profiles whose default projection is kept for reuse
+PROJECTION_CACHE_SIZE = 1024
+
+# Assumed annual rate distributions (mean, standard deviation) and cash-flow rules
+DEFAULT_ASSUMPTIONS = {
+    'years': 10,
+    'income_growth': (0.03, 0.02),
+    'expense_inflation': (0.03, 0.01),
+    'savings_return': (0.02, 0.005),
+    'investment_return': (0.07, 0.15),
+    'loan_apr': 0.07,
+    # Share of the monthly surplus put towards debt while any remains
+    'debt_payment_share': 0.5,
+    # Share of the rest of the surplus that is invested instead of saved
+    'investment_share': 0.5
+}
+
+PERCENTILES = (10, 50, 90)
+
+
+def simulate_projections(financial_data: dict, n_paths: int = DEFAULT_PATHS, seed: int = 0,
+                         assumptions: dict = None) -> dict:
+    """
+    Project savings, debt, investments and net worth over time.
+
+    Each month, income and expenses grow with the path's drawn annual rates,
+    debt accrues interest, the surplus pays down debt and is split between
+    savings and investments, and a deficit is drawn from savings and then
+    borrowed. Returns are drawn independently for every path and month.
+    Balances are simulated in float32, which halves memory and time against
+    float64 at well under a cent of error per dollar.
+
+    Args:
+        financial_data: Dictionary with the five financial inputs
+        n_paths: Number of simulated paths
+        seed: Random seed, so the same inputs give the same projection
+        assumptions: Overrides for DEFAULT_ASSUMPTIONS
+
+    Returns:
+        Dictionary with yearly 10th/50th/90th percentiles of each balance
+        and summary probabilities, all JSON-serializable
+    """
+    params = dict(DEFAULT_ASSUMPTIONS, **(assumptions or {}))
+    years = int(params['years'])
+    rng = np.random.default_rng(seed)
+
+    # Per-path annual rates, redrawn every year
+    def draw_annual(name):
+        mean, std = params[name]
+        return rng.normal(mean, std, size=(years, n_paths)).astype(np.float32)
+
+    income_growth = draw_annual('income_growth')
+    expense_inflation = draw_annual('expense_inflation')
+    savings_return = draw_annual('savings_return')
+    invest_mean, invest_std = params['investment_return']
+
+    income = np.full(n_paths, financial_data['annual_income'] / 12, dtype=np.float32)
+    expenses = np.full(n_paths, financial_data['monthly_expenses'], dtype=np.float32)
+    savings = np.full(n_paths, financial_data['total_savings'], dtype=np.float32)
+    debt = np.full(n_paths, financial_data['total_loans'], dtype=np.float32)
+    investments = np.full(n_paths, financial_data['investment_amount'], dtype=np.float32)
+    months_to_debt_free = np.where(debt > 0, -1, 0)
+    ever_depleted = np.zeros(n_paths, dtype=bool)
+
+    # Itemized loans replace the assumed APR with their balance-weighted APR
+    loans = financial_data.get('loans')
+    total_balance = sum(loan['balance'] for loan in loans) if loans else 0
+    if total_balance > 0:
+        params['loan_apr'] = sum(loan['balance'] * loan['apr'] for loan in loans) / total_balance / 100
+
+    loan_rate = params['loan_apr'] / 12
+    debt_share = params['debt_payment_share']
+    invest_share = params['investment_share']
+
+    snapshots = {name: np.empty((years + 1, n_paths), dtype=np.float32) for name in ('savings', 'debt', 'investments')}
+    for name, balance in (('savings', savings), ('debt', debt), ('investments', investments)):
+        snapshots[name][0] = balance
+
+    monthly_mean, monthly_std = invest_mean / 12, invest_std / np.sqrt(12)
+    debt_share_by_path = np.empty(n_paths, dtype=np.float32)
+    for month in range(years * 12):
+        year, month_of_year = divmod(month, 12)
+        if month_of_year == 0:
+            if year:
+                income *= 1 + income_growth[year - 1]
+                expenses *= 1 + expense_inflation[year - 1]
+            surplus = income - expenses
+            positive = np.maximum(surplus, 0)
+            shortfall = np.maximum(-surplus, 0)
+            # Monthly investment returns, drawn a year at a time to bound memory
+            investment_growth = rng.standard_normal((12, n_paths), dtype=np.float32)
+            investment_growth *= monthly_std
+            investment_growth += 1 + monthly_mean
+            np.maximum(investment_growth, 0, out=investment_growth)
+            savings_growth = 1 + savings_return[year] / 12
+
+        debt *= np.float32(1 + loan_rate)
+
+        # Positive surplus: pay down debt, then split the rest
+        np.multiply(debt > 0, debt_share, out=debt_share_by_path)
+        debt_payment = np.minimum(debt, positive * debt_share_by_path)
+        debt -= debt_payment
+        remaining = positive - debt_payment
+        investments += remaining * invest_share
+        remaining *= 1 - invest_share
+        savings += remaining
+
+        # Negative surplus: draw from savings, then borrow
+        from_savings = np.minimum(savings, shortfall)
+        savings -= from_savings
+        borrowed = shortfall - from_savings
+        debt += borrowed
+        ever_depleted |= borrowed > 0
+
+        savings *= savings_growth
+        investments *= investment_growth[month_of_year]
+
+        # A path only counts as debt-free if it stays so; borrowing again resets it
+        months_to_debt_free[debt > 0.01] = -1
+        newly_free = (months_to_debt_free < 0) & (debt <= 0.01)
+        months_to_debt_free[newly_free] = month + 1
+
+        if month_of_year == 11:
+            for name, balance in (('savings', savings), ('debt', debt), ('investments', investments)):
+                snapshots[name][year + 1] = balance
+
+    snapshots['net_worth'] = snapshots['savings'] + snapshots['investments'] - snapshots['debt']
+
+    result = {
+        'paths': n_paths,
+        'years': list(range(years + 1)),
+        'probability_debt_free': round(float(np.mean(months_to_debt_free >= 0)), 4),
+        'median_months_to_debt_free': None,
+        'probability_savings_depleted': round(float(np.mean(ever_depleted)), 4),
+        'assumptions': {key: list(value) if isinstance(value, tuple) else value for key, value in params.items()}
+    }
+
+    # The median is only defined when at least half the paths pay off their
+    # debt; paths that never do count as longer than the horizon
+    paid_off = months_to_debt_free >= 0
+    if paid_off.mean() >= 0.5:
+        result['median_months_to_debt_free'] = int(np.median(np.where(paid_off, months_to_debt_free, years * 12 + 1)))
+
+    for name, values in snapshots.items():
+        bands = np.percentile(values, PERCENTILES, axis=1)
+        result[name] = {f'p{p}': [round(float(v), 2) for v in band] for p, band in zip(PERCENTILES, bands)}
+
+    return result
+
+
+@functools.lru_cache(maxsize=PROJECTION_CACHE_SIZE)
+def _cached_projection(profile_json: str) -> dict:
+    return simulate_projections(json.loads(profile_json))
+
+
+def projection_for(financial_data: dict) -> dict:
+    """
+    The default projection of a profile, computed once and then reused.
+
+    Projections are deterministic, so every request for the same inputs
+    shares one result; callers must treat it as read-only.
+    """
+    profile = {key: financial_data[key] for key in
+               ('annual_income', 'total_savings', 'total_loans', 'monthly_expenses', 'investment_amount')}
+    if financial_data.get('loans'):
+        profile['loans'] = [{'balance': loan['balance'], 'apr': loan['apr']} for loan in financial_data['loans']]
+    return _cached_projection(json.dumps(profile, sort_keys=True))
+
+
+def summarize_projection(projection: dict, compact: bool = False) -> str:
+    """
+    Describe a projection in a few lines for the analysis prompt.
+
+    With ``compact`` the same figures are encoded tersely on one line.
+    """
+    years = projection['years'][-1]
+    midpoint = years // 2
+    net_worth = projection['net_worth']
+
+    if compact:
+        bands = " ".join(
+            f"{year}y={net_worth['p50'][year]:.0f}[{net_worth['p10'][year]:.0f},{net_worth['p90'][year]:.0f}]"
+            for year in (midpoint, years)
+        )
+        line = (f"projection({projection['paths']} paths): net_worth p50[p10,p90] {bands} "
+                f"p_debt_free_{years}y={projection['probability_debt_free']:.2f}")
+        if projection['median_months_to_debt_free'] is not None:
+            line += f" median_debt_free_mo={projection['median_months_to_debt_free']}"
+        return line + f" p_savings_depleted={projection['probability_savings_depleted']:.2f}"
+
+    lines = [
+        f"Monte Carlo projection ({projection['paths']:,} paths, {years} years, "
+        f"assumed {projection['assumptions']['investment_return'][0]:.0%} mean investment return):"
+    ]
+    for year in (midpoint, years):
+        lines.append(
+            f"- Net worth in {year} years: median ${net_worth['p50'][year]:,.0f} "
+            f"(10th-90th percentile ${net_worth['p10'][year]:,.0f} to ${net_worth['p90'][year]:,.0f})"
+        )
+    lines.append(f"- Probability of being debt-free within {years} years: {projection['probability_debt_free']:.0%}")
+    if projection['median_months_to_debt_free'] is not None:
+        lines.append(f"- Median time to debt-free: {projection['median_months_to_debt_free']} months")
+    lines.append(f"- Probability of running out of savings: {projection['probability_savings_depleted']:.0%}")
+    return "\n".join(lines)
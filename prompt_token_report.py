@@ -0,0 +1,139 @@
+"""
+Prompt Token Report for Financial Analyzer
+Compares the input tokens each turn of an analysis sends in the verbose and
+compact prompt modes, using canned replies so no analysis is actually run.
+
+Run with:
+    python prompt_token_report.py          # offline estimate (~4 characters per token)
+    python prompt_token_report.py --api    # exact counts from the token counting endpoint
+"""
+
+import argparse
+import json
+import os
+import sys
+from types import SimpleNamespace
+import anthropic
+from anthropic.resources import Messages
+from financial_analyzer import FinancialAnalyzer, RISK_METRICS_TOOL, SUMMARY_MARKER
+
+PROFILES = {
+    "Young Professional": {
+        "annual_income": 65000,
+        "total_savings": 15000,
+        "total_loans": 35000,
+        "monthly_expenses": 2500,
+        "investment_amount": 5000
+    },
+    "Itemized Loans": {
+        "annual_income": 55000,
+        "total_savings": 3000,
+        "total_loans": 47000,
+        "monthly_expenses": 3500,
+        "investment_amount": 0,
+        "loans": [
+            {"name": "Credit card", "balance": 12000.0, "apr": 24.9, "minimum_payment": 300.0},
+            {"name": "Car", "balance": 15000.0, "apr": 6.5, "minimum_payment": 350.0},
+            {"name": "Student loan", "balance": 20000.0, "apr": 4.5, "minimum_payment": 220.0}
+        ]
+    }
+}
+
+# Stand-in for a typical first reply: about 700 tokens of prose
+CANNED_ANALYSIS = (
+    "Your debt-to-savings ratio is elevated, and while your monthly surplus is healthy, "
+    "the balance between paying down debt, building an emergency fund and investing deserves "
+    "attention. The projections show net worth growing steadily in most scenarios, but the "
+    "lower percentiles highlight sensitivity to investment returns and expense growth. "
+) * 8
+CANNED_SUMMARY = f"\n{SUMMARY_MARKER} Elevated debt relative to savings, solid surplus; prioritize the " \
+                 "emergency fund and high-APR debt, then raise investments."
+CANNED_METRICS = {
+    "risk_score": 55,
+    "risk_factors": ["Debt exceeds savings", "Thin emergency fund", "Concentrated high-APR debt"],
+    "gain_opportunities": ["Pay off high-APR debt", "Automate savings", "Increase index investing"]
+}
+
+
+def _canned_responses(compact: bool):
+    """The replies sent back into the conversation, turn by turn."""
+    return [
+        SimpleNamespace(content=[SimpleNamespace(
+            type="text", text=CANNED_ANALYSIS + (CANNED_SUMMARY if compact else ""))]),
+        SimpleNamespace(content=[SimpleNamespace(
+            type="tool_use", id="toolu_report", name=RISK_METRICS_TOOL["name"], input=CANNED_METRICS)]),
+        SimpleNamespace(content=[SimpleNamespace(type="text", text="1. ...")])
+    ]
+
+
+def collect_requests(analyzer: FinancialAnalyzer, financial_data: dict) -> list:
+    """Drive the analysis conversation with canned replies and return each turn's request."""
+    requests = []
+    steps = analyzer._analysis_steps(financial_data)
+    request = next(steps)
+    for response in _canned_responses(analyzer.compact):
+        # The history list is shared between turns, so snapshot each request
+        requests.append(json.loads(json.dumps(request)))
+        try:
+            request = steps.send(response)
+        except StopIteration:
+            break
+    requests.append(analyzer._risk_assessment_request(financial_data))
+    return requests
+
+
+def estimate_tokens(request: dict) -> int:
+    """Approximate the input tokens of a request at ~4 characters per token."""
+    payload = {key: request[key] for key in ('system', 'messages', 'tools') if key in request}
+    return round(len(json.dumps(payload)) / 4)
+
+
+def count_tokens(client, request: dict) -> int:
+    """Count the input tokens of a request exactly with the token counting endpoint."""
+    fields = {key: value for key, value in request.items() if key != 'max_tokens'}
+    return client.messages.count_tokens(**fields).input_tokens
+
+
+def token_counting_unavailable() -> str:
+    """Why exact counts can't be taken with the installed SDK, or None if they can."""
+    if not hasattr(Messages, 'count_tokens'):
+        return (f"--api needs messages.count_tokens, which anthropic {anthropic.__version__} lacks; "
+                "install the version in requirements.txt")
+    if not os.getenv('ANTHROPIC_API_KEY'):
+        return "--api needs ANTHROPIC_API_KEY"
+    return None
+
+
+def main():
+    """Print per-turn input tokens for each profile in both prompt modes."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--api', action='store_true', help='Count tokens exactly with the Anthropic API')
+    args = parser.parse_args()
+
+    if args.api:
+        problem = token_counting_unavailable()
+        if problem:
+            sys.exit(f"Error: {problem}")
+    else:
+        # Requests are only built, never sent
+        os.environ.setdefault('ANTHROPIC_API_KEY', 'offline')
+
+    verbose, compact = FinancialAnalyzer(compact=False), FinancialAnalyzer(compact=True)
+    count = (lambda request: count_tokens(verbose.client, request)) if args.api else estimate_tokens
+
+    print(f"Input tokens per request ({'exact' if args.api else 'estimated'})")
+    print(f"{'Profile':<20} {'Mode':<8} {'Turn 1':>7} {'Turn 2':>7} {'Turn 3':>7} {'Analysis':>9} {'Quick':>6}")
+    try:
+        for name, profile in PROFILES.items():
+            totals = {}
+            for mode, analyzer in (('verbose', verbose), ('compact', compact)):
+                *turns, quick = [count(request) for request in collect_requests(analyzer, profile)]
+                totals[mode] = sum(turns)
+                print(f"{name:<20} {mode:<8} {turns[0]:>7,} {turns[1]:>7,} {turns[2]:>7,} {sum(turns):>9,} {quick:>6,}")
+            print(f"{'':<20} saving   {1 - totals['compact'] / totals['verbose']:>43.0%}")
+    except anthropic.APIError as e:
+        sys.exit(f"Error: token counting request failed: {e}")
+
+
+if __name__ == '__main__':
+    main()
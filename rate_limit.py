@@ -0,0 +1,218 @@
+"""
+Admission Control for the Financial Analyzer Web Servers
+Token-bucket rate limiting of requests and estimated tokens, per client and
+for the shared Anthropic quota, with a bounded wait queue for excess work.
+"""
+
+import asyncio
+import math
+import os
+import threading
+import time
+
+# Rough upper bounds on the tokens one call of each kind spends upstream:
+# three turns that each resend the growing history plus up to 1000 output
+# tokens, versus one short prompt with up to 200 output tokens.
+ANALYSIS_TOKEN_ESTIMATE = 6000
+QUICK_ASSESSMENT_TOKEN_ESTIMATE = 500
+# Compact prompts (COMPACT_PROMPTS=1) resend about a third of the input tokens
+COMPACT_ANALYSIS_TOKEN_ESTIMATE = 4000
+# A follow-up chat turn: the analysis context, up to the history budget and
+# the reply, plus the occasional summarization request
+CHAT_TOKEN_ESTIMATE = 4000
+
+
+class RateLimitExceeded(Exception):
+    """Raised when a request cannot be admitted within the allowed wait."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        """Value for the Retry-After header (whole seconds, at least 1)."""
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class TokenBucket:
+    """
+    A token bucket refilled continuously at ``rate_per_minute``.
+
+    Reservations may take the balance negative; the deficit is the time later
+    callers have to wait, which queues them in arrival order.
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: float = None, clock=time.monotonic):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.tokens = self.capacity
+        self.clock = clock
+        self.updated = clock()
+
+    def _refill(self):
+        """Add the tokens earned since the last update."""
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until ``amount`` tokens would be available."""
+        self._refill()
+        deficit = amount - self.tokens
+        return deficit / self.rate if deficit > 0 else 0.0
+
+    def take(self, amount: float):
+        """Remove ``amount`` tokens, possibly going into deficit."""
+        self._refill()
+        self.tokens -= amount
+
+
+class RateLimiter:
+    """Per-client and upstream admission control for analyzer calls."""
+
+    def __init__(self, client_rpm: float = 10, client_tpm: float = 40000,
+                 upstream_rpm: float = 50, upstream_tpm: float = 80000,
+                 max_wait: float = 30, max_queue_per_client: int = 5,
+                 max_queue: int = 100, priority_share: float = 0, clock=time.monotonic):
+        """
+        Initialize the limiter.
+
+        Args:
+            client_rpm: Requests per minute allowed for each client
+            client_tpm: Estimated tokens per minute allowed for each client
+            upstream_rpm: Requests per minute allowed across all clients
+            upstream_tpm: Estimated tokens per minute allowed across all clients
+            max_wait: Longest a request may be held before it is rejected
+            max_queue_per_client: Requests one client may have waiting
+            max_queue: Requests that may be waiting in total
+            priority_share: Fraction of the upstream quota held back for
+                priority requests (quick assessments), which may also use
+                the rest; other requests only get the rest
+        """
+        self.client_rpm = client_rpm
+        self.client_tpm = client_tpm
+        self.max_wait = max_wait
+        self.max_queue_per_client = max_queue_per_client
+        self.max_queue = max_queue
+        self.clock = clock
+        self.upstream_requests = TokenBucket(upstream_rpm * (1 - priority_share), clock=clock)
+        self.upstream_tokens = TokenBucket(upstream_tpm * (1 - priority_share), clock=clock)
+        # A backlog of analyses drains the shared buckets into deficit, which
+        # would make a quick assessment wait behind all of it in arrival order
+        self.priority_buckets = (
+            TokenBucket(upstream_rpm * priority_share, clock=clock),
+            TokenBucket(upstream_tpm * priority_share, clock=clock)
+        ) if priority_share > 0 else None
+        self._clients = {}
+        self._waiting = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """Create a limiter configured from RATE_LIMIT_* environment variables."""
+        return cls(
+            client_rpm=float(os.getenv('RATE_LIMIT_CLIENT_RPM', '10')),
+            client_tpm=float(os.getenv('RATE_LIMIT_CLIENT_TPM', '40000')),
+            upstream_rpm=float(os.getenv('RATE_LIMIT_UPSTREAM_RPM', '50')),
+            upstream_tpm=float(os.getenv('RATE_LIMIT_UPSTREAM_TPM', '80000')),
+            max_wait=float(os.getenv('RATE_LIMIT_MAX_WAIT', '30')),
+            max_queue_per_client=int(os.getenv('RATE_LIMIT_MAX_QUEUE_PER_CLIENT', '5')),
+            max_queue=int(os.getenv('RATE_LIMIT_MAX_QUEUE', '100')),
+            priority_share=float(os.getenv('RATE_LIMIT_PRIORITY_SHARE', '0.2'))
+        )
+
+    def reserve(self, client_id: str, estimated_tokens: float, priority: bool = False) -> float:
+        """
+        Book capacity for one request and return how long it must wait.
+
+        A ``priority`` request books whichever of the shared and the held-back
+        upstream quota admits it sooner.
+
+        If the returned wait is positive the request counts towards the wait
+        queue, and the caller must sleep that long and then call ``release``
+        (``acquire`` and ``acquire_async`` do both).
+
+        Raises:
+            RateLimitExceeded: If the wait would exceed ``max_wait`` or the
+                wait queue for the client or the server is full
+        """
+        with self._lock:
+            buckets = self._clients.get(client_id)
+            if buckets is None:
+                buckets = (
+                    TokenBucket(self.client_rpm, clock=self.clock),
+                    TokenBucket(self.client_tpm, clock=self.clock)
+                )
+                self._clients[client_id] = buckets
+            client_requests, client_tokens = buckets
+
+            upstream_requests, upstream_tokens = self.upstream_requests, self.upstream_tokens
+            upstream_wait = max(upstream_requests.wait_time(1), upstream_tokens.wait_time(estimated_tokens))
+            if priority and self.priority_buckets is not None:
+                priority_requests, priority_tokens = self.priority_buckets
+                priority_wait = max(priority_requests.wait_time(1), priority_tokens.wait_time(estimated_tokens))
+                if priority_wait < upstream_wait:
+                    upstream_requests, upstream_tokens = self.priority_buckets
+                    upstream_wait = priority_wait
+            wait = max(
+                client_requests.wait_time(1),
+                client_tokens.wait_time(estimated_tokens),
+                upstream_wait
+            )
+
+            waiting = self._waiting.get(client_id, 0)
+            if wait > 0:
+                if wait > self.max_wait:
+                    raise RateLimitExceeded(f'Rate limit exceeded, retry in {wait:.0f}s', wait)
+                if waiting >= self.max_queue_per_client or sum(self._waiting.values()) >= self.max_queue:
+                    raise RateLimitExceeded('Too many requests waiting', wait)
+
+            for bucket, amount in ((client_requests, 1), (client_tokens, estimated_tokens),
+                                   (upstream_requests, 1), (upstream_tokens, estimated_tokens)):
+                bucket.take(amount)
+            if wait > 0:
+                self._waiting[client_id] = waiting + 1
+            self._prune()
+            return wait
+
+    def release(self, client_id: str):
+        """Mark a reserved request as no longer waiting."""
+        with self._lock:
+            remaining = self._waiting.get(client_id, 0) - 1
+            if remaining > 0:
+                self._waiting[client_id] = remaining
+            else:
+                self._waiting.pop(client_id, None)
+
+    def acquire(self, client_id: str, estimated_tokens: float, priority: bool = False):
+        """Block until the request is admitted. Raises RateLimitExceeded."""
+        wait = self.reserve(client_id, estimated_tokens, priority)
+        if wait > 0:
+            try:
+                time.sleep(wait)
+            finally:
+                self.release(client_id)
+
+    async def acquire_async(self, client_id: str, estimated_tokens: float, priority: bool = False):
+        """Asynchronous version of ``acquire``."""
+        wait = self.reserve(client_id, estimated_tokens, priority)
+        if wait > 0:
+            try:
+                await asyncio.sleep(wait)
+            finally:
+                self.release(client_id)
+
+    def stats(self) -> dict:
+        """Return the number of requests waiting for admission and of clients tracked."""
+        with self._lock:
+            return {'waiting': sum(self._waiting.values()), 'clients': len(self._clients)}
+
+    def _prune(self):
+        """Forget idle clients whose buckets have refilled. Caller holds the lock."""
+        if len(self._clients) < 10000:
+            return
+        for client_id, (requests, tokens) in list(self._clients.items()):
+            if client_id not in self._waiting and requests.wait_time(requests.capacity) == 0 \
+                    and tokens.wait_time(tokens.capacity) == 0:
+                del self._clients[client_id]
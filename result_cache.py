@@ -0,0 +1,253 @@
+"""
+Shared Result Cache for Financial Analyzer
+Stores finished analyses and quick assessments in a SQLite file (in WAL
+mode) that every web server worker process and the Streamlit app open, so
+a profile analyzed by one process is answered from the cache by all of
+them. Entries expire after a TTL and the least recently used are evicted
+beyond a size bound. A lease per key makes concurrent requests for the same
+profile wait for one computation instead of each calling the API.
+
+Enabled by setting RESULT_CACHE_PATH, for example to
+``/var/cache/financial-analyzer/results.sqlite3``.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+# Seconds between checks while another process computes a leased result
+LEASE_POLL_INTERVAL = 0.1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_last_access ON results (last_access);
+CREATE TABLE IF NOT EXISTS leases (
+    key TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+"""
+
+
+def _canonical(value):
+    """Normalize numbers so 85000 and 85000.0 give the same key."""
+    if isinstance(value, bool) or value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, dict):
+        return {str(k): _canonical(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_canonical(v) for v in value]
+    return str(value)
+
+
+def cache_key(kind: str, payload: dict) -> str:
+    """Return the cache key for a result of ``kind`` computed from ``payload``."""
+    canonical = json.dumps(_canonical(payload), sort_keys=True, separators=(",", ":"))
+    return f"{kind}:{hashlib.sha256(canonical.encode('utf-8')).hexdigest()[:32]}"
+
+
+def analyzer_cache_key(kind: str, analyzer, financial_data: dict) -> str:
+    """The key for an analyzer's result for a profile, which depends on its model and prompt mode."""
+    return cache_key(kind, {"model": analyzer.model, "compact": analyzer.compact, "input": financial_data})
+
+
+class ResultCache:
+    """
+    A cross-process cache of JSON-serializable results in a SQLite file.
+
+    Each thread gets its own connection. Reads and writes are single short
+    statements, so with WAL readers never block on the writer and a write
+    waits at most for another process's statement to finish.
+    """
+
+    def __init__(self, path: str, ttl: float = 3600, max_entries: int = 5000, lease_ttl: float = 180):
+        """
+        Open (creating if needed) a cache file.
+
+        Args:
+            path: SQLite database file shared by the processes
+            ttl: Seconds a result stays fresh
+            max_entries: Entries kept before the least recently used are evicted
+            lease_ttl: Seconds after which a computation's lease is presumed
+                abandoned (its process died) and another caller takes over
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lease_ttl = lease_ttl
+        self._local = threading.local()
+        self._counts = {"hits": 0, "misses": 0, "coalesced": 0}
+        self._counts_lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection().executescript(SCHEMA)
+
+    @classmethod
+    def from_env(cls):
+        """Open the cache named by RESULT_CACHE_PATH, or return None if it is unset."""
+        path = os.getenv("RESULT_CACHE_PATH")
+        if not path:
+            return None
+        return cls(
+            path,
+            ttl=float(os.getenv("RESULT_CACHE_TTL", "3600")),
+            max_entries=int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "5000"))
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        """This thread's connection, opened on first use."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            # Autocommit, so each statement is its own short transaction
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def _count(self, name: str):
+        with self._counts_lock:
+            self._counts[name] += 1
+
+    def get(self, key: str):
+        """Return the fresh result for ``key``, or None."""
+        now = time.time()
+        connection = self._connection()
+        row = connection.execute(
+            "SELECT value FROM results WHERE key = ? AND expires_at > ?", (key, now)
+        ).fetchone()
+        if row is None:
+            return None
+        connection.execute("UPDATE results SET last_access = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def set(self, key: str, value):
+        """Store a result, evicting expired and least recently used entries beyond ``max_entries``."""
+        now = time.time()
+        connection = self._connection()
+        connection.execute(
+            "INSERT OR REPLACE INTO results (key, value, expires_at, last_access) VALUES (?, ?, ?, ?)",
+            (key, json.dumps(value), now + self.ttl, now)
+        )
+        connection.execute("DELETE FROM results WHERE expires_at <= ?", (now,))
+        connection.execute(
+            "DELETE FROM results WHERE key IN "
+            "(SELECT key FROM results ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+
+    def delete(self, key: str):
+        """Drop a result."""
+        self._connection().execute("DELETE FROM results WHERE key = ?", (key,))
+
+    def _acquire_lease(self, key: str, owner: str) -> bool:
+        """Take the lease to compute ``key`` unless another live caller holds it."""
+        now = time.time()
+        connection = self._connection()
+        connection.execute("DELETE FROM leases WHERE key = ? AND expires_at <= ?", (key, now))
+        cursor = connection.execute(
+            "INSERT OR IGNORE INTO leases (key, owner, expires_at) VALUES (?, ?, ?)",
+            (key, owner, now + self.lease_ttl)
+        )
+        return cursor.rowcount == 1
+
+    def _release_lease(self, key: str, owner: str):
+        self._connection().execute("DELETE FROM leases WHERE key = ? AND owner = ?", (key, owner))
+
+    def _lease_held(self, key: str) -> bool:
+        row = self._connection().execute(
+            "SELECT 1 FROM leases WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+        return row is not None
+
+    def get_or_compute(self, key: str, compute, cancel_token=None):
+        """
+        Return the cached result for ``key``, computing and storing it on a miss.
+
+        If another thread or process is already computing it, wait for that
+        result instead; if that computation fails or its lease lapses, take
+        over. Results are only stored when ``compute`` returns normally.
+
+        Args:
+            compute: Callable returning a JSON-serializable result
+            cancel_token: Optional CancelToken that stops the wait
+        """
+        owner = uuid.uuid4().hex
+        waited = False
+        while True:
+            value = self.get(key)
+            if value is not None:
+                self._count("coalesced" if waited else "hits")
+                return value
+            if self._acquire_lease(key, owner):
+                break
+            waited = True
+            while self._lease_held(key):
+                if cancel_token is not None:
+                    if cancel_token.wait(LEASE_POLL_INTERVAL):
+                        cancel_token.raise_if_cancelled()
+                else:
+                    time.sleep(LEASE_POLL_INTERVAL)
+
+        self._count("misses")
+        try:
+            value = compute()
+            self.set(key, value)
+            return value
+        finally:
+            self._release_lease(key, owner)
+
+    async def get_or_compute_async(self, key: str, compute, cancel_token=None):
+        """
+        Asynchronous version of ``get_or_compute``; ``compute`` is a coroutine
+        function. The SQLite calls, which can wait on another process's
+        write, run in worker threads so they never block the event loop.
+        """
+        owner = uuid.uuid4().hex
+        waited = False
+        while True:
+            value = await asyncio.to_thread(self.get, key)
+            if value is not None:
+                self._count("coalesced" if waited else "hits")
+                return value
+            if await asyncio.to_thread(self._acquire_lease, key, owner):
+                break
+            waited = True
+            while await asyncio.to_thread(self._lease_held, key):
+                if cancel_token is not None:
+                    cancel_token.raise_if_cancelled()
+                await asyncio.sleep(LEASE_POLL_INTERVAL)
+
+        self._count("misses")
+        try:
+            value = await compute()
+            await asyncio.to_thread(self.set, key, value)
+            return value
+        finally:
+            await asyncio.to_thread(self._release_lease, key, owner)
+
+    def stats(self) -> dict:
+        """
+        Return this process's hits, misses and coalesced waits, its hit ratio
+        and the number of entries shared by all processes.
+        """
+        entries = self._connection().execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        with self._counts_lock:
+            counts = dict(self._counts)
+        lookups = sum(counts.values())
+        counts["hit_ratio"] = round((counts["hits"] + counts["coalesced"]) / lookups, 4) if lookups else 0.0
+        counts["entries"] = entries
+        return counts
@@ -0,0 +1,154 @@
+"""
+Deterministic Risk Scoring for Financial Analyzer
+Rule-based metrics, 0-100 risk scores and risk bands computed locally with
+NumPy, so whole arrays of profiles can be scored without calling the API.
+"""
+
+import numpy as np
+
+# Boundaries between the Low, Medium, High and Critical bands, matching
+# financial_analyzer.get_risk_level
+BAND_EDGES = (25, 50, 75)
+RISK_LEVELS = np.array(['Low', 'Medium', 'High', 'Critical'])
+
+# Points each risk component contributes at its worst; they sum to 100
+WEIGHTS = {
+    'debt_to_income': 35,
+    'savings_rate': 25,
+    'emergency_fund': 25,
+    'debt_to_assets': 15
+}
+
+
+def compute_metrics(annual_income, total_savings, total_loans, monthly_expenses, investment_amount) -> dict:
+    """
+    Compute the deterministic financial metrics for one or many profiles.
+
+    Each argument is a number or an array; the results broadcast together.
+    Ratios with a zero denominator are ``inf`` (or 0 when the numerator is
+    also 0), mirroring the metrics shown in the web interfaces.
+    """
+    annual_income = np.asarray(annual_income, dtype=float)
+    total_savings = np.asarray(total_savings, dtype=float)
+    total_loans = np.asarray(total_loans, dtype=float)
+    monthly_expenses = np.asarray(monthly_expenses, dtype=float)
+    investment_amount = np.asarray(investment_amount, dtype=float)
+
+    monthly_income = annual_income / 12
+    monthly_surplus = monthly_income - monthly_expenses
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return {
+            'monthly_income': monthly_income,
+            'monthly_surplus': monthly_surplus,
+            'savings_rate': np.where(monthly_income > 0, monthly_surplus / monthly_income * 100, 0.0),
+            'debt_to_savings_ratio': _ratio(total_loans, total_savings),
+            'debt_to_income_ratio': _ratio(total_loans, annual_income),
+            'debt_to_assets_ratio': _ratio(total_loans, total_savings + investment_amount),
+            'emergency_fund_months': _ratio(total_savings, monthly_expenses)
+        }
+
+
+def _ratio(numerator, denominator):
+    """Divide, giving inf for x/0 and 0 for 0/0."""
+    return np.where(
+        denominator > 0,
+        numerator / np.where(denominator > 0, denominator, 1),
+        np.where(numerator > 0, np.inf, 0.0)
+    )
+
+
+def risk_score(metrics: dict):
+    """
+    Score risk from 0 (none) to 100 (maximum) from computed metrics.
+
+    Each component scales linearly from no points at a healthy value to its
+    full weight at a distressed one: debt at 2x annual income, a savings rate
+    of -20%, no emergency fund (against a six-month target) and debt at 3x
+    liquid assets.
+    """
+    components = (
+        WEIGHTS['debt_to_income'] * np.clip(metrics['debt_to_income_ratio'] / 2, 0, 1),
+        WEIGHTS['savings_rate'] * np.clip((20 - metrics['savings_rate']) / 40, 0, 1),
+        WEIGHTS['emergency_fund'] * np.clip((6 - metrics['emergency_fund_months']) / 6, 0, 1),
+        WEIGHTS['debt_to_assets'] * np.clip(metrics['debt_to_assets_ratio'] / 3, 0, 1)
+    )
+    return np.round(sum(components), 1)
+
+
+def risk_levels(scores):
+    """Map risk scores to Low/Medium/High/Critical bands."""
+    return RISK_LEVELS[np.searchsorted(BAND_EDGES, scores, side='right')]
+
+
+def needs_llm_review(scores, margin: float = 5.0):
+    """
+    Flag profiles the deterministic score cannot settle on its own.
+
+    Those are Critical profiles, which always warrant a full analysis, and
+    profiles within ``margin`` points of a band boundary, whose band could
+    go either way.
+    """
+    scores = np.asarray(scores, dtype=float)
+    near_edge = np.min(np.abs(scores[..., None] - np.array(BAND_EDGES)), axis=-1) < margin
+    return near_edge | (scores >= BAND_EDGES[-1])
+
+
+def score_profile(financial_data: dict) -> dict:
+    """Score a single financial_data dictionary, returning plain Python values."""
+    metrics = compute_metrics(
+        financial_data['annual_income'], financial_data['total_savings'],
+        financial_data['total_loans'], financial_data['monthly_expenses'],
+        financial_data['investment_amount']
+    )
+    score = risk_score(metrics)
+    result = {name: float(value) for name, value in metrics.items()}
+    result['risk_score'] = float(score)
+    result['risk_level'] = str(risk_levels(score))
+    return result
+
+
+def grid_axis(base: float, steps: int = 21, spread: float = 0.5, min_half_width: float = 1000.0):
+    """
+    Evenly spaced values around ``base`` for one axis of a sensitivity grid.
+
+    The axis runs from ``spread`` below to ``spread`` above the base value
+    (0.5 is +/-50%), at least ``min_half_width`` either side so zero inputs
+    still vary, and never below zero.
+    """
+    half_width = max(abs(base) * spread, min_half_width)
+    return np.linspace(max(0.0, base - half_width), base + half_width, steps)
+
+
+def sensitivity_grid(financial_data: dict, x_field: str, x_values, y_field: str, y_values) -> dict:
+    """
+    Score every combination of two varied inputs in one vectorized pass.
+
+    The other inputs stay at their ``financial_data`` values.
+
+    Returns:
+        Dictionary with the axis values under ``x`` and ``y``, and each
+        metric, ``risk_score`` and ``risk_level`` as arrays of shape
+        (len(y_values), len(x_values))
+    """
+    if x_field == y_field:
+        raise ValueError("The two sensitivity inputs must differ")
+
+    x_values = np.asarray(x_values, dtype=float)
+    y_values = np.asarray(y_values, dtype=float)
+    inputs = {
+        field: financial_data[field]
+        for field in ('annual_income', 'total_savings', 'total_loans', 'monthly_expenses', 'investment_amount')
+    }
+    # Broadcasting a row of x values against a column of y values gives the grid
+    inputs[x_field] = x_values[None, :]
+    inputs[y_field] = y_values[:, None]
+
+    metrics = compute_metrics(**inputs)
+    shape = (len(y_values), len(x_values))
+    grid = {name: np.broadcast_to(values, shape) for name, values in metrics.items()}
+    grid['risk_score'] = np.broadcast_to(risk_score(metrics), shape)
+    grid['risk_level'] = risk_levels(grid['risk_score'])
+    grid['x'] = x_values
+    grid['y'] = y_values
+    return grid
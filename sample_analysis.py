@@ -53,15 +53,16 @@ def analyze_sample_profiles():
     
     results = {}
     
-    for profile_name, financial_data in sample_profiles.items():
+    # Get quick risk assessments for every profile in one request
+    print("\nAnalyzing...")
+    risk_assessments = analyzer.get_risk_assessments(list(sample_profiles.values()))
+    
+    for (profile_name, financial_data), risk_assessment in zip(sample_profiles.items(), risk_assessments):
         print(f"\n{'='*70}")
         print(f"Analyzing: {profile_name}")
         print(f"{'='*70}")
         print(f"Profile Data: {json.dumps(financial_data, indent=2)}")
-        print("\nAnalyzing...")
         
-        # Get quick risk assessment
-        risk_assessment = analyzer.get_risk_assessment(financial_data)
         results[profile_name] = {
             "profile": financial_data,
             "risk_assessment": risk_assessment
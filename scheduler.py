@@ -0,0 +1,246 @@
+"""
+Priority Scheduling for the Financial Analyzer Web Servers
+Limits how many analyzer calls run at once and, when all slots are busy,
+hands freed slots to waiting requests by class: quick assessments ahead of
+chat turns ahead of full analyses, by weight so no class starves. Requests
+that have waited past their class's deadline are dropped instead of run late.
+"""
+
+import asyncio
+import contextlib
+import math
+import os
+import threading
+import time
+from collections import deque
+from cancellation import AnalysisCancelled
+from tracing import span
+
+QUICK = 'quick'
+CHAT = 'chat'
+ANALYSIS = 'analysis'
+
+# Per class: share of freed slots when every class is waiting (relative),
+# longest queue wait in seconds before the request is dropped, and the most
+# requests that may wait at once
+DEFAULT_CLASSES = {
+    QUICK: {'weight': 8, 'max_wait': 5, 'max_queue': 200},
+    CHAT: {'weight': 3, 'max_wait': 20, 'max_queue': 100},
+    ANALYSIS: {'weight': 1, 'max_wait': 60, 'max_queue': 100}
+}
+
+
+class SchedulerBusy(Exception):
+    """Raised when a request's class queue is full or its deadline passed while queued."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        """Value for the Retry-After header (whole seconds, at least 1)."""
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class _Waiter:
+    """A queued request, woken from a thread or an event loop."""
+
+    def __init__(self, request_class: str, deadline: float, loop=None):
+        self.request_class = request_class
+        self.deadline = deadline
+        self.granted = False
+        self.dropped = False
+        self._loop = loop
+        if loop is None:
+            self._event = threading.Event()
+        else:
+            self._future = loop.create_future()
+
+    def wake(self):
+        """Wake the waiting request (safe from any thread)."""
+        if self._loop is None:
+            self._event.set()
+        else:
+            self._loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self):
+        if not self._future.done():
+            self._future.set_result(None)
+
+
+class PriorityScheduler:
+    """
+    A pool of ``max_concurrent`` slots for analyzer calls with one queue per
+    request class.
+
+    Freed slots go to the waiting class that has received the least service
+    relative to its weight (stride scheduling), so with weights 8:3:1 and
+    every class backlogged, quick assessments get 8 of every 12 slots.
+    """
+
+    def __init__(self, max_concurrent: int = 16, classes: dict = None):
+        """
+        Initialize the scheduler.
+
+        Args:
+            max_concurrent: Analyzer calls allowed to run at once
+            classes: Per-class ``weight``, ``max_wait`` and ``max_queue``;
+                defaults to DEFAULT_CLASSES
+        """
+        self.max_concurrent = max_concurrent
+        self.classes = classes or DEFAULT_CLASSES
+        self._queues = {name: deque() for name in self.classes}
+        self._pass = {name: 0.0 for name in self.classes}
+        self._virtual_time = 0.0
+        self._running = 0
+        self._dropped = {name: 0 for name in self.classes}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """
+        Create a scheduler configured from SCHEDULER_* environment variables.
+
+        SCHEDULER_WEIGHTS and SCHEDULER_MAX_WAITS override the defaults with
+        entries such as ``quick:8,chat:3,analysis:1``.
+        """
+        classes = {name: dict(config) for name, config in DEFAULT_CLASSES.items()}
+        for variable, key in (('SCHEDULER_WEIGHTS', 'weight'), ('SCHEDULER_MAX_WAITS', 'max_wait')):
+            for entry in filter(None, os.getenv(variable, '').split(',')):
+                name, _, value = entry.partition(':')
+                classes[name.strip()][key] = float(value)
+        return cls(max_concurrent=int(os.getenv('SCHEDULER_MAX_CONCURRENT', '16')), classes=classes)
+
+    @contextlib.contextmanager
+    def slot(self, request_class: str, cancel_token=None):
+        """
+        Hold a slot for the enclosed block, waiting for one if all are busy.
+
+        Raises:
+            SchedulerBusy: If the class queue is full or the deadline passes
+            AnalysisCancelled: If ``cancel_token`` is cancelled while waiting
+        """
+        waiter = self._enqueue(request_class)
+        if waiter is not None:
+            with span('queue'):
+                unregister = cancel_token.add_callback(waiter.wake) if cancel_token is not None else None
+                try:
+                    waiter._event.wait(max(0.0, waiter.deadline - time.monotonic()))
+                finally:
+                    if unregister is not None:
+                        unregister()
+                self._settle(waiter, cancel_token)
+        try:
+            yield
+        finally:
+            self._release()
+
+    @contextlib.asynccontextmanager
+    async def slot_async(self, request_class: str, cancel_token=None):
+        """Asynchronous version of ``slot``."""
+        waiter = self._enqueue(request_class, asyncio.get_running_loop())
+        if waiter is not None:
+            with span('queue'):
+                unregister = cancel_token.add_callback(waiter.wake) if cancel_token is not None else None
+                try:
+                    await asyncio.wait([waiter._future], timeout=max(0.0, waiter.deadline - time.monotonic()))
+                except asyncio.CancelledError:
+                    self._abandon(waiter)
+                    raise
+                finally:
+                    if unregister is not None:
+                        unregister()
+                self._settle(waiter, cancel_token)
+        try:
+            yield
+        finally:
+            self._release()
+
+    def stats(self) -> dict:
+        """Return running calls, queued requests per class and drops per class since start."""
+        with self._lock:
+            self._drop_expired()
+            return {
+                'running': self._running,
+                'max_concurrent': self.max_concurrent,
+                'queued': {name: len(queue) for name, queue in self._queues.items()},
+                'dropped': dict(self._dropped)
+            }
+
+    def _enqueue(self, request_class: str, loop=None):
+        """Take a free slot (returning None) or queue a waiter for one."""
+        config = self.classes[request_class]
+        with self._lock:
+            self._drop_expired()
+            if self._running < self.max_concurrent and not any(self._queues.values()):
+                self._running += 1
+                return None
+
+            queue = self._queues[request_class]
+            if len(queue) >= config['max_queue']:
+                raise SchedulerBusy(f'Too many {request_class} requests waiting', config['max_wait'])
+            if not queue:
+                # A class returning from idle doesn't bank credit for the time it was away
+                self._pass[request_class] = max(self._pass[request_class], self._virtual_time)
+            waiter = _Waiter(request_class, time.monotonic() + config['max_wait'], loop)
+            queue.append(waiter)
+            self._dispatch()
+            return waiter
+
+    def _settle(self, waiter: _Waiter, cancel_token):
+        """After a wait, return if the slot was granted, else leave the queue and raise."""
+        cancelled = cancel_token is not None and cancel_token.cancelled
+        with self._lock:
+            if waiter.granted:
+                return
+            if not waiter.dropped:
+                self._queues[waiter.request_class].remove(waiter)
+                if not cancelled:
+                    waiter.dropped = True
+                    self._dropped[waiter.request_class] += 1
+        if cancelled:
+            raise AnalysisCancelled("Analysis cancelled")
+        raise SchedulerBusy(f'Waited too long for capacity ({waiter.request_class})',
+                            self.classes[waiter.request_class]['max_wait'])
+
+    def _abandon(self, waiter: _Waiter):
+        """Withdraw a waiter whose task was cancelled, giving back a slot granted meanwhile."""
+        with self._lock:
+            if waiter.granted:
+                self._running -= 1
+                self._dispatch()
+            elif not waiter.dropped:
+                self._queues[waiter.request_class].remove(waiter)
+
+    def _release(self):
+        """Free a slot and hand it to the next waiter."""
+        with self._lock:
+            self._running -= 1
+            self._dispatch()
+
+    def _dispatch(self):
+        """Grant free slots to waiters in weighted order. Caller holds the lock."""
+        while self._running < self.max_concurrent:
+            self._drop_expired()
+            waiting = [name for name, queue in self._queues.items() if queue]
+            if not waiting:
+                return
+            name = min(waiting, key=lambda n: (self._pass[n], -self.classes[n]['weight']))
+            waiter = self._queues[name].popleft()
+            self._virtual_time = self._pass[name]
+            self._pass[name] += 1 / self.classes[name]['weight']
+            self._running += 1
+            waiter.granted = True
+            waiter.wake()
+
+    def _drop_expired(self):
+        """Drop waiters whose deadline has passed. Caller holds the lock."""
+        now = time.monotonic()
+        for name, queue in self._queues.items():
+            # Each class has one max_wait, so deadlines are in queue order
+            while queue and queue[0].deadline <= now:
+                waiter = queue.popleft()
+                waiter.dropped = True
+                self._dropped[name] += 1
+                waiter.wake()
@@ -0,0 +1,213 @@
+"""
+Offline Customer Scoring for Financial Analyzer
+Streams a CSV or Parquet customer file through the deterministic risk scoring
+in fixed-size column batches, writes the scored rows as CSV or Parquet and
+flags the rows that need a full LLM analysis. Peak memory depends on the chunk
+size, not the file size.
+
+Run with:
+    python score_customers.py customers.parquet scored.parquet --flagged needs_llm.csv
+"""
+
+import argparse
+import time
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+from api_helpers import REQUIRED_FIELDS
+from risk_scoring import compute_metrics, risk_score, risk_levels, needs_llm_review
+
+DEFAULT_CHUNK_SIZE = 100_000
+
+# A decimal number, optionally signed and in exponent notation
+NUMBER_PATTERN = r'^[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?$'
+
+# Scored columns appended to every input row
+OUTPUT_FIELDS = (
+    'monthly_income', 'monthly_surplus', 'savings_rate', 'debt_to_savings_ratio',
+    'debt_to_income_ratio', 'debt_to_assets_ratio', 'emergency_fund_months'
+)
+
+
+def is_parquet(path: str) -> bool:
+    """Whether a path names a Parquet file (by extension); anything else is CSV."""
+    return path.lower().endswith(('.parquet', '.pq'))
+
+
+def iter_batches(path: str, chunk_size: int = DEFAULT_CHUNK_SIZE):
+    """
+    Yield record batches of ``chunk_size`` rows (the last may be shorter).
+
+    Parquet files are read a batch at a time; CSV files are parsed in blocks
+    of roughly one chunk and re-sliced, so at most about two chunks are held
+    in memory at once. CSV input columns are read as text, so a stray
+    non-numeric cell marks its row invalid instead of failing the file.
+    """
+    if is_parquet(path):
+        yield from pq.ParquetFile(path).iter_batches(batch_size=chunk_size)
+        return
+
+    # Guess ~100 bytes per CSV row to size the parser's blocks
+    read_options = pa_csv.ReadOptions(block_size=max(1 << 20, chunk_size * 100))
+    convert_options = pa_csv.ConvertOptions(column_types={field: pa.string() for field in REQUIRED_FIELDS})
+    pending, pending_rows = [], 0
+    for batch in pa_csv.open_csv(path, read_options=read_options, convert_options=convert_options):
+        pending.append(batch)
+        pending_rows += batch.num_rows
+        while pending_rows >= chunk_size:
+            table = pa.Table.from_batches(pending)
+            yield table.slice(0, chunk_size).combine_chunks().to_batches()[0]
+            rest = table.slice(chunk_size)
+            pending, pending_rows = rest.to_batches(), rest.num_rows
+    if pending_rows:
+        yield pa.Table.from_batches(pending).combine_chunks().to_batches()[0]
+
+
+def _numeric(column: pa.Array) -> pa.Array:
+    """Convert a column to float64, with cells that aren't numbers as nulls."""
+    if pa.types.is_string(column.type) or pa.types.is_large_string(column.type):
+        column = pc.utf8_trim_whitespace(column)
+        is_number = pc.fill_null(pc.match_substring_regex(column, NUMBER_PATTERN), False)
+        column = pc.if_else(is_number, column, pa.scalar(None, column.type))
+    return pc.cast(column, pa.float64())
+
+
+def _column(batch: pa.RecordBatch, name: str) -> pa.Array:
+    """Return an input column as float64, with missing and non-numeric cells as nulls."""
+    index = batch.schema.get_field_index(name)
+    if index < 0:
+        raise ValueError(f'Missing field: {name}')
+    return _numeric(batch.column(index))
+
+
+def score_batch(batch: pa.RecordBatch, margin: float = 5.0) -> pa.RecordBatch:
+    """
+    Append metrics, ``risk_score``, ``risk_level``, ``valid`` and
+    ``needs_llm`` columns to a batch of customer rows.
+
+    Rows with a missing, negative or non-numeric input are marked invalid,
+    with a null score and level, and are never flagged for the LLM. Text
+    input columns are carried through as the parsed numbers.
+    """
+    inputs = {field: _column(batch, field) for field in REQUIRED_FIELDS}
+    values = [inputs[field].to_numpy(zero_copy_only=False) for field in REQUIRED_FIELDS]
+    valid = np.logical_and.reduce([np.isfinite(v) & (v >= 0) for v in values])
+    # Score invalid rows as zeros so they can't raise; their results are masked below
+    values = [np.where(valid, v, 0.0) for v in values]
+
+    metrics = compute_metrics(*values)
+    scores = risk_score(metrics)
+    invalid = ~valid
+
+    names = list(batch.schema.names)
+    columns = [
+        inputs[name] if name in inputs and pa.types.is_string(column.type) else column
+        for name, column in zip(names, batch.columns)
+    ]
+    for name in OUTPUT_FIELDS:
+        columns.append(pa.array(np.round(metrics[name], 4), mask=invalid))
+        names.append(name)
+    columns += [
+        pa.array(scores, mask=invalid),
+        pa.array(risk_levels(scores), mask=invalid),
+        pa.array(valid),
+        pa.array(valid & needs_llm_review(scores, margin))
+    ]
+    names += ['risk_score', 'risk_level', 'valid', 'needs_llm']
+    return pa.RecordBatch.from_arrays(columns, names=names)
+
+
+class _BatchWriter:
+    """Write record batches to a CSV or Parquet file opened on first use."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.writer = None
+
+    def write(self, batch: pa.RecordBatch):
+        if self.writer is None:
+            if is_parquet(self.path):
+                self.writer = pq.ParquetWriter(self.path, batch.schema)
+            else:
+                self.writer = pa_csv.CSVWriter(self.path, batch.schema)
+        if is_parquet(self.path):
+            self.writer.write_batch(batch)
+        else:
+            self.writer.write(batch)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+def score_file(input_path: str, output_path: str, flagged_path: str = None,
+               chunk_size: int = DEFAULT_CHUNK_SIZE, margin: float = 5.0) -> dict:
+    """
+    Score every row of a customer file.
+
+    Args:
+        input_path: CSV or Parquet file with the five financial input columns
+            (any other columns, such as a customer ID, are carried through)
+        output_path: CSV or Parquet file for all scored rows
+        flagged_path: Optional CSV or Parquet file for just the rows flagged
+            for an LLM analysis
+        chunk_size: Rows per batch
+        margin: Points from a band boundary within which a row is flagged
+
+    Returns:
+        Summary with row, invalid and flagged counts and rows per risk level
+    """
+    summary = {'rows': 0, 'invalid': 0, 'flagged': 0, 'risk_levels': {}}
+    writer = _BatchWriter(output_path)
+    flagged_writer = _BatchWriter(flagged_path) if flagged_path else None
+
+    try:
+        for batch in iter_batches(input_path, chunk_size):
+            scored = score_batch(batch, margin)
+            writer.write(scored)
+
+            needs_llm = scored.column('needs_llm')
+            if flagged_writer is not None:
+                flagged_writer.write(scored.filter(needs_llm))
+
+            summary['rows'] += scored.num_rows
+            summary['invalid'] += scored.num_rows - pc.sum(scored.column('valid')).as_py()
+            summary['flagged'] += pc.sum(needs_llm).as_py() or 0
+            counts = pc.value_counts(scored.column('risk_level').drop_null())
+            for entry in counts.to_pylist():
+                level = entry['values']
+                summary['risk_levels'][level] = summary['risk_levels'].get(level, 0) + entry['counts']
+    finally:
+        writer.close()
+        if flagged_writer is not None:
+            flagged_writer.close()
+
+    return summary
+
+
+def main():
+    """Score a customer file and print a summary."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('input', help='CSV or Parquet customer file')
+    parser.add_argument('output', help='CSV or Parquet file for the scored rows')
+    parser.add_argument('--flagged', help='CSV or Parquet file for rows needing an LLM analysis')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument('--margin', type=float, default=5.0,
+                        help='Flag rows within this many points of a risk band boundary')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    summary = score_file(args.input, args.output, args.flagged, args.chunk_size, args.margin)
+    elapsed = time.perf_counter() - start
+
+    print(f"Scored {summary['rows']:,} rows in {elapsed:.1f}s")
+    for level in ('Low', 'Medium', 'High', 'Critical'):
+        print(f"  {level}: {summary['risk_levels'].get(level, 0):,}")
+    print(f"  Invalid: {summary['invalid']:,}")
+    print(f"Flagged for LLM analysis: {summary['flagged']:,}")
+
+
+if __name__ == '__main__':
+    main()
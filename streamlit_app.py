@@ -3,14 +3,109 @@ Streamlit Web Interface for Financial Analyzer
 AI-Powered Risk Assessment & Gain Analysis
 """
 
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
 import streamlit as st
+import altair as alt
+import numpy as np
+import pandas as pd
 from financial_analyzer import FinancialAnalyzer
+from cancellation import CancelToken
+from result_cache import ResultCache
+from api_helpers import cached_result
+from amortization import validate_loans, compare_strategies
+from projections import projection_for
+from risk_scoring import grid_axis, sensitivity_grid
 import os
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
+# Inputs that can be varied in the sensitivity analysis, and the metrics it
+# can show, by label
+SENSITIVITY_INPUTS = {
+    "Annual Income ($)": 'annual_income',
+    "Monthly Expenses ($)": 'monthly_expenses',
+    "Total Loans ($)": 'total_loans',
+    "Total Savings ($)": 'total_savings',
+    "Investment Amount ($)": 'investment_amount'
+}
+SENSITIVITY_METRICS = {
+    "Risk Score": 'risk_score',
+    "Savings Rate (%)": 'savings_rate',
+    "Monthly Surplus ($)": 'monthly_surplus',
+    "Emergency Fund (months)": 'emergency_fund_months',
+    "Debt-to-Income Ratio": 'debt_to_income_ratio'
+}
+
+
+@st.cache_data(max_entries=64)
+def sensitivity_table(base_profile: tuple, x_field: str, y_field: str, spread: float, steps: int = 21) -> pd.DataFrame:
+    """
+    Score a grid of two varied inputs around a base profile, one row per cell.
+    
+    Every metric is computed in the same vectorized pass and the result is
+    cached per base profile and axes, so switching metrics or returning to
+    earlier axes redraws without recomputing.
+    """
+    financial_data = dict(base_profile)
+    x_values = grid_axis(financial_data[x_field], steps, spread)
+    y_values = grid_axis(financial_data[y_field], steps, spread)
+    grid = sensitivity_grid(financial_data, x_field, x_values, y_field, y_values)
+    
+    x, y = np.meshgrid(grid['x'], grid['y'])
+    table = pd.DataFrame({'x': x.ravel(), 'y': y.ravel()})
+    for metric in SENSITIVITY_METRICS.values():
+        table[metric] = np.round(grid[metric].ravel(), 2)
+    table['risk_level'] = grid['risk_level'].ravel()
+    # Outline the cell nearest the user's own values
+    table['current'] = (
+        (table['x'] == x_values[np.abs(x_values - financial_data[x_field]).argmin()]) &
+        (table['y'] == y_values[np.abs(y_values - financial_data[y_field]).argmin()])
+    )
+    # Ratios over a zero denominator are infinite, which charts can't plot
+    return table.replace([np.inf, -np.inf], np.nan)
+
+
+@st.cache_resource
+def shared_result_cache():
+    """The result cache shared with the web servers, or None if RESULT_CACHE_PATH is unset."""
+    return ResultCache.from_env()
+
+
+def run_cancellable_analysis(analyzer, financial_data: dict) -> dict:
+    """
+    Run an analysis on a worker thread while this script run polls it.
+    
+    When the user resubmits the form or closes the tab, Streamlit stops the
+    script run by raising at its next Streamlit call. The polling loop keeps
+    making such calls, so the analysis is cancelled instead of finishing
+    unseen. With a shared result cache, a profile already analyzed by the
+    web servers is answered from it.
+    """
+    cancel_token = CancelToken()
+    executor = ThreadPoolExecutor(max_workers=1)
+    future = executor.submit(
+        cached_result, shared_result_cache(), 'analysis', analyzer, financial_data,
+        lambda: analyzer.analyze_financial_situation(financial_data, cancel_token=cancel_token), cancel_token
+    )
+    executor.shutdown(wait=False)
+    
+    elapsed = st.empty()
+    started = time.monotonic()
+    try:
+        while True:
+            try:
+                return future.result(timeout=0.25)
+            except TimeoutError:
+                elapsed.caption(f"Elapsed: {time.monotonic() - started:.0f}s")
+    finally:
+        # A no-op once the analysis has finished
+        cancel_token.cancel()
+        elapsed.empty()
+
+
 # Page configuration
 st.set_page_config(
     page_title="Financial Analyzer",
@@ -87,6 +182,55 @@ col1, col2 = st.columns([1, 1])
 with col1:
     st.subheader("📊 Enter Your Financial Data")
     
+    # Itemized loans live outside the form so the payoff comparison
+    # recomputes as soon as a loan is edited
+    st.markdown("**Itemized Loans** (optional)")
+    loans_table = st.data_editor(
+        pd.DataFrame({
+            "name": pd.Series(dtype=str),
+            "balance": pd.Series(dtype=float),
+            "apr": pd.Series(dtype=float),
+            "minimum_payment": pd.Series(dtype=float)
+        }),
+        num_rows="dynamic",
+        use_container_width=True,
+        column_config={
+            "name": st.column_config.TextColumn("Name"),
+            "balance": st.column_config.NumberColumn("Balance ($)", min_value=0.0, format="$%.2f"),
+            "apr": st.column_config.NumberColumn("APR (%)", min_value=0.0, format="%.2f%%"),
+            "minimum_payment": st.column_config.NumberColumn("Minimum Payment ($)", min_value=0.0, format="$%.2f")
+        },
+        key="loans_editor"
+    )
+    
+    loans = []
+    try:
+        loans = validate_loans([
+            dict(row, name=row["name"] if isinstance(row["name"], str) else None)
+            for row in loans_table.to_dict("records")
+            if pd.notna(row["balance"]) and row["balance"] > 0
+        ])
+    except ValueError as e:
+        st.error(f"Invalid loan: {str(e)}")
+    
+    if loans:
+        payoff = compare_strategies(loans)
+        st.caption("Total interest by extra monthly payment")
+        st.line_chart(
+            pd.DataFrame(
+                {strategy.title(): payoff[strategy]['total_interest'] for strategy in ('avalanche', 'snowball', 'custom')},
+                index=pd.Index(payoff['extra_payments'], name="Extra payment ($/month)")
+            )
+        )
+        st.dataframe(
+            pd.DataFrame(
+                {strategy.title(): payoff[strategy]['months_to_payoff'] for strategy in ('avalanche', 'snowball', 'custom')},
+                index=pd.Index([f"${extra:,.0f}" for extra in payoff['extra_payments']], name="Extra payment")
+            ),
+            use_container_width=True
+        )
+        st.caption("Months to payoff; custom follows the table order")
+    
     with st.form("financial_form"):
         annual_income = st.number_input(
             "Annual Income ($)",
@@ -112,8 +256,12 @@ with col1:
             max_value=100000000.0,
             step=1000.0,
             value=40000.0,
-            help="All outstanding debt (car, student, mortgage, credit cards)"
+            help="All outstanding debt (car, student, mortgage, credit cards)",
+            disabled=bool(loans)
         )
+        if loans:
+            total_loans = sum(loan['balance'] for loan in loans)
+            st.caption(f"Using itemized loans: ${total_loans:,.2f}")
         
         monthly_expenses = st.number_input(
             "Monthly Expenses ($)",
@@ -150,10 +298,12 @@ with col1:
                     'monthly_expenses': monthly_expenses,
                     'investment_amount': investment_amount
                 }
+                if loans:
+                    financial_data['loans'] = loans
                 
                 try:
                     with st.spinner("🔄 Analyzing your financial situation..."):
-                        analysis = st.session_state.analyzer.analyze_financial_situation(financial_data)
+                        analysis = run_cancellable_analysis(st.session_state.analyzer, financial_data)
                         st.session_state.results = {
                             'analysis': analysis,
                             'input_data': financial_data
@@ -207,6 +357,31 @@ with col2:
                 delta=None
             )
         
+        # Monte Carlo projection of savings, debt and investments
+        projection = analysis.get('projections') or projection_for(data)
+        horizon = projection['years'][-1]
+        
+        projection_col1, projection_col2 = st.columns(2)
+        with projection_col1:
+            st.metric(
+                f"Median Net Worth in {horizon} Years",
+                f"${projection['net_worth']['p50'][horizon]:,.0f}",
+                delta=None
+            )
+        with projection_col2:
+            st.metric(
+                f"Chance Debt-Free in {horizon} Years",
+                f"{projection['probability_debt_free']:.0%}",
+                delta=None
+            )
+        
+        st.caption(f"Projected net worth by year ({projection['paths']:,} simulated paths)")
+        st.line_chart({
+            "10th percentile": projection['net_worth']['p10'],
+            "Median": projection['net_worth']['p50'],
+            "90th percentile": projection['net_worth']['p90']
+        })
+        
         st.divider()
         
         # Display analysis sections
@@ -214,7 +389,16 @@ with col2:
             st.markdown(analysis['initial_analysis'])
         
         with st.expander("📈 Detailed Metrics", expanded=True):
-            st.markdown(analysis['detailed_metrics'])
+            st.metric(
+                "Risk Score",
+                f"{analysis['risk_score']}/100",
+                delta=analysis['risk_level'],
+                delta_color="off"
+            )
+            st.markdown("**Top Risk Factors**")
+            st.markdown("\n".join(f"{i}. {factor}" for i, factor in enumerate(analysis['risk_factors'], 1)))
+            st.markdown("**Gain Opportunities**")
+            st.markdown("\n".join(f"{i}. {item}" for i, item in enumerate(analysis['gain_opportunities'], 1)))
         
         with st.expander("💡 Recommendations", expanded=True):
             st.markdown(analysis['recommendations'])
@@ -235,14 +419,18 @@ with col2:
 ## Key Metrics
 - Monthly Income: ${monthly_income:,.2f}
 - Monthly Surplus: ${monthly_surplus:,.2f}
-- Debt-to-Savings Ratio: {debt_to_savings:.2f if debt_to_savings != float('inf') else '∞'}
+- Debt-to-Savings Ratio: {f'{debt_to_savings:.2f}' if debt_to_savings != float('inf') else '∞'}
 - Savings Rate: {savings_rate:.1f}%
+- Median Net Worth in {horizon} Years: ${projection['net_worth']['p50'][horizon]:,.2f}
+- Chance Debt-Free in {horizon} Years: {projection['probability_debt_free']:.0%}
 
 ## Initial Analysis
 {analysis['initial_analysis']}
 
 ## Detailed Metrics
-{analysis['detailed_metrics']}
+- Risk Score: {analysis['risk_score']}/100 ({analysis['risk_level']})
+- Top Risk Factors: {'; '.join(analysis['risk_factors'])}
+- Gain Opportunities: {'; '.join(analysis['gain_opportunities'])}
 
 ## Recommendations
 {analysis['recommendations']}
@@ -259,6 +447,59 @@ with col2:
     else:
         st.info("👈 Fill in your financial information and click 'Analyze' to get started")
 
+st.divider()
+
+# Sensitivity analysis of the rule-based score, computed locally
+st.subheader("🔍 Sensitivity Analysis")
+st.caption("How the rule-based risk score and metrics change as two of your inputs move. "
+           "Computed instantly on this server, with no API call.")
+
+if st.session_state.results:
+    base_data = st.session_state.results['input_data']
+else:
+    base_data = {
+        'annual_income': annual_income,
+        'total_savings': total_savings,
+        'total_loans': total_loans,
+        'monthly_expenses': monthly_expenses,
+        'investment_amount': investment_amount
+    }
+base_profile = tuple((field, float(base_data[field])) for field in SENSITIVITY_INPUTS.values())
+
+control_col1, control_col2, control_col3, control_col4 = st.columns(4)
+with control_col1:
+    x_label = st.selectbox("Horizontal axis", list(SENSITIVITY_INPUTS))
+with control_col2:
+    y_label = st.selectbox("Vertical axis", [label for label in SENSITIVITY_INPUTS if label != x_label])
+with control_col3:
+    metric_label = st.selectbox("Show", list(SENSITIVITY_METRICS))
+with control_col4:
+    spread = st.slider("Range (±%)", min_value=10, max_value=100, value=50, step=10)
+
+metric = SENSITIVITY_METRICS[metric_label]
+table = sensitivity_table(base_profile, SENSITIVITY_INPUTS[x_label], SENSITIVITY_INPUTS[y_label], spread / 100)
+if metric == 'risk_score':
+    color_scale = alt.Scale(scheme='redyellowgreen', reverse=True, domain=[0, 100])
+else:
+    color_scale = alt.Scale(scheme='viridis')
+
+heatmap = alt.Chart(table).mark_rect().encode(
+    x=alt.X('x:O', title=x_label, axis=alt.Axis(format='$,.0f', labelOverlap=True)),
+    y=alt.Y('y:O', title=y_label, sort='descending', axis=alt.Axis(format='$,.0f', labelOverlap=True)),
+    color=alt.Color(f'{metric}:Q', title=metric_label, scale=color_scale),
+    stroke=alt.condition(alt.datum.current, alt.value('black'), alt.value(None)),
+    strokeWidth=alt.condition(alt.datum.current, alt.value(2), alt.value(0)),
+    tooltip=[
+        alt.Tooltip('x:Q', title=x_label, format='$,.0f'),
+        alt.Tooltip('y:Q', title=y_label, format='$,.0f'),
+        alt.Tooltip('risk_score:Q', title="Risk Score"),
+        alt.Tooltip('risk_level:N', title="Risk Level"),
+    ] + ([alt.Tooltip(f'{metric}:Q', title=metric_label)] if metric != 'risk_score' else [])
+).properties(height=420)
+st.altair_chart(heatmap, use_container_width=True)
+st.caption("The outlined cell is closest to your current values. This is the local rule-based score, "
+           "which can differ from the AI risk score above.")
+
 # Sidebar
 st.sidebar.markdown("---")
 st.sidebar.subheader("📚 About This App")
@@ -3,8 +3,23 @@ Unit tests for the Financial Analyzer module.
 Tests the analyzer's ability to process financial data and communicate with Claude API.
 """
 
+import asyncio
+import threading
+import time
 import unittest
-from financial_analyzer import FinancialAnalyzer, get_financial_inputs
+from types import SimpleNamespace
+from unittest import mock
+import copy
+import json
+import tempfile
+from anthropic.types import Message
+from cancellation import AnalysisCancelled, CancelToken
+from cassette import AsyncCassetteClient, Cassette, CassetteMismatch
+from tracing import Tracer
+from financial_analyzer import (
+    FinancialAnalyzer, AsyncFinancialAnalyzer, get_financial_inputs, parse_risk_metrics,
+    parse_risk_assessments, split_summary
+)
 import os
 from dotenv import load_dotenv
 
@@ -191,5 +206,592 @@ class TestFinancialProfiles(unittest.TestCase):
         self.assertGreater(profile["total_savings"], profile["total_loans"])
 
 
+def _text_response(text):
+    """Build a fake Messages API response with a single text block."""
+    return SimpleNamespace(content=[SimpleNamespace(type="text", text=text)])
+
+
+def _tool_response(name, tool_input, tool_id="toolu_test"):
+    """Build a fake Messages API response with a single tool_use block."""
+    return SimpleNamespace(content=[
+        SimpleNamespace(type="tool_use", id=tool_id, name=name, input=tool_input)
+    ])
+
+
+class TestRiskMetrics(unittest.TestCase):
+    """Test the structured risk-metrics turn."""
+    
+    def setUp(self):
+        """Create an analyzer with a mocked Anthropic client."""
+        with mock.patch.dict(os.environ, {"ANTHROPIC_API_KEY": "test-key"}):
+            self.analyzer = FinancialAnalyzer()
+        self.analyzer.client = mock.Mock()
+        self.profile = {
+            "annual_income": 65000,
+            "total_savings": 15000,
+            "total_loans": 35000,
+            "monthly_expenses": 2500,
+            "investment_amount": 5000
+        }
+    
+    def test_parse_valid_metrics(self):
+        """Test that valid tool input is typed and classified."""
+        metrics = parse_risk_metrics({
+            "risk_score": "42",
+            "risk_factors": ["High debt ", "Low savings"],
+            "gain_opportunities": ["Refinance"]
+        })
+        
+        self.assertEqual(metrics["risk_score"], 42)
+        self.assertEqual(metrics["risk_level"], "Medium")
+        self.assertEqual(metrics["risk_factors"], ["High debt", "Low savings"])
+        self.assertEqual(metrics["gain_opportunities"], ["Refinance"])
+        
+        # Fractional scores are rounded, not truncated
+        self.assertEqual(parse_risk_metrics(dict(
+            risk_score=74.6, risk_factors=[], gain_opportunities=[]
+        ))["risk_level"], "Critical")
+    
+    def test_parse_invalid_metrics(self):
+        """Test that malformed tool input is rejected."""
+        invalid_inputs = [
+            {"risk_factors": [], "gain_opportunities": []},
+            {"risk_score": 150, "risk_factors": [], "gain_opportunities": []},
+            {"risk_score": "high", "risk_factors": [], "gain_opportunities": []},
+            {"risk_score": True, "risk_factors": [], "gain_opportunities": []},
+            {"risk_score": float("nan"), "risk_factors": [], "gain_opportunities": []},
+            {"risk_score": 50, "risk_factors": "debt", "gain_opportunities": []},
+        ]
+        
+        for tool_input in invalid_inputs:
+            with self.assertRaises(ValueError):
+                parse_risk_metrics(tool_input)
+    
+    def test_analysis_returns_typed_fields(self):
+        """Test the three-turn flow with a structured second turn."""
+        self.analyzer.client.messages.create.side_effect = [
+            _text_response("Initial analysis"),
+            _tool_response("record_risk_metrics", {
+                "risk_score": 80,
+                "risk_factors": ["Debt", "Deficit", "No buffer"],
+                "gain_opportunities": ["Budget", "Consolidate", "Invest"]
+            }),
+            _text_response("1. Do this"),
+        ]
+        
+        analysis = self.analyzer.analyze_financial_situation(self.profile)
+        
+        self.assertEqual(analysis["risk_score"], 80)
+        self.assertEqual(analysis["risk_level"], "Critical")
+        self.assertEqual(len(analysis["risk_factors"]), 3)
+        self.assertIn('"risk_score": 80', analysis["detailed_metrics"])
+        self.assertEqual(analysis["recommendations"], "1. Do this")
+        self.assertIn("net_worth", analysis["projections"])
+        
+        # The first turn carries the locally computed projection
+        first_message = self.analyzer.conversation_history[0]["content"]
+        self.assertIn("Monte Carlo projection", first_message)
+        
+        # The recommendation turn answers the tool call before asking
+        last_turn = self.analyzer.conversation_history[-1]["content"]
+        self.assertEqual(last_turn[0]["type"], "tool_result")
+        self.assertEqual(last_turn[0]["tool_use_id"], "toolu_test")
+        
+        # ...and keeps the tool defined but forbids calling it again
+        last_request = self.analyzer.client.messages.create.call_args.kwargs
+        self.assertEqual(last_request["tool_choice"], {"type": "none"})
+    
+    def test_recommendations_skip_non_text_blocks(self):
+        """Test that the recommendations are the reply's text even if it also holds a tool call."""
+        self.analyzer.client.messages.create.side_effect = [
+            _text_response("Initial analysis"),
+            _tool_response("record_risk_metrics", {
+                "risk_score": 30, "risk_factors": [], "gain_opportunities": []
+            }),
+            SimpleNamespace(content=[
+                SimpleNamespace(type="tool_use", id="toolu_2", name="record_risk_metrics", input={}),
+                SimpleNamespace(type="text", text="1. Do this"),
+                SimpleNamespace(type="text", text="\n2. Then that")
+            ]),
+        ]
+        
+        analysis = self.analyzer.analyze_financial_situation(self.profile)
+        
+        self.assertEqual(analysis["recommendations"], "1. Do this\n2. Then that")
+    
+    def test_itemized_loans_in_prompt(self):
+        """Test that itemized loans and their payoff comparison reach the prompt."""
+        profile = dict(self.profile, loans=[
+            {"name": "Car", "balance": 35000.0, "apr": 6.5, "minimum_payment": 500.0}
+        ])
+        
+        formatted = self.analyzer._format_financial_data(profile, debt_payoff={
+            "extra_payments": [0.0],
+            "avalanche": {"months_to_payoff": [84], "total_interest": [7000.0]},
+            "snowball": {"months_to_payoff": [84], "total_interest": [7000.0]}
+        })
+        
+        self.assertIn("- Total Loans: $35,000.00\n  - Car: $35,000.00 at 6.50% APR", formatted)
+        self.assertIn("avalanche 84 months", formatted)
+        self.assertNotIn("- Loans:", formatted)
+    
+    def test_turns_are_traced(self):
+        """Test that each turn and the local work between turns are timed as spans."""
+        self.analyzer.client.messages.create.side_effect = [
+            _text_response("Initial analysis"),
+            _tool_response("record_risk_metrics", {
+                "risk_score": 20, "risk_factors": [], "gain_opportunities": []
+            }),
+            _text_response("1. Do this"),
+        ]
+        tracer = Tracer()
+        trace = tracer.start("analysis")
+        self.analyzer.analyze_financial_situation(self.profile)
+        tracer.finish(trace)
+        
+        names = [span_record["name"] for span_record in trace.spans]
+        self.assertEqual(names, ["projections", "prepare", "llm_1", "prepare", "llm_2", "prepare", "llm_3", "prepare"])
+        self.assertEqual(trace.spans[0]["parent"], "prepare")
+    
+    def test_missing_tool_call_raises(self):
+        """Test that a reply without the tool call is rejected."""
+        self.analyzer.client.messages.create.side_effect = [
+            _text_response("Initial analysis"),
+            _text_response("Here is some JSON..."),
+        ]
+        
+        with self.assertRaises(ValueError):
+            self.analyzer.analyze_financial_situation(self.profile)
+    
+    def test_async_analyzer_shares_conversation(self):
+        """Test that the async analyzer runs the same three turns."""
+        with mock.patch.dict(os.environ, {"ANTHROPIC_API_KEY": "test-key"}):
+            analyzer = AsyncFinancialAnalyzer()
+        analyzer.client = mock.Mock()
+        analyzer.client.messages.create = mock.AsyncMock(side_effect=[
+            _text_response("Initial analysis"),
+            _tool_response("record_risk_metrics", {
+                "risk_score": 10,
+                "risk_factors": ["None"],
+                "gain_opportunities": ["Invest"]
+            }),
+            _text_response("1. Keep going"),
+        ])
+        
+        analysis = asyncio.run(analyzer.analyze_financial_situation(self.profile))
+        
+        self.assertEqual(analysis["risk_level"], "Low")
+        self.assertEqual(analysis["conversation_turns"], 5)
+        self.assertEqual(analyzer.client.messages.create.await_count, 3)
+
+
+class TestBatchedAssessments(unittest.TestCase):
+    """Test quick assessments of several profiles in one request."""
+    
+    def setUp(self):
+        """Create an analyzer with a mocked Anthropic client."""
+        with mock.patch.dict(os.environ, {"ANTHROPIC_API_KEY": "test-key"}):
+            self.analyzer = FinancialAnalyzer()
+        self.analyzer.client = mock.Mock()
+        self.profiles = [
+            {"annual_income": income, "total_savings": 10000, "total_loans": loans,
+             "monthly_expenses": 2000, "investment_amount": 0}
+            for income, loans in ((90000, 0), (40000, 80000), (60000, 20000))
+        ]
+    
+    def test_parse_assessments(self):
+        """Test that assessments are ordered by profile number and invalid ones skipped."""
+        results = parse_risk_assessments({"assessments": [
+            {"profile": 2, "risk_level": "High", "explanation": " Heavy debt. "},
+            {"profile": 1, "risk_level": "Low", "explanation": "No debt."},
+            {"profile": 3, "risk_level": "Severe", "explanation": "Not a level."},
+            {"profile": 9, "risk_level": "Low", "explanation": "No such profile."}
+        ]}, 3)
+        
+        self.assertEqual(results, ["Low. No debt.", "High. Heavy debt.", None])
+        with self.assertRaises(ValueError):
+            parse_risk_assessments({"assessments": "Low"}, 1)
+    
+    def test_one_request_for_the_batch(self):
+        """Test that a batch is one tool call, with skipped profiles assessed on their own."""
+        self.analyzer.client.messages.create.side_effect = [
+            _tool_response("record_risk_assessments", {"assessments": [
+                {"profile": 1, "risk_level": "Low", "explanation": "No debt."},
+                {"profile": 2, "risk_level": "Critical", "explanation": "Debt is twice income."}
+            ]}),
+            _text_response("Medium. Moderate debt.")
+        ]
+        
+        results = self.analyzer.get_risk_assessments(self.profiles)
+        
+        self.assertEqual(results, ["Low. No debt.", "Critical. Debt is twice income.", "Medium. Moderate debt."])
+        batch_request = self.analyzer.client.messages.create.call_args_list[0].kwargs
+        self.assertEqual(batch_request["tool_choice"]["name"], "record_risk_assessments")
+        self.assertEqual(batch_request["max_tokens"], 300)
+        self.assertIn("Profile 3:", batch_request["messages"][0]["content"])
+        self.assertEqual(self.analyzer.client.messages.create.call_count, 2)
+    
+    def test_single_profile_uses_plain_request(self):
+        """Test that a batch of one is sent as an ordinary quick assessment."""
+        self.analyzer.client.messages.create.return_value = _text_response("Low. No debt.")
+        
+        self.assertEqual(self.analyzer.get_risk_assessments(self.profiles[:1]), ["Low. No debt."])
+        self.assertNotIn("tools", self.analyzer.client.messages.create.call_args.kwargs)
+
+
+class TestCompactPrompts(unittest.TestCase):
+    """Test the compact prompt mode."""
+    
+    def setUp(self):
+        """Create a compact analyzer whose mocked client records each request."""
+        with mock.patch.dict(os.environ, {"ANTHROPIC_API_KEY": "test-key"}):
+            self.analyzer = FinancialAnalyzer(compact=True)
+        self.requests = []
+        responses = iter([
+            _text_response("Long analysis paragraph.\n\nMore detail.\nSUMMARY: Debt is high; build savings."),
+            _tool_response("record_risk_metrics", {
+                "risk_score": 60,
+                "risk_factors": ["Debt"],
+                "gain_opportunities": ["Refinance"]
+            }),
+            _text_response("1. Do this"),
+        ])
+        
+        def create(**request):
+            # The history list is shared across turns, so snapshot it
+            self.requests.append(copy.deepcopy(request))
+            return next(responses)
+        
+        self.analyzer.client = mock.Mock()
+        self.analyzer.client.messages.create.side_effect = create
+        self.profile = {
+            "annual_income": 65000,
+            "total_savings": 15000,
+            "total_loans": 35000,
+            "monthly_expenses": 2500,
+            "investment_amount": 5000
+        }
+    
+    def test_later_turns_resend_summary(self):
+        """Test that later turns carry the summary and a text restatement of the metrics."""
+        analysis = self.analyzer.analyze_financial_situation(self.profile)
+        
+        self.assertEqual(analysis["initial_analysis"], "Long analysis paragraph.\n\nMore detail.")
+        self.assertEqual(analysis["risk_level"], "High")
+        self.assertEqual(analysis["conversation_turns"], 5)
+        
+        first, second, third = self.requests
+        self.assertIn("debt/income=0.54", first["messages"][0]["content"])
+        self.assertIn("projection(2000 paths)", first["messages"][0]["content"])
+        self.assertEqual(second["messages"][1]["content"], "Debt is high; build savings.")
+        self.assertIn("tool_choice", second)
+        self.assertNotIn("tools", third)
+        self.assertIn("risk_score=60 (High)", third["messages"][3]["content"])
+        self.assertTrue(all(isinstance(message["content"], str) for message in third["messages"]))
+    
+    def test_quick_assessment_is_terse(self):
+        """Test that the quick assessment prompt uses the terse encoding."""
+        request = self.analyzer._risk_assessment_request(self.profile)
+        
+        self.assertIn("income=65000/yr", request["messages"][0]["content"])
+        self.assertNotIn("{", request["messages"][0]["content"])
+    
+    def test_split_summary_fallback(self):
+        """Test that a reply without a summary line falls back to its opening text."""
+        body, summary = split_summary("First point. " * 100, max_chars=60)
+        
+        self.assertEqual(body, ("First point. " * 100).strip())
+        self.assertTrue(summary.endswith("."))
+        self.assertLessEqual(len(summary), 60)
+
+
+class TestChat(unittest.TestCase):
+    """Test follow-up chat turns."""
+    
+    def setUp(self):
+        """Create an analyzer whose mocked client records each request."""
+        with mock.patch.dict(os.environ, {"ANTHROPIC_API_KEY": "test-key"}):
+            self.analyzer = FinancialAnalyzer()
+        self.requests = []
+        self.replies = []
+        
+        def create(**request):
+            self.requests.append(copy.deepcopy(request))
+            return _text_response(self.replies.pop(0))
+        
+        self.analyzer.client = mock.Mock()
+        self.analyzer.client.messages.create.side_effect = create
+    
+    def test_short_history_is_sent_verbatim(self):
+        """Test that a short history needs a single request."""
+        self.replies = ["Refinancing saves $40/month."]
+        history = [{"role": "user", "content": "Hi"}, {"role": "assistant", "content": "Hello"}]
+        
+        result = self.analyzer.chat("Risk: 40/100 (Medium)", "", history, "Should I refinance?")
+        
+        self.assertEqual(len(self.requests), 1)
+        self.assertIn("Risk: 40/100 (Medium)", self.requests[0]["system"])
+        self.assertEqual(self.requests[0]["messages"][-1]["content"], "Should I refinance?")
+        self.assertEqual(result["reply"], "Refinancing saves $40/month.")
+        self.assertEqual(len(result["messages"]), 4)
+    
+    def test_long_history_is_summarized(self):
+        """Test that history over the budget is folded into the summary first."""
+        self.replies = ["User is weighing refinancing.", "Yes, refinance."]
+        history = []
+        for turn in range(6):
+            history.append({"role": "user", "content": f"Question {turn} " + "x" * 1500})
+            history.append({"role": "assistant", "content": f"Answer {turn} " + "y" * 1500})
+        
+        result = self.analyzer.chat("context", "Old summary.", history, "So?")
+        
+        summarize, answer = self.requests
+        self.assertIn("Old summary.", summarize["messages"][0]["content"])
+        self.assertIn("Question 0", summarize["messages"][0]["content"])
+        self.assertIn("User is weighing refinancing.", answer["system"])
+        self.assertEqual(len(answer["messages"]), 5)
+        self.assertEqual(result["summary"], "User is weighing refinancing.")
+        self.assertEqual(result["messages"][0]["content"], history[-4]["content"])
+
+
+class _FakeStream:
+    """A fake MessageStream that yields events until it is closed."""
+    
+    def __init__(self, response, events=3, delay=0.0):
+        self.response = response
+        self.events = events
+        self.delay = delay
+        self.consumed = 0
+        self.closed = False
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+    
+    def __iter__(self):
+        for _ in range(self.events):
+            time.sleep(self.delay)
+            if self.closed:
+                raise ConnectionError("stream closed")
+            self.consumed += 1
+            yield SimpleNamespace(type="content_block_delta")
+    
+    def close(self):
+        self.closed = True
+    
+    def get_final_message(self):
+        return self.response
+
+
+class TestCancellation(unittest.TestCase):
+    """Test cancelling analyses between turns and mid-call."""
+    
+    def setUp(self):
+        """Create an analyzer whose mocked client streams canned responses."""
+        with mock.patch.dict(os.environ, {"ANTHROPIC_API_KEY": "test-key"}):
+            self.analyzer = FinancialAnalyzer()
+        self.analyzer.client = mock.Mock()
+        self.profile = {
+            "annual_income": 65000,
+            "total_savings": 15000,
+            "total_loans": 35000,
+            "monthly_expenses": 2500,
+            "investment_amount": 5000
+        }
+        self.responses = [
+            _text_response("Initial analysis"),
+            _tool_response("record_risk_metrics", {
+                "risk_score": 30, "risk_factors": ["Debt"], "gain_opportunities": ["Invest"]
+            }),
+            _text_response("1. Do this"),
+        ]
+    
+    def test_token_streams_every_call(self):
+        """Test that an uncancelled token streams all three turns to completion."""
+        self.analyzer.client.messages.stream.side_effect = [_FakeStream(r) for r in self.responses]
+        
+        analysis = self.analyzer.analyze_financial_situation(self.profile, cancel_token=CancelToken())
+        
+        self.assertEqual(analysis["risk_level"], "Medium")
+        self.assertEqual(self.analyzer.client.messages.stream.call_count, 3)
+        self.analyzer.client.messages.create.assert_not_called()
+    
+    def test_cancel_between_turns(self):
+        """Test that no further call is made once the token is cancelled."""
+        token = CancelToken()
+        
+        def stream(**request):
+            token.cancel()
+            return _FakeStream(self.responses[0])
+        
+        self.analyzer.client.messages.stream.side_effect = stream
+        
+        with self.assertRaises(AnalysisCancelled):
+            self.analyzer.analyze_financial_situation(self.profile, cancel_token=token)
+        self.assertEqual(self.analyzer.client.messages.stream.call_count, 1)
+    
+    def test_cancel_aborts_stream_in_flight(self):
+        """Test that cancelling from another thread closes the open stream."""
+        token = CancelToken()
+        slow_stream = _FakeStream(self.responses[0], events=200, delay=0.01)
+        self.analyzer.client.messages.stream.return_value = slow_stream
+        threading.Timer(0.1, token.cancel).start()
+        
+        with self.assertRaises(AnalysisCancelled):
+            self.analyzer.analyze_financial_situation(self.profile, cancel_token=token)
+        self.assertTrue(slow_stream.closed)
+        self.assertLess(slow_stream.consumed, 50)
+    
+    def test_async_cancel_aborts_call_in_flight(self):
+        """Test that cancelling the token cancels the awaited upstream call."""
+        with mock.patch.dict(os.environ, {"ANTHROPIC_API_KEY": "test-key"}):
+            analyzer = AsyncFinancialAnalyzer()
+        started = []
+        
+        async def create(**request):
+            started.append(request)
+            await asyncio.sleep(10)
+        
+        analyzer.client = mock.Mock()
+        analyzer.client.messages.create = create
+        token = CancelToken()
+        
+        async def run():
+            asyncio.get_running_loop().call_later(0.05, token.cancel)
+            return await analyzer.analyze_financial_situation(self.profile, cancel_token=token)
+        
+        begin = time.monotonic()
+        with self.assertRaises(AnalysisCancelled):
+            asyncio.run(run())
+        self.assertLess(time.monotonic() - begin, 5)
+        self.assertEqual(len(started), 1)
+
+
+def _message(content, input_tokens=1000, output_tokens=200):
+    """Build a real Messages API response, as recorded cassettes hold."""
+    return Message.model_validate({
+        "id": "msg_test", "type": "message", "role": "assistant",
+        "model": "claude-3-5-sonnet-20241022", "content": content,
+        "stop_reason": "end_turn", "stop_sequence": None,
+        "usage": {"input_tokens": input_tokens, "output_tokens": output_tokens}
+    })
+
+
+class TestCassette(unittest.TestCase):
+    """Test recording an analysis to a cassette and replaying it offline."""
+    
+    def setUp(self):
+        """Record one analysis against a scripted upstream client."""
+        self.path = os.path.join(tempfile.mkdtemp(), "analysis.json")
+        self.profile = {
+            "annual_income": 65000,
+            "total_savings": 15000,
+            "total_loans": 35000,
+            "monthly_expenses": 2500,
+            "investment_amount": 5000
+        }
+        upstream = mock.Mock()
+        upstream.messages.create.side_effect = [
+            _message([{"type": "text", "text": "Initial analysis"}]),
+            _message([{"type": "tool_use", "id": "toolu_rec", "name": "record_risk_metrics", "input": {
+                "risk_score": 62, "risk_factors": ["Debt"], "gain_opportunities": ["Invest"]
+            }}]),
+            _message([{"type": "text", "text": "1. Pay the card"}]),
+        ]
+        env = {"ANTHROPIC_API_KEY": "test-key", "ANTHROPIC_CASSETTE": self.path,
+               "ANTHROPIC_CASSETTE_MODE": "record"}
+        with mock.patch.dict(os.environ, env), \
+                mock.patch.object(FinancialAnalyzer, "_create_client", return_value=upstream):
+            self.recorded = FinancialAnalyzer().analyze_financial_situation(self.profile)
+    
+    def replaying(self, analyzer_class=FinancialAnalyzer, latency="0"):
+        """Create an analyzer that replays the cassette."""
+        env = {"ANTHROPIC_API_KEY": "test-key", "ANTHROPIC_CASSETTE": self.path,
+               "ANTHROPIC_CASSETTE_MODE": "replay", "ANTHROPIC_CASSETTE_LATENCY": latency}
+        with mock.patch.dict(os.environ, env):
+            return analyzer_class()
+    
+    def set_recorded_latency(self, seconds):
+        """Rewrite every recorded call as having taken ``seconds``."""
+        with open(self.path) as f:
+            data = json.load(f)
+        for interaction in data["interactions"]:
+            interaction["elapsed"] = seconds
+        with open(self.path, "w") as f:
+            json.dump(data, f)
+    
+    def test_cassette_holds_usage_and_timing(self):
+        """Test that each call is saved with its request, usage and latency."""
+        cassette = Cassette(self.path)
+        
+        self.assertEqual(cassette.summary()["calls"], 3)
+        self.assertEqual(cassette.summary()["input_tokens"], 3000)
+        second = cassette.interactions[1]
+        self.assertEqual(second["request"]["tool_choice"]["name"], "record_risk_metrics")
+        self.assertEqual(len(second["request"]["messages"]), 3)
+        self.assertGreaterEqual(second["elapsed"], 0)
+    
+    def test_replay_reproduces_analysis(self):
+        """Test that replays give the recorded result, repeatedly and for both analyzers."""
+        analyzer = self.replaying()
+        
+        self.assertEqual(analyzer.analyze_financial_situation(self.profile), self.recorded)
+        self.assertEqual(analyzer.analyze_financial_situation(self.profile), self.recorded)
+        self.assertEqual(analyzer.analyze_financial_situation(self.profile, cancel_token=CancelToken()),
+                         self.recorded)
+        async_analysis = asyncio.run(
+            self.replaying(AsyncFinancialAnalyzer).analyze_financial_situation(self.profile))
+        self.assertEqual(async_analysis, self.recorded)
+    
+    def test_async_stream_replay(self):
+        """Test that the async client replays a recorded call as a stream and stops when closed."""
+        self.set_recorded_latency(0.2)
+        cassette = Cassette(self.path, latency_scale=1)
+        client = AsyncCassetteClient(cassette)
+        request = cassette.interactions[0]["request"]
+        
+        async def replay(close_after):
+            events = 0
+            async with client.messages.stream(**request) as stream:
+                async for _ in stream:
+                    events += 1
+                    if events == close_after:
+                        await stream.close()
+                message = await stream.get_final_message()
+            return events, message
+        
+        events, message = asyncio.run(replay(close_after=None))
+        self.assertEqual(events, 10)
+        self.assertEqual(message.content[0].text, "Initial analysis")
+        
+        begin = time.monotonic()
+        events, _ = asyncio.run(replay(close_after=2))
+        self.assertEqual(events, 2)
+        self.assertLess(time.monotonic() - begin, 0.15)
+    
+    def test_unrecorded_request_raises(self):
+        """Test that a request the cassette never saw is not answered."""
+        with self.assertRaises(CassetteMismatch):
+            self.replaying().analyze_financial_situation(dict(self.profile, total_savings=16000))
+    
+    def test_replay_with_recorded_latency(self):
+        """Test that replays can wait the recorded latency and still be cancelled mid-call."""
+        self.set_recorded_latency(0.1)
+        analyzer = self.replaying(latency="1")
+        
+        begin = time.monotonic()
+        analyzer.analyze_financial_situation(self.profile)
+        self.assertGreaterEqual(time.monotonic() - begin, 0.3)
+        
+        token = CancelToken()
+        threading.Timer(0.15, token.cancel).start()
+        begin = time.monotonic()
+        with self.assertRaises(AnalysisCancelled):
+            analyzer.analyze_financial_situation(self.profile, cancel_token=token)
+        self.assertLess(time.monotonic() - begin, 0.25)
+
+
 if __name__ == '__main__':
     unittest.main(verbosity=2)
@@ -0,0 +1,1462 @@
+"""
+Tests for the Flask and ASGI web servers and their supporting components.
+The analyzer is mocked, so these tests never call the Anthropic API.
+"""
+
+import asyncio
+import gzip
+import json
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+import anthropic
+
+os.environ.setdefault('ANTHROPIC_API_KEY', 'test-key')
+
+import app as web_app
+import asgi_app
+import benchmark_servers
+from api_helpers import client_id_for
+from archetypes import ArchetypeIndex
+from cancellation import AnalysisCancelled, CancelToken, SupersedingRegistry
+from chat import ChatSessionStore, SessionBusyError
+from batching import MicroBatcher, AsyncMicroBatcher
+from compression import choose_encoding
+from anthropic.types import Message
+from financial_analyzer import FinancialAnalyzer, AsyncFinancialAnalyzer
+from jobs import JobQueue, QueueFullError, validate_callback_url
+from rate_limit import RateLimiter, RateLimitExceeded, TokenBucket
+from health import MonitoredClient, ReadinessPolicy, UpstreamMonitor
+from result_cache import ResultCache, cache_key
+from scheduler import PriorityScheduler, SchedulerBusy
+from tracing import Tracer
+
+
+SAMPLE_PROFILE = {
+    'annual_income': '85000',
+    'total_savings': '25000',
+    'total_loans': '40000',
+    'monthly_expenses': '3200',
+    'investment_amount': '8000'
+}
+
+SAMPLE_ANALYSIS = {
+    'initial_analysis': 'Initial analysis',
+    'detailed_metrics': '{"risk_score": 40}',
+    'risk_score': 40,
+    'risk_level': 'Medium',
+    'risk_factors': ['Debt'],
+    'gain_opportunities': ['Invest'],
+    'recommendations': '1. Save more',
+    'conversation_turns': 5
+}
+
+
+def wait_for_job(client, job_id, timeout=5):
+    """Poll a job until it finishes and return its final state."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = client.get(f'/api/jobs/{job_id}').get_json()
+        if job['status'] in ('succeeded', 'failed', 'cancelled'):
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f'Job {job_id} did not finish')
+
+
+def unlimited_rate_limiter():
+    """A rate limiter that admits everything, for tests of other behavior."""
+    return RateLimiter(client_rpm=1e9, client_tpm=1e12, upstream_rpm=1e9, upstream_tpm=1e12)
+
+
+class FakeClock:
+    """A manually advanced monotonic clock."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class AppTestCase(unittest.TestCase):
+    """Base class that swaps in a mocked analyzer."""
+
+    def setUp(self):
+        self.analyzer = mock.Mock()
+        self.analyzer.analyze_financial_situation.return_value = dict(SAMPLE_ANALYSIS)
+        self.analyzer.get_risk_assessments.side_effect = lambda profiles: ['Medium. Manageable debt.'] * len(profiles)
+        for name, value in [('analyzer', self.analyzer), ('rate_limiter', unlimited_rate_limiter()),
+                            ('archetype_index', ArchetypeIndex())]:
+            patcher = mock.patch.object(web_app, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.client = web_app.app.test_client()
+
+
+class TestAnalyzeRoute(AppTestCase):
+    """Test the /api/analyze route."""
+
+    def test_sync_analysis(self):
+        """Test that a synchronous analysis returns the full response."""
+        response = self.client.post('/api/analyze', json=SAMPLE_PROFILE)
+        body = response.get_json()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body['analysis']['risk_score'], 40)
+        self.assertEqual(body['metrics']['debt_to_savings_ratio'], 1.6)
+        self.assertEqual(body['input_data']['annual_income'], 85000.0)
+
+    def test_validation_errors(self):
+        """Test that invalid payloads are rejected with 400."""
+        missing = dict(SAMPLE_PROFILE)
+        del missing['total_loans']
+        negative = dict(SAMPLE_PROFILE, total_savings='-1')
+        malformed = dict(SAMPLE_PROFILE, annual_income='abc')
+
+        for payload, message in [
+            (missing, 'Missing field: total_loans'),
+            (negative, 'total_savings must be non-negative'),
+            (malformed, 'Invalid number format'),
+        ]:
+            response = self.client.post('/api/analyze', json=payload)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn(message, response.get_json()['error'])
+
+    def test_non_object_bodies(self):
+        """Test that JSON bodies which aren't objects, or hold non-scalar numbers, are rejected with 400."""
+        for path in ('/api/analyze', '/api/analyze/provisional'):
+            for payload, message in [
+                ([1, 2], 'Request body must be a JSON object'),
+                (dict(SAMPLE_PROFILE, annual_income=[85000]), 'Invalid number format'),
+            ]:
+                response = self.client.post(path, json=payload)
+                self.assertEqual(response.status_code, 400, path)
+                self.assertIn(message, response.get_json()['error'])
+
+    def test_itemized_loans(self):
+        """Test that itemized loans replace total_loans and add a payoff comparison."""
+        payload = dict(SAMPLE_PROFILE, loans=[
+            {'name': 'Car', 'balance': '15000', 'apr': '6.5', 'minimum_payment': '350'},
+            {'name': 'Card', 'balance': '5000', 'apr': '22.9', 'minimum_payment': '150'}
+        ])
+        del payload['total_loans']
+
+        body = self.client.post('/api/analyze', json=payload).get_json()
+
+        self.assertEqual(body['input_data']['total_loans'], 20000.0)
+        self.assertEqual(body['input_data']['loans'][1]['apr'], 22.9)
+        self.assertIn('avalanche', body['debt_payoff'])
+        self.assertNotIn('debt_payoff', self.client.post('/api/analyze', json=SAMPLE_PROFILE).get_json())
+
+    def test_unsafe_callback_url_rejected(self):
+        """Test that callbacks to non-URLs and internal addresses are refused before queueing."""
+        for callback_url in (123, 'ftp://example.com/', 'http://169.254.169.254/latest', 'http://localhost:8080/'):
+            payload = dict(SAMPLE_PROFILE, callback_url=callback_url, **{'async': True})
+            response = self.client.post('/api/analyze', json=payload)
+            self.assertEqual(response.status_code, 400, callback_url)
+        self.analyzer.analyze_financial_situation.assert_not_called()
+
+    def test_async_analysis(self):
+        """Test that async mode returns 202 and the result can be polled."""
+        response = self.client.post('/api/analyze', json=dict(SAMPLE_PROFILE, **{'async': True}))
+        body = response.get_json()
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.headers['Location'], f"/api/jobs/{body['job_id']}")
+
+        job = wait_for_job(self.client, body['job_id'])
+        self.assertEqual(job['status'], 'succeeded')
+        self.assertEqual(job['result']['analysis']['risk_level'], 'Medium')
+
+    def test_async_analysis_gets_provisional_answer(self):
+        """Test that an async submission gets a similar profile's risk score at once."""
+        self.analyzer.analyze_financial_situation.return_value = dict(
+            SAMPLE_ANALYSIS, initial_analysis='Private: your $85,000 salary', risk_factors=['Private factor'],
+            gain_opportunities=['Private opportunity'], recommendations='1. Private advice'
+        )
+        self.client.post('/api/analyze', json=SAMPLE_PROFILE)
+        similar = dict(SAMPLE_PROFILE, annual_income='88000', **{'async': True})
+
+        body = self.client.post('/api/analyze', json=similar).get_json()
+
+        provisional = body['provisional']
+        self.assertTrue(provisional['provisional'])
+        self.assertEqual(provisional['analysis']['risk_level'], 'Medium')
+        self.assertEqual(provisional['input_data']['annual_income'], 88000.0)
+        self.assertLess(provisional['archetype_distance'], 0.1)
+        self.assertEqual(wait_for_job(self.client, body['job_id'])['status'], 'succeeded')
+
+        # None of the earlier user's written analysis is passed on; the
+        # provisional text quotes the submitted profile's own figures
+        self.assertNotIn('Private', json.dumps(provisional['analysis']))
+        self.assertIn('$4,133', provisional['analysis']['initial_analysis'])
+
+        different = dict(SAMPLE_PROFILE, total_loans='400000', **{'async': True})
+        body = self.client.post('/api/analyze', json=different).get_json()
+        self.assertNotIn('provisional', body)
+        wait_for_job(self.client, body['job_id'])
+
+    def test_provisional_endpoint(self):
+        """Test that the provisional endpoint answers from a similar analyzed profile, or 204."""
+        self.assertEqual(self.client.post('/api/analyze/provisional', json=SAMPLE_PROFILE).status_code, 204)
+        self.client.post('/api/analyze', json=SAMPLE_PROFILE)
+
+        response = self.client.post('/api/analyze/provisional', json=dict(SAMPLE_PROFILE, annual_income='88000'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.get_json()['provisional'])
+        # Projections are left to the full analysis to keep the answer instant
+        self.assertNotIn('projections', response.get_json())
+        self.assertEqual(response.get_json()['analysis']['risk_score'], SAMPLE_ANALYSIS['risk_score'])
+        self.assertEqual(self.client.post('/api/analyze/provisional', json={'annual_income': 'x'}).status_code, 400)
+        self.assertEqual(self.analyzer.analyze_financial_situation.call_count, 1)
+
+    def test_unknown_job(self):
+        """Test that polling an unknown job returns 404."""
+        response = self.client.get('/api/jobs/does-not-exist')
+        self.assertEqual(response.status_code, 404)
+
+
+def blocking_analysis(financial_data, cancel_token=None):
+    """Stand-in analysis that runs until its token is cancelled."""
+    if cancel_token is None or not cancel_token.wait(5):
+        return dict(SAMPLE_ANALYSIS)
+    raise AnalysisCancelled('Analysis cancelled')
+
+
+class TestCancellation(AppTestCase):
+    """Test superseding and cancelling analyses."""
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(web_app, 'active_analyses', SupersedingRegistry())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.analyzer.analyze_financial_situation.side_effect = blocking_analysis
+
+    def post_in_background(self, path, headers):
+        """POST an analysis from another thread and return a holder for its response."""
+        holder = {}
+        thread = threading.Thread(target=lambda: holder.update(
+            response=web_app.app.test_client().post(path, json=SAMPLE_PROFILE, headers=headers)
+        ))
+        thread.start()
+        holder['thread'] = thread
+        return holder
+
+    def wait_until_running(self, count):
+        deadline = time.time() + 5
+        while self.analyzer.analyze_financial_situation.call_count < count and time.time() < deadline:
+            time.sleep(0.01)
+
+    def test_newer_submission_supersedes(self):
+        """Test that a resubmission from the same tab cancels the older analysis."""
+        headers = {'X-Supersede-Key': 'tab-1'}
+        first = self.post_in_background('/api/analyze', headers)
+        self.wait_until_running(1)
+        second = self.post_in_background('/api/analyze', headers)
+        self.wait_until_running(2)
+
+        first['thread'].join(5)
+        self.assertEqual(first['response'].status_code, 409)
+        self.assertEqual(first['response'].get_json()['error'], 'Analysis cancelled')
+
+        self.client.post('/api/analyze/cancel', json={'supersede_key': 'tab-1'})
+        second['thread'].join(5)
+        self.assertEqual(second['response'].status_code, 409)
+
+    def test_other_tabs_are_not_superseded(self):
+        """Test that different supersede keys run side by side."""
+        first = self.post_in_background('/api/analyze', {'X-Supersede-Key': 'tab-1'})
+        self.wait_until_running(1)
+
+        response = self.client.post('/api/analyze/cancel', json={'supersede_key': 'tab-2'})
+        self.assertFalse(response.get_json()['cancelled'])
+
+        response = self.client.post('/api/analyze/cancel', json={'supersede_key': 'tab-1'})
+        self.assertTrue(response.get_json()['cancelled'])
+        first['thread'].join(5)
+        self.assertEqual(first['response'].status_code, 409)
+
+    def test_cancel_job(self):
+        """Test that DELETE cancels a running job."""
+        body = self.client.post('/api/analyze', json=dict(SAMPLE_PROFILE, **{'async': True})).get_json()
+        self.wait_until_running(1)
+
+        self.assertEqual(self.client.delete(f"/api/jobs/{body['job_id']}").status_code, 200)
+        self.assertEqual(wait_for_job(self.client, body['job_id'])['status'], 'cancelled')
+        self.assertEqual(self.client.delete('/api/jobs/unknown').status_code, 404)
+
+
+class TestJobQueue(unittest.TestCase):
+    """Test the bounded background job queue."""
+
+    def test_failed_job_records_error(self):
+        """Test that exceptions are captured on the job."""
+        queue = JobQueue(max_workers=1)
+        self.addCleanup(queue.shutdown)
+
+        def fail():
+            raise RuntimeError('upstream timeout')
+
+        job_id = queue.submit(fail)
+        queue.shutdown(wait=True)
+
+        job = queue.get(job_id)
+        self.assertEqual(job['status'], 'failed')
+        self.assertEqual(job['error'], 'upstream timeout')
+
+    def test_queue_full(self):
+        """Test that submissions beyond max_pending are rejected."""
+        queue = JobQueue(max_workers=1, max_pending=2)
+        release = threading.Event()
+        self.addCleanup(queue.shutdown)
+        self.addCleanup(release.set)
+
+        queue.submit(release.wait)
+        queue.submit(release.wait)
+
+        with self.assertRaises(QueueFullError):
+            queue.submit(release.wait)
+
+    def test_cancel_queued_job(self):
+        """Test that a cancelled queued job never runs."""
+        queue = JobQueue(max_workers=1)
+        release = threading.Event()
+        self.addCleanup(release.set)
+        ran = []
+
+        queue.submit(release.wait)
+        job_id = queue.submit(lambda: ran.append(True))
+        self.assertEqual(queue.cancel(job_id)['status'], 'cancelled')
+        release.set()
+        queue.shutdown(wait=True)
+
+        self.assertEqual(ran, [])
+        self.assertEqual(queue.get(job_id)['status'], 'cancelled')
+
+    def test_callback_url_validation(self):
+        """Test that only public http(s) callback targets are accepted."""
+        self.assertEqual(validate_callback_url('https://93.184.216.34/hook'), 'https://93.184.216.34/hook')
+        for url in (None, 'file:///etc/passwd', 'http://127.0.0.1/', 'http://10.0.0.5/', 'http://192.168.1.1/',
+                    'http://169.254.169.254/', 'http://[::1]/', 'http://0.0.0.0/'):
+            with self.assertRaises(ValueError, msg=url):
+                validate_callback_url(url)
+
+        with mock.patch.dict(os.environ, {'CALLBACK_ALLOWED_HOSTS': 'hooks.internal'}):
+            self.assertEqual(validate_callback_url('http://hooks.internal/done'), 'http://hooks.internal/done')
+            with self.assertRaises(ValueError):
+                validate_callback_url('https://93.184.216.34/hook')
+
+    def test_slow_callback_does_not_hold_a_worker(self):
+        """Test that callbacks are delivered off the job worker pool."""
+        queue = JobQueue(max_workers=1)
+        release = threading.Event()
+        self.addCleanup(queue.shutdown)
+        self.addCleanup(release.set)
+
+        with mock.patch.object(JobQueue, '_send_callback', side_effect=lambda url, job: release.wait(5)):
+            queue.submit(lambda: 1, callback_url='https://93.184.216.34/hook')
+            second = queue.submit(lambda: 2)
+            deadline = time.time() + 2
+            while queue.get(second)['status'] != 'succeeded' and time.time() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(queue.get(second)['result'], 2)
+            release.set()
+            queue.shutdown(wait=True)
+
+    def test_finished_jobs_are_evicted(self):
+        """Test that only max_results finished jobs are retained."""
+        queue = JobQueue(max_workers=1, max_results=2)
+        job_ids = [queue.submit(lambda i=i: i) for i in range(3)]
+        queue.shutdown(wait=True)
+
+        self.assertIsNone(queue.get(job_ids[0]))
+        self.assertEqual(queue.get(job_ids[2])['result'], 2)
+
+
+class TestRateLimiter(unittest.TestCase):
+    """Test token-bucket admission control."""
+
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def test_bucket_refills_over_time(self):
+        """Test that a drained bucket reports the time until refill."""
+        bucket = TokenBucket(60, clock=self.clock)
+        bucket.take(60)
+        self.assertAlmostEqual(bucket.wait_time(1), 1.0)
+
+        self.clock.now += 1
+        self.assertEqual(bucket.wait_time(1), 0)
+
+    def test_excess_requests_queue_then_reject(self):
+        """Test that bursts wait in a bounded queue and then get rejected."""
+        limiter = RateLimiter(client_rpm=2, max_wait=60, max_queue_per_client=1, clock=self.clock)
+
+        self.assertEqual(limiter.reserve('ip:a', 100), 0)
+        self.assertEqual(limiter.reserve('ip:a', 100), 0)
+        self.assertAlmostEqual(limiter.reserve('ip:a', 100), 30)
+
+        with self.assertRaises(RateLimitExceeded) as raised:
+            limiter.reserve('ip:a', 100)
+        self.assertEqual(raised.exception.retry_after_header, '60')
+
+        # Other clients keep their own quota
+        self.assertEqual(limiter.reserve('ip:b', 100), 0)
+
+    def test_token_budget_is_enforced(self):
+        """Test that estimated tokens are limited as well as requests."""
+        limiter = RateLimiter(client_tpm=1000, max_wait=10, clock=self.clock)
+        limiter.reserve('key:x', 1000)
+
+        with self.assertRaises(RateLimitExceeded):
+            limiter.reserve('key:x', 1000)
+
+    def test_upstream_limit_is_shared(self):
+        """Test that the upstream bucket limits all clients together."""
+        limiter = RateLimiter(upstream_rpm=1, max_wait=0, clock=self.clock)
+        limiter.reserve('ip:a', 10)
+
+        with self.assertRaises(RateLimitExceeded):
+            limiter.reserve('ip:b', 10)
+
+    def test_quick_assessments_have_held_back_upstream_quota(self):
+        """Test that analyses exhausting the upstream quota don't hold up priority requests."""
+        limiter = RateLimiter(client_tpm=1e9, upstream_rpm=1000, upstream_tpm=60000, max_wait=60,
+                              max_queue_per_client=10, priority_share=0.2, clock=self.clock)
+        for client in range(8):
+            self.assertEqual(limiter.reserve(f'ip:{client}', 6000), 0)
+        # The shared 48000 tokens are spent; later analyses wait for them to refill
+        self.assertAlmostEqual(limiter.reserve('ip:8', 6000), 7.5)
+        self.assertGreater(limiter.reserve('ip:9', 500), 7.5)
+
+        self.assertEqual(limiter.reserve('ip:9', 500, priority=True), 0)
+
+    def test_only_issued_api_keys_get_their_own_quota(self):
+        """Test that unrecognized API keys fall back to the caller's IP address."""
+        with mock.patch.dict(os.environ, {'RATE_LIMIT_API_KEYS': 'issued-1, issued-2'}):
+            issued = client_id_for({'X-API-Key': 'issued-2'}, '10.0.0.1')
+            forged = client_id_for({'X-API-Key': 'random-123'}, '10.0.0.1')
+
+        self.assertTrue(issued.startswith('key:'))
+        self.assertNotIn('issued-2', issued)
+        self.assertEqual(forged, 'ip:10.0.0.1')
+        self.assertEqual(client_id_for({'X-API-Key': 'issued-1'}, '10.0.0.1'), 'ip:10.0.0.1')
+
+    def test_route_returns_429(self):
+        """Test that a rejected request gets 429 with Retry-After."""
+        limiter = RateLimiter(client_rpm=1, max_wait=0)
+        analyzer = mock.Mock(**{'analyze_financial_situation.return_value': dict(SAMPLE_ANALYSIS)})
+        client = web_app.app.test_client()
+
+        with mock.patch.object(web_app, 'rate_limiter', limiter), \
+                mock.patch.object(web_app, 'analyzer', analyzer):
+            first = client.post('/api/analyze', json=SAMPLE_PROFILE)
+            second = client.post('/api/analyze', json=SAMPLE_PROFILE)
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.status_code, 429)
+        self.assertEqual(second.headers['Retry-After'], '60')
+        self.assertEqual(second.get_json()['error'], 'Rate limit exceeded')
+
+
+class TestArchetypeIndex(unittest.TestCase):
+    """Test the nearest-archetype index."""
+
+    def profile(self, **changes):
+        return dict({key: float(value) for key, value in SAMPLE_PROFILE.items()}, **changes)
+
+    def analysis(self, risk_score):
+        return dict(SAMPLE_ANALYSIS, risk_score=risk_score, projections={'years': [0]})
+
+    def test_nearest_profile_matches(self):
+        """Test that lookups return the closest entry within range, without projections."""
+        index = ArchetypeIndex()
+        index.add(self.profile(), self.analysis(40))
+        index.add(self.profile(total_loans=200000.0), self.analysis(80))
+
+        matches = index.nearest(self.profile(total_loans=180000.0), k=2)
+        self.assertEqual([match['analysis']['risk_score'] for match in matches], [80])
+        self.assertNotIn('projections', matches[0]['analysis'])
+        self.assertEqual(index.nearest(self.profile(annual_income=5e6, total_savings=1e6)), [])
+        self.assertEqual(index.stats()['hit_ratio'], 0.5)
+
+    def test_near_duplicates_replace_entries(self):
+        """Test that a new analysis of a near-identical profile replaces the old one."""
+        index = ArchetypeIndex()
+        index.add(self.profile(), self.analysis(40))
+        index.add(self.profile(annual_income=86000.0), self.analysis(42))
+
+        self.assertEqual(len(index), 1)
+        self.assertEqual(index.nearest(self.profile())[0]['analysis']['risk_score'], 42)
+
+    def test_capacity_evicts_least_recently_used(self):
+        """Test that a full index evicts the entry least recently added or matched."""
+        index = ArchetypeIndex(capacity=2)
+        index.add(self.profile(), self.analysis(40))
+        index.add(self.profile(total_loans=200000.0), self.analysis(80))
+        index.nearest(self.profile())
+        index.add(self.profile(total_savings=0.0), self.analysis(60))
+
+        self.assertEqual(len(index), 2)
+        self.assertEqual(index.nearest(self.profile(total_loans=200000.0)), [])
+        self.assertEqual(index.nearest(self.profile())[0]['analysis']['risk_score'], 40)
+
+
+class TestScheduler(unittest.TestCase):
+    """Test priority scheduling of analyzer calls."""
+
+    def make_scheduler(self, max_wait=5, **weights):
+        """A one-slot scheduler with the given class weights."""
+        classes = {name: {'weight': weight, 'max_wait': max_wait, 'max_queue': 10}
+                   for name, weight in weights.items()}
+        return PriorityScheduler(max_concurrent=1, classes=classes)
+
+    def run_queued(self, scheduler, requests):
+        """Queue ``requests`` (class names) behind a held slot, release it and return the grant order."""
+        order = []
+
+        def run(request_class):
+            with scheduler.slot(request_class):
+                order.append(request_class)
+
+        threads = []
+        with scheduler.slot(requests[0]):
+            for count, request_class in enumerate(requests, start=1):
+                threads.append(threading.Thread(target=run, args=(request_class,)))
+                threads[-1].start()
+                while sum(scheduler.stats()['queued'].values()) < count:
+                    time.sleep(0.001)
+        for thread in threads:
+            thread.join(5)
+        return order
+
+    def test_quick_requests_jump_the_queue(self):
+        """Test that a quick assessment is served before analyses queued earlier."""
+        scheduler = self.make_scheduler(quick=8, analysis=1)
+        order = self.run_queued(scheduler, ['analysis', 'analysis', 'analysis', 'quick'])
+        self.assertEqual(order, ['quick', 'analysis', 'analysis', 'analysis'])
+
+    def test_weights_share_slots(self):
+        """Test that a lower-weight class still gets its share while others wait."""
+        scheduler = self.make_scheduler(quick=2, analysis=1)
+        order = self.run_queued(scheduler, ['analysis'] * 3 + ['quick'] * 3)
+        self.assertEqual(order, ['quick', 'analysis', 'quick', 'quick', 'analysis', 'analysis'])
+
+    def test_stale_requests_are_dropped(self):
+        """Test that a request waiting past its deadline is dropped, not run late."""
+        scheduler = self.make_scheduler(max_wait=0.05, quick=1)
+        with scheduler.slot('quick'):
+            with self.assertRaises(SchedulerBusy):
+                with scheduler.slot('quick'):
+                    self.fail('Stale request ran')
+        self.assertEqual(scheduler.stats()['dropped'], {'quick': 1})
+        self.assertEqual(scheduler.stats()['running'], 0)
+
+    def test_cancelled_request_leaves_queue(self):
+        """Test that cancelling a queued request stops its wait."""
+        scheduler = self.make_scheduler(analysis=1)
+        token = CancelToken()
+        threading.Timer(0.02, token.cancel).start()
+        with scheduler.slot('analysis'):
+            with self.assertRaises(AnalysisCancelled):
+                with scheduler.slot('analysis', token):
+                    pass
+        self.assertEqual(scheduler.stats()['queued'], {'analysis': 0})
+
+    def test_async_priority(self):
+        """Test that asyncio waiters are granted slots in priority order."""
+        scheduler = self.make_scheduler(quick=8, analysis=1)
+        order = []
+
+        async def run(request_class):
+            async with scheduler.slot_async(request_class):
+                order.append(request_class)
+
+        async def main():
+            async with scheduler.slot_async('analysis'):
+                tasks = [asyncio.ensure_future(run(name)) for name in ['analysis', 'quick']]
+                await asyncio.sleep(0.01)
+            await asyncio.gather(*tasks)
+
+        asyncio.run(main())
+        self.assertEqual(order, ['quick', 'analysis'])
+
+    def test_route_returns_503(self):
+        """Test that a dropped quick assessment gets 503 with Retry-After."""
+        scheduler = PriorityScheduler(max_concurrent=0, classes={
+            'quick': {'weight': 1, 'max_wait': 0, 'max_queue': 10}
+        })
+        analyzer = mock.Mock(**{'get_risk_assessments.return_value': ['Low']})
+
+        with mock.patch.object(web_app, 'scheduler', scheduler), \
+                mock.patch.object(web_app, 'analyzer', analyzer), \
+                mock.patch.object(web_app, 'rate_limiter', unlimited_rate_limiter()):
+            response = web_app.app.test_client().post('/api/quick-assessment', json=SAMPLE_PROFILE)
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['Retry-After'], '1')
+        self.assertEqual(response.get_json()['error'], 'Server busy')
+        analyzer.get_risk_assessments.assert_not_called()
+
+    def test_quick_assessment_admitted_behind_analysis_backlog(self):
+        """Test that a quick assessment is admitted at once when analyses have used up the upstream quota."""
+        limiter = RateLimiter(client_tpm=1e9, upstream_rpm=1000, upstream_tpm=60000, max_wait=30,
+                              priority_share=0.2)
+        for client in range(12):
+            limiter.reserve(f'ip:10.0.0.{client}', 6000)
+        analyzer = mock.Mock(**{'get_risk_assessments.return_value': ['Low']})
+
+        with mock.patch.object(web_app, 'analyzer', analyzer), \
+                mock.patch.object(web_app, 'rate_limiter', limiter):
+            begin = time.monotonic()
+            response = web_app.app.test_client().post('/api/quick-assessment', json=SAMPLE_PROFILE)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertLess(time.monotonic() - begin, 1)
+
+
+def rate_limit_error():
+    """An upstream 429, as the Anthropic client raises it."""
+    response = mock.Mock(status_code=429, headers={})
+    return anthropic.RateLimitError('Rate limited', response=response, body=None)
+
+
+class TestHealth(unittest.TestCase):
+    """Test upstream monitoring, the health report and readiness."""
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.monitor = UpstreamMonitor(window=60, clock=self.clock)
+
+    def test_rolling_statistics(self):
+        """Test latency percentiles and error and 429 rates over the window."""
+        for latency in range(1, 9):
+            self.monitor.record(latency, 'ok')
+        self.monitor.record(10, 'error')
+        self.monitor.record(0.5, 'rate_limited')
+
+        snapshot = self.monitor.snapshot()
+        self.assertEqual(snapshot['calls'], 10)
+        self.assertEqual(snapshot['latency_ms']['p50'], 4500.0)
+        self.assertEqual((snapshot['error_rate'], snapshot['rate_limited_rate']), (0.1, 0.1))
+
+        self.clock.now += 61
+        self.assertEqual(self.monitor.snapshot()['calls'], 0)
+
+    def test_monitored_client_classifies_calls(self):
+        """Test that successes, errors and 429s are recorded, but not other exceptions."""
+        upstream = mock.Mock()
+        upstream.messages.create.side_effect = ['reply', rate_limit_error(), AnalysisCancelled('stop')]
+        client = MonitoredClient(upstream, self.monitor)
+
+        self.assertEqual(client.messages.create(model='m'), 'reply')
+        with self.assertRaises(anthropic.RateLimitError):
+            client.messages.create(model='m')
+        with self.assertRaises(AnalysisCancelled):
+            client.messages.create(model='m')
+
+        snapshot = self.monitor.snapshot()
+        self.assertEqual((snapshot['calls'], snapshot['rate_limited_rate']), (2, 0.5))
+
+    def test_analyzer_reports_to_monitor(self):
+        """Test that an analyzer given a monitor records its calls."""
+        with mock.patch.dict(os.environ, {'ANTHROPIC_API_KEY': 'test-key'}), \
+                mock.patch.object(FinancialAnalyzer, '_create_client', return_value=mock.Mock()) as create:
+            analyzer = FinancialAnalyzer(monitor=self.monitor)
+        create.return_value.messages.create.return_value = mock.Mock(content=[mock.Mock(type='text', text='Low')])
+
+        self.assertEqual(analyzer.get_risk_assessment({'annual_income': 1}), 'Low')
+        self.assertEqual(self.monitor.snapshot()['calls'], 1)
+
+    def test_readiness_policy(self):
+        """Test that saturation, errors, 429s and slow calls each make the instance unready."""
+        policy = ReadinessPolicy(max_queued=5, min_calls=4, max_p95_ms=1000)
+        idle = {'queued': {'quick': 0, 'analysis': 0}}
+        self.assertEqual(policy.reasons(self.monitor.snapshot(), idle), [])
+        self.assertEqual(len(policy.reasons(self.monitor.snapshot(), {'queued': {'quick': 2, 'analysis': 3}})), 1)
+
+        # Too few calls to judge the error rate, but slow
+        self.monitor.record(2, 'error')
+        self.assertEqual(policy.reasons(self.monitor.snapshot(), idle), ['upstream p95 latency 2000ms'])
+
+        for _ in range(3):
+            self.monitor.record(0.1, 'rate_limited')
+        reasons = policy.reasons(self.monitor.snapshot(), idle)
+        self.assertIn('upstream 429 rate 75%', reasons)
+        self.assertEqual(len(reasons), 2)
+
+    def test_ready_route_flips_when_saturated(self):
+        """Test that /api/ready answers 503 with reasons, while /api/health stays 200."""
+        client = web_app.app.test_client()
+        for _ in range(10):
+            self.monitor.record(0.1, 'error')
+
+        self.assertEqual(client.get('/api/ready').status_code, 200)
+        with mock.patch.object(web_app, 'upstream_monitor', self.monitor):
+            ready = client.get('/api/ready')
+            health = client.get('/api/health')
+
+        self.assertEqual(ready.status_code, 503)
+        self.assertEqual(ready.get_json()['reasons'], ['upstream error rate 100%'])
+        self.assertEqual(health.status_code, 200)
+        self.assertFalse(health.get_json()['ready'])
+        self.assertEqual(health.get_json()['upstream']['calls'], 10)
+        self.assertIn('hit_ratio', health.get_json()['cache']['archetypes'])
+
+        status, body = call_asgi('GET', '/api/ready')
+        self.assertEqual((status, body), (200, {'ready': True}))
+
+
+class TestResultCache(unittest.TestCase):
+    """Test the shared SQLite result cache."""
+
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), 'results.sqlite3')
+        self.cache = ResultCache(self.path)
+
+    def test_keys_ignore_number_types(self):
+        """Test that equal profiles get equal keys whether numbers are ints or floats."""
+        self.assertEqual(cache_key('analysis', {'annual_income': 85000}),
+                         cache_key('analysis', {'annual_income': 85000.0}))
+        self.assertNotEqual(cache_key('analysis', {'annual_income': 1}), cache_key('quick', {'annual_income': 1}))
+
+    def test_expiry_and_eviction(self):
+        """Test that stale entries expire and the least recently used are evicted."""
+        cache = ResultCache(self.path, max_entries=2)
+        cache.set('a', {'n': 1})
+        cache.set('b', {'n': 2})
+        cache.get('a')
+        cache.set('c', {'n': 3})
+
+        self.assertEqual((cache.get('a'), cache.get('b'), cache.get('c')), ({'n': 1}, None, {'n': 3}))
+        with mock.patch('result_cache.time.time', return_value=time.time() + 3601):
+            self.assertIsNone(cache.get('a'))
+
+    def test_concurrent_misses_compute_once(self):
+        """Test that callers racing on a miss wait for one computation."""
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.2)
+            return {'risk_score': 40}
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.cache.get_or_compute('k', compute)))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{'risk_score': 40}] * 5)
+        stats = self.cache.stats()
+        self.assertEqual((stats['misses'], stats['coalesced'], stats['entries']), (1, 4, 1))
+
+    def test_failed_computation_is_not_cached(self):
+        """Test that a failure releases the lease so the next caller computes."""
+        with self.assertRaises(ValueError):
+            self.cache.get_or_compute('k', mock.Mock(side_effect=ValueError('upstream down')))
+        self.assertEqual(self.cache.get_or_compute('k', lambda: 'Low'), 'Low')
+
+    def test_async_lookups_do_not_block_the_loop(self):
+        """Test that waiting on another writer's lock leaves the event loop free."""
+        writer = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        self.addCleanup(writer.close)
+        writer.execute('BEGIN IMMEDIATE')
+        threading.Timer(0.3, lambda: writer.execute('COMMIT')).start()
+
+        async def compute():
+            return 'Low'
+
+        async def main():
+            ticks = 0
+            lookup = asyncio.ensure_future(self.cache.get_or_compute_async('k', compute))
+            while not lookup.done():
+                ticks += 1
+                await asyncio.sleep(0.01)
+            return ticks, lookup.result()
+
+        ticks, value = asyncio.run(main())
+        self.assertEqual(value, 'Low')
+        self.assertGreater(ticks, 10)
+
+    def test_shared_between_processes(self):
+        """Test that a result stored by another process is read here."""
+        script = f"from result_cache import ResultCache; ResultCache({self.path!r}).set('k', {{'from': 'child'}})"
+        subprocess.run([sys.executable, '-c', script], check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(self.cache.get('k'), {'from': 'child'})
+
+    def test_servers_share_results(self):
+        """Test that a quick assessment made by Flask is answered from the cache by ASGI."""
+        flask_analyzer = mock.Mock(model='m', compact=False, **{'get_risk_assessments.return_value': ['Low']})
+        asgi_analyzer = mock.Mock(model='m', compact=False, get_risk_assessments=mock.AsyncMock())
+
+        with mock.patch.object(web_app, 'result_cache', self.cache), \
+                mock.patch.object(web_app, 'analyzer', flask_analyzer), \
+                mock.patch.object(web_app, 'rate_limiter', unlimited_rate_limiter()):
+            client = web_app.app.test_client()
+            for _ in range(2):
+                self.assertEqual(client.post('/api/quick-assessment', json=SAMPLE_PROFILE).get_json()['assessment'], 'Low')
+        with mock.patch.object(asgi_app, 'result_cache', ResultCache(self.path)), \
+                mock.patch.object(asgi_app, 'analyzer', asgi_analyzer), \
+                mock.patch.object(asgi_app, 'rate_limiter', unlimited_rate_limiter()):
+            status, body = call_asgi('POST', '/api/quick-assessment', SAMPLE_PROFILE)
+
+        self.assertEqual((status, body['assessment']), (200, 'Low'))
+        flask_analyzer.get_risk_assessments.assert_called_once()
+        asgi_analyzer.get_risk_assessments.assert_not_called()
+
+
+class TestMicroBatcher(unittest.TestCase):
+    """Test micro-batching of concurrent requests."""
+
+    def submit_concurrently(self, batcher, items):
+        """Submit ``items`` from one thread each and return their results (or exceptions) in order."""
+        results = [None] * len(items)
+
+        def submit(index):
+            try:
+                results[index] = batcher.submit(items[index])
+            except Exception as e:
+                results[index] = e
+
+        threads = [threading.Thread(target=submit, args=(index,)) for index in range(len(items))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        return results
+
+    def test_concurrent_requests_share_a_call(self):
+        """Test that requests within the window go out together, up to the batch size."""
+        process = mock.Mock(side_effect=lambda items: [item * 10 for item in items])
+        batcher = MicroBatcher(process, max_batch=4, max_delay=0.2)
+
+        results = self.submit_concurrently(batcher, list(range(6)))
+
+        self.assertEqual(results, [0, 10, 20, 30, 40, 50])
+        self.assertEqual(sorted(len(call.args[0]) for call in process.call_args_list), [2, 4])
+        self.assertEqual(batcher.stats(), {'batches': 2, 'mean_batch_size': 3.0})
+
+    def test_failure_reaches_every_caller(self):
+        """Test that a failed call fails each request in its batch."""
+        batcher = MicroBatcher(mock.Mock(side_effect=ValueError('upstream down')), max_delay=0.1)
+
+        results = self.submit_concurrently(batcher, ['a', 'b'])
+
+        self.assertTrue(all(isinstance(result, ValueError) for result in results))
+
+    def test_async_batching(self):
+        """Test that concurrent coroutines share one call."""
+        process = mock.AsyncMock(side_effect=lambda items: [item.upper() for item in items])
+        batcher = AsyncMicroBatcher(process, max_delay=0.05)
+
+        async def main():
+            return await asyncio.gather(*(batcher.submit(item) for item in ['low', 'high', 'medium']))
+
+        self.assertEqual(asyncio.run(main()), ['LOW', 'HIGH', 'MEDIUM'])
+        process.assert_awaited_once_with(['low', 'high', 'medium'])
+
+    def test_async_flush_tasks_are_held_and_cancelled_on_shutdown(self):
+        """Test that pending flush tasks are referenced until done, and shutdown cancels their callers."""
+        started = asyncio.Event()
+
+        async def process(items):
+            started.set()
+            await asyncio.Event().wait()
+
+        batcher = AsyncMicroBatcher(process, max_delay=0.01)
+
+        async def main():
+            submitted = asyncio.ensure_future(batcher.submit('low'))
+            await started.wait()
+            self.assertEqual(len(batcher._tasks), 1)
+            await batcher.shutdown()
+            with self.assertRaises(asyncio.CancelledError):
+                await submitted
+            self.assertEqual(batcher._tasks, set())
+
+        asyncio.run(main())
+
+    def test_quick_assessment_route_batches(self):
+        """Test that simultaneous quick assessments reach the analyzer as one batch."""
+        analyzer = mock.Mock(**{'get_risk_assessments.side_effect': lambda profiles: ['Low'] * len(profiles)})
+        batcher = MicroBatcher(web_app.assess_quick_batch, max_delay=0.2)
+
+        with mock.patch.object(web_app, 'analyzer', analyzer), \
+                mock.patch.object(web_app, 'quick_batcher', batcher), \
+                mock.patch.object(web_app, 'rate_limiter', unlimited_rate_limiter()):
+            statuses = self.submit_concurrently(
+                mock.Mock(submit=lambda payload: web_app.app.test_client().post(
+                    '/api/quick-assessment', json=payload).status_code),
+                [dict(SAMPLE_PROFILE, annual_income=str(income)) for income in (50000, 60000, 70000)]
+            )
+
+        self.assertEqual(statuses, [200, 200, 200])
+        analyzer.get_risk_assessments.assert_called_once()
+        self.assertEqual(len(analyzer.get_risk_assessments.call_args.args[0]), 3)
+
+
+class TestTracing(AppTestCase):
+    """Test per-request tracing and Server-Timing headers."""
+
+    def test_server_timing_header(self):
+        """Test that each stage of a request is timed in the response header."""
+        response = self.client.post('/api/analyze', json=SAMPLE_PROFILE)
+
+        timings = dict(entry.split(';dur=') for entry in response.headers['Server-Timing'].split(', '))
+        self.assertEqual(list(timings), ['validate', 'rate_limit', 'response', 'serialize', 'compress', 'total'])
+        self.assertGreaterEqual(float(timings['total']), sum(float(v) for k, v in timings.items() if k != 'total'))
+
+    def test_sampled_traces_are_exported(self):
+        """Test that only sampled traces reach the exporter."""
+        exported = []
+        exporter = mock.Mock(export=exported.append)
+        samples = iter([0.05, 0.5])
+        with mock.patch.object(web_app, 'tracer', Tracer(exporter, sample_rate=0.1, rng=lambda: next(samples))):
+            self.client.post('/api/analyze', json=SAMPLE_PROFILE)
+            self.client.post('/api/analyze', json=SAMPLE_PROFILE)
+
+        self.assertEqual(len(exported), 1)
+        trace = exported[0].to_dict()
+        self.assertEqual((trace['name'], trace['attributes']), ('POST /api/analyze', {'status': 200}))
+        self.assertEqual(trace['spans'][0]['name'], 'validate')
+
+
+class TestCompressionAndCaching(AppTestCase):
+    """Test negotiated compression and conditional GET."""
+
+    def test_large_responses_are_compressed(self):
+        """Test that responses over the threshold are gzipped only for clients that accept it."""
+        response = self.client.post('/api/analyze', json=SAMPLE_PROFILE, headers={'Accept-Encoding': 'gzip, deflate'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+        body = json.loads(gzip.decompress(response.get_data()))
+        self.assertEqual(body['analysis']['risk_score'], 40)
+
+        plain = self.client.post('/api/analyze', json=SAMPLE_PROFILE)
+        self.assertNotIn('Content-Encoding', plain.headers)
+        self.assertEqual(plain.get_json()['analysis']['risk_score'], 40)
+
+        small = self.client.get('/api/health', headers={'Accept-Encoding': 'gzip'})
+        self.assertNotIn('Content-Encoding', small.headers)
+
+    def test_encoding_negotiation(self):
+        """Test Accept-Encoding quality values, with and without Brotli installed."""
+        with mock.patch('compression.brotli', None):
+            self.assertEqual(choose_encoding('br, gzip;q=0.5'), 'gzip')
+            self.assertEqual(choose_encoding('*'), 'gzip')
+            self.assertIsNone(choose_encoding('gzip;q=0, deflate'))
+            self.assertIsNone(choose_encoding(''))
+        with mock.patch('compression.brotli', mock.Mock()):
+            self.assertEqual(choose_encoding('gzip, br'), 'br')
+            self.assertEqual(choose_encoding('gzip, br;q=0.8'), 'gzip')
+
+    def test_page_revalidation(self):
+        """Test that the page is answered with 304 while the browser's copy is current."""
+        page = self.client.get('/')
+        etag, last_modified = page.headers['ETag'], page.headers['Last-Modified']
+        self.assertEqual(page.status_code, 200)
+
+        for headers in ({'If-None-Match': etag}, {'If-Modified-Since': last_modified}):
+            revalidated = self.client.get('/', headers=headers)
+            self.assertEqual(revalidated.status_code, 304)
+            self.assertEqual(revalidated.get_data(), b'')
+
+        stale = self.client.get('/', headers={'If-None-Match': 'W/"old"', 'If-Modified-Since': last_modified})
+        self.assertEqual(stale.status_code, 200)
+
+    def test_job_revalidation(self):
+        """Test that polling a job with its ETag gets 304 until the job changes."""
+        job_id = self.client.post('/api/analyze', json=dict(SAMPLE_PROFILE, **{'async': True})).get_json()['job_id']
+        wait_for_job(self.client, job_id)
+
+        first = self.client.get(f'/api/jobs/{job_id}')
+        again = self.client.get(f'/api/jobs/{job_id}', headers={'If-None-Match': first.headers['ETag']})
+
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again.headers['ETag'], first.headers['ETag'])
+
+
+class TestChatRoute(AppTestCase):
+    """Test the /api/chat/<session_id> route."""
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(web_app, 'chat_store', ChatSessionStore())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.analyzer.chat.side_effect = lambda context, summary, messages, question: {
+            'reply': f'Answer to {question}',
+            'summary': summary,
+            'messages': messages + [{'role': 'user', 'content': question},
+                                    {'role': 'assistant', 'content': f'Answer to {question}'}]
+        }
+        response = self.client.post('/api/analyze', json=SAMPLE_PROFILE)
+        self.session_id = response.get_json()['session_id']
+
+    def test_follow_up_turns(self):
+        """Test that turns carry the analysis context and accumulate history."""
+        first = self.client.post(f'/api/chat/{self.session_id}', json={'message': 'Should I refinance?'})
+        second = self.client.post(f'/api/chat/{self.session_id}', json={'message': 'And invest?'})
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.get_json()['reply'], 'Answer to Should I refinance?')
+        self.assertEqual(second.get_json()['turns'], 2)
+
+        context, _, messages, _ = self.analyzer.chat.call_args.args
+        self.assertIn('Risk: 40/100 (Medium)', context)
+        self.assertIn('1. Save more', context)
+        self.assertEqual(len(messages), 2)
+
+    def test_errors(self):
+        """Test unknown sessions, invalid messages and concurrent turns."""
+        response = self.client.post('/api/chat/unknown', json={'message': 'Hi'})
+        self.assertEqual(response.status_code, 404)
+
+        response = self.client.post(f'/api/chat/{self.session_id}', json={'message': '  '})
+        self.assertEqual(response.status_code, 400)
+
+        web_app.chat_store.checkout(self.session_id)
+        response = self.client.post(f'/api/chat/{self.session_id}', json={'message': 'Hi'})
+        self.assertEqual(response.status_code, 409)
+
+    def test_failed_turn_releases_session(self):
+        """Test that an upstream failure leaves the session usable and unchanged."""
+        self.analyzer.chat.side_effect = RuntimeError('upstream down')
+        response = self.client.post(f'/api/chat/{self.session_id}', json={'message': 'Hi'})
+        self.assertEqual(response.status_code, 500)
+
+        session = web_app.chat_store.checkout(self.session_id)
+        self.assertEqual(session['messages'], [])
+
+    def test_end_session(self):
+        """Test that a deleted session is gone."""
+        self.assertEqual(self.client.delete(f'/api/chat/{self.session_id}').status_code, 200)
+        response = self.client.post(f'/api/chat/{self.session_id}', json={'message': 'Hi'})
+        self.assertEqual(response.status_code, 404)
+
+
+class TestChatSessionStore(unittest.TestCase):
+    """Test the bounded chat session store."""
+
+    def test_idle_sessions_are_evicted(self):
+        """Test that sessions idle past the TTL disappear."""
+        clock = FakeClock()
+        store = ChatSessionStore(idle_ttl=60, clock=clock)
+        session_id = store.create('context')
+
+        clock.now = 59
+        self.assertIsNotNone(store.checkout(session_id))
+        store.checkin(session_id, '', [])
+
+        clock.now = 59 + 61
+        self.assertIsNone(store.checkout(session_id))
+        self.assertEqual(store.stats(), {'sessions': 0, 'bytes': 0})
+
+    def test_memory_cap_evicts_least_recently_used(self):
+        """Test that the byte cap evicts the least recently used sessions first."""
+        clock = FakeClock()
+        store = ChatSessionStore(max_bytes=250, clock=clock)
+        first = store.create('a' * 100)
+        second = store.create('b' * 100)
+
+        # Touch the first session so the second is least recently used
+        store.checkout(first)
+        store.checkin(first, '', [{'role': 'user', 'content': 'c' * 20}])
+        third = store.create('d' * 100)
+
+        self.assertIsNone(store.checkout(second))
+        self.assertIsNotNone(store.checkout(first))
+        self.assertIsNotNone(store.checkout(third))
+        self.assertLessEqual(store.stats()['bytes'], 250)
+
+    def test_busy_session(self):
+        """Test that a session takes one turn at a time."""
+        store = ChatSessionStore()
+        session_id = store.create('context')
+        store.checkout(session_id)
+
+        with self.assertRaises(SessionBusyError):
+            store.checkout(session_id)
+        store.release(session_id)
+        self.assertIsNotNone(store.checkout(session_id))
+
+
+class TestCancelToken(unittest.TestCase):
+    """Test cancel tokens and the superseding registry."""
+
+    def test_callbacks_run_once(self):
+        """Test that callbacks run on the first cancel only, or at once if already cancelled."""
+        token = CancelToken()
+        calls = []
+        token.add_callback(lambda: calls.append('first'))
+        unregister = token.add_callback(lambda: calls.append('removed'))
+        unregister()
+
+        token.cancel()
+        token.cancel()
+        token.add_callback(lambda: calls.append('late'))
+
+        self.assertEqual(calls, ['first', 'late'])
+        with self.assertRaises(AnalysisCancelled):
+            token.raise_if_cancelled()
+
+    def test_registry_supersedes_per_key(self):
+        """Test that starting a request cancels only the previous one for its key."""
+        registry = SupersedingRegistry()
+        first = registry.start(('ip:1', 'tab'))
+        other = registry.start(('ip:2', 'tab'))
+        second = registry.start(('ip:1', 'tab'))
+
+        self.assertTrue(first.cancelled)
+        self.assertFalse(other.cancelled)
+
+        # A superseded request finishing late doesn't unregister its successor
+        registry.finish(('ip:1', 'tab'), first)
+        self.assertTrue(registry.cancel(('ip:1', 'tab')))
+        self.assertTrue(second.cancelled)
+
+
+def call_asgi(*args, **kwargs):
+    """Send one request through the ASGI app on a new event loop and return (status, json body)."""
+    return asyncio.run(call_asgi_async(*args, **kwargs))
+
+
+async def call_asgi_async(method, path, body=None, headers=None, disconnect_after=None, response_headers=None):
+    """
+    Send one request through the ASGI app and return (status, json body).
+
+    The client stays connected until the response, or disconnects after
+    ``disconnect_after`` seconds. Pass a dict as ``response_headers`` to
+    collect the response headers.
+    """
+    messages = [{
+        'type': 'http.request',
+        'body': json.dumps(body).encode() if body is not None else b'',
+        'more_body': False
+    }]
+    sent = []
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        if disconnect_after is None:
+            await asyncio.Event().wait()
+        await asyncio.sleep(disconnect_after)
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+        'method': method, 'path': path, 'raw_path': path.encode(), 'query_string': b'',
+        'headers': [(b'content-type', b'application/json')] + [
+            (name.lower().encode(), value.encode()) for name, value in (headers or {}).items()
+        ],
+        'client': ('127.0.0.1', 1234), 'server': ('testserver', 80), 'scheme': 'http'
+    }
+    await asgi_app.app(scope, receive, send)
+
+    status = sent[0]['status']
+    if response_headers is not None:
+        response_headers.update((name.decode(), value.decode()) for name, value in sent[0]['headers'])
+    payload = b''.join(m.get('body', b'') for m in sent[1:])
+    return status, json.loads(payload) if payload.startswith(b'{') else payload
+
+
+async def wait_for_asgi_job(job_id, timeout=5):
+    """Poll an ASGI job until it finishes and return its final state."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        _, job = await call_asgi_async('GET', f'/api/jobs/{job_id}')
+        if job['status'] in ('succeeded', 'failed', 'cancelled'):
+            return job
+        await asyncio.sleep(0.01)
+    raise AssertionError(f'Job {job_id} did not finish')
+
+
+class TestAsgiApp(unittest.TestCase):
+    """Test that the ASGI server matches the Flask server."""
+
+    def setUp(self):
+        self.analyzer = mock.Mock()
+        self.analyzer.analyze_financial_situation = mock.AsyncMock(return_value=dict(SAMPLE_ANALYSIS))
+        self.analyzer.get_risk_assessments = mock.AsyncMock(
+            side_effect=lambda profiles: ['Medium. Manageable debt.'] * len(profiles)
+        )
+        for name, value in [('analyzer', self.analyzer), ('rate_limiter', unlimited_rate_limiter()),
+                            ('archetype_index', ArchetypeIndex())]:
+            patcher = mock.patch.object(asgi_app, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_analyze_matches_flask(self):
+        """Test that both servers return the same analyze response."""
+        status, body = call_asgi('POST', '/api/analyze', SAMPLE_PROFILE)
+
+        with mock.patch.object(web_app, 'analyzer', mock.Mock(**{
+            'analyze_financial_situation.return_value': dict(SAMPLE_ANALYSIS)
+        })), mock.patch.object(web_app, 'rate_limiter', unlimited_rate_limiter()):
+            flask_body = web_app.app.test_client().post('/api/analyze', json=SAMPLE_PROFILE).get_json()
+
+        self.assertEqual(status, 200)
+        # Each server opens its own chat session
+        self.assertTrue(body.pop('session_id'))
+        self.assertTrue(flask_body.pop('session_id'))
+        self.assertEqual(body, flask_body)
+
+    def test_provisional_answer(self):
+        """Test that the ASGI server answers provisionally once a similar profile is analyzed."""
+        status, _ = call_asgi('POST', '/api/analyze/provisional', SAMPLE_PROFILE)
+        self.assertEqual(status, 204)
+
+        call_asgi('POST', '/api/analyze', SAMPLE_PROFILE)
+        status, body = call_asgi('POST', '/api/analyze/provisional', dict(SAMPLE_PROFILE, annual_income='88000'))
+
+        self.assertEqual(status, 200)
+        self.assertTrue(body['provisional'])
+        self.assertEqual(body['input_data']['annual_income'], 88000.0)
+
+    def test_chat(self):
+        """Test a follow-up chat turn on the ASGI server."""
+        self.analyzer.chat = mock.AsyncMock(return_value={
+            'reply': 'Yes.', 'summary': '', 'messages': []
+        })
+        with mock.patch.object(asgi_app, 'chat_store', ChatSessionStore()):
+            _, body = call_asgi('POST', '/api/analyze', SAMPLE_PROFILE)
+            status, reply = call_asgi('POST', f"/api/chat/{body['session_id']}", {'message': 'Refinance?'})
+            missing_status, _ = call_asgi('POST', '/api/chat/unknown', {'message': 'Refinance?'})
+
+        self.assertEqual(status, 200)
+        self.assertEqual(reply['reply'], 'Yes.')
+        self.assertEqual(reply['turns'], 1)
+        self.assertEqual(missing_status, 404)
+
+    def test_disconnect_cancels_analysis(self):
+        """Test that a client disconnect aborts the upstream call in flight."""
+        with mock.patch.dict(os.environ, {'ANTHROPIC_API_KEY': 'test-key'}):
+            analyzer = AsyncFinancialAnalyzer()
+        calls = []
+
+        async def create(**request):
+            calls.append(request)
+            await asyncio.sleep(10)
+
+        analyzer.client = mock.Mock()
+        analyzer.client.messages.create = create
+
+        begin = time.monotonic()
+        with mock.patch.object(asgi_app, 'analyzer', analyzer):
+            status, body = call_asgi('POST', '/api/analyze', SAMPLE_PROFILE, disconnect_after=0.05)
+
+        self.assertEqual(status, 409)
+        self.assertLess(time.monotonic() - begin, 5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(asgi_app.inflight, 0)
+
+    def test_validation_errors(self):
+        """Test that invalid payloads get the same 400 errors."""
+        status, body = call_asgi('POST', '/api/analyze', dict(SAMPLE_PROFILE, total_loans='-5'))
+        self.assertEqual(status, 400)
+        self.assertEqual(body['error'], 'total_loans must be non-negative')
+
+        status, body = call_asgi('POST', '/api/quick-assessment', {'annual_income': 1})
+        self.assertEqual(status, 400)
+        self.assertIn('Invalid input', body['error'])
+
+        for path in ('/api/analyze', '/api/analyze/provisional', '/api/quick-assessment'):
+            status, body = call_asgi('POST', path, [1, 2])
+            self.assertEqual(status, 400, path)
+
+    def test_quick_assessment_and_health(self):
+        """Test the quick assessment and health routes."""
+        status, body = call_asgi('POST', '/api/quick-assessment', SAMPLE_PROFILE)
+        self.assertEqual((status, body['assessment']), (200, 'Medium. Manageable debt.'))
+
+        status, body = call_asgi('GET', '/api/health')
+        self.assertEqual((status, body['status']), (200, 'healthy'))
+
+    def test_async_jobs(self):
+        """Test that "async": true enqueues a job that can be polled on the same event loop."""
+        async def main():
+            headers = {}
+            status, body = await call_asgi_async('POST', '/api/analyze', dict(SAMPLE_PROFILE, **{'async': True}),
+                                                 response_headers=headers)
+            self.assertEqual(status, 202)
+            self.assertEqual(headers['location'], f"/api/jobs/{body['job_id']}")
+            self.assertEqual(body['status_url'], headers['location'])
+            return await wait_for_asgi_job(body['job_id'])
+
+        job = asyncio.run(main())
+
+        self.assertEqual(job['status'], 'succeeded')
+        self.assertEqual(job['result']['analysis']['risk_level'], 'Medium')
+        self.assertEqual(call_asgi('GET', '/api/jobs/unknown')[0], 404)
+        self.assertEqual(call_asgi('DELETE', '/api/jobs/unknown')[0], 404)
+
+    def test_cancel_async_job(self):
+        """Test that DELETE /api/jobs/{job_id} stops a running analysis job."""
+        async def analyze_until_cancelled(financial_data, cancel_token=None):
+            while not cancel_token.cancelled:
+                await asyncio.sleep(0.01)
+            raise AnalysisCancelled('Analysis cancelled')
+        self.analyzer.analyze_financial_situation = analyze_until_cancelled
+
+        async def main():
+            _, body = await call_asgi_async('POST', '/api/analyze', dict(SAMPLE_PROFILE, **{'async': True}))
+            status, _ = await call_asgi_async('DELETE', f"/api/jobs/{body['job_id']}")
+            self.assertEqual(status, 200)
+            return await wait_for_asgi_job(body['job_id'])
+
+        self.assertEqual(asyncio.run(main())['status'], 'cancelled')
+
+    def test_unsafe_callback_url(self):
+        """Test that the ASGI server rejects callback URLs pointing at internal addresses."""
+        status, body = call_asgi('POST', '/api/analyze', dict(
+            SAMPLE_PROFILE, **{'async': True, 'callback_url': 'http://127.0.0.1/hook'}
+        ))
+        self.assertEqual(status, 400)
+        self.assertIn('private or internal', body['error'])
+        self.analyzer.analyze_financial_situation.assert_not_called()
+
+    def test_inflight_counts_requests_waiting_for_admission(self):
+        """Test that requests waiting on the rate limiter count as in flight, and are uncounted when rejected."""
+        seen = []
+
+        async def acquire_async(client_id, estimated_tokens, priority=False):
+            seen.append(asgi_app.inflight)
+            if len(seen) > 1:
+                raise RateLimitExceeded('Rate limit exceeded, retry in 5s', 5)
+
+        with mock.patch.object(asgi_app, 'rate_limiter', mock.Mock(acquire_async=acquire_async)):
+            self.assertEqual(call_asgi('POST', '/api/analyze', SAMPLE_PROFILE)[0], 200)
+            self.assertEqual(call_asgi('POST', '/api/analyze', SAMPLE_PROFILE)[0], 429)
+
+        self.assertEqual(seen, [1, 1])
+        self.assertEqual(asgi_app.inflight, 0)
+
+    def test_inflight_limit(self):
+        """Test that requests over the in-flight limit get 503."""
+        with mock.patch.object(asgi_app, 'inflight', asgi_app.MAX_INFLIGHT):
+            status, body = call_asgi('POST', '/api/analyze', SAMPLE_PROFILE)
+        self.assertEqual(status, 503)
+
+    def test_server_timing(self):
+        """Test that responses report their stage timings."""
+        headers = {}
+        status, _ = call_asgi('POST', '/api/analyze', SAMPLE_PROFILE, response_headers=headers)
+
+        self.assertEqual(status, 200)
+        stages = [entry.split(';')[0] for entry in headers['server-timing'].split(', ')]
+        self.assertEqual(stages, ['validate', 'rate_limit', 'response', 'serialize', 'compress', 'total'])
+
+    def test_compression_and_page_revalidation(self):
+        """Test that the ASGI server compresses and revalidates like the Flask server."""
+        headers = {}
+        status, body = call_asgi('POST', '/api/analyze', SAMPLE_PROFILE,
+                                 headers={'Accept-Encoding': 'gzip'}, response_headers=headers)
+        self.assertEqual((status, headers['content-encoding']), (200, 'gzip'))
+        self.assertEqual(json.loads(gzip.decompress(body))['analysis']['risk_score'], 40)
+
+        page_headers = {}
+        call_asgi('GET', '/', response_headers=page_headers)
+        status, body = call_asgi('GET', '/', headers={'If-None-Match': page_headers['etag']})
+        self.assertEqual((status, body), (304, b''))
+
+    def test_not_found(self):
+        """Test the JSON 404 handler."""
+        status, body = call_asgi('GET', '/missing')
+        self.assertEqual((status, body), (404, {'error': 'Not found'}))
+
+
+def recorded_message(content):
+    """A Messages API response as the scripted upstream returns it."""
+    return Message.model_validate({
+        'id': 'msg_test', 'type': 'message', 'role': 'assistant',
+        'model': 'claude-3-5-sonnet-20241022', 'content': content,
+        'stop_reason': 'end_turn', 'stop_sequence': None,
+        'usage': {'input_tokens': 1200, 'output_tokens': 300}
+    })
+
+
+class TestCassetteReplay(unittest.TestCase):
+    """Test both servers end to end with real analyzers replaying a cassette."""
+
+    def setUp(self):
+        """Record an analysis through the Flask route against a scripted upstream."""
+        self.env = {'ANTHROPIC_API_KEY': 'test-key',
+                    'ANTHROPIC_CASSETTE': os.path.join(tempfile.mkdtemp(), 'web.json')}
+        upstream = mock.Mock()
+        upstream.messages.create.side_effect = [
+            recorded_message([{'type': 'text', 'text': 'Initial analysis'}]),
+            recorded_message([{'type': 'tool_use', 'id': 'toolu_web', 'name': 'record_risk_metrics', 'input': {
+                'risk_score': 45, 'risk_factors': ['Debt'], 'gain_opportunities': ['Invest']
+            }}]),
+            recorded_message([{'type': 'text', 'text': '1. Save more'}]),
+        ]
+        with mock.patch.dict(os.environ, self.env, ANTHROPIC_CASSETTE_MODE='record'), \
+                mock.patch.object(FinancialAnalyzer, '_create_client', return_value=upstream):
+            self.recorded = self.post_flask(FinancialAnalyzer())
+
+    def post_flask(self, analyzer):
+        """POST the sample profile to the Flask server and return the body."""
+        with mock.patch.object(web_app, 'analyzer', analyzer), \
+                mock.patch.object(web_app, 'rate_limiter', unlimited_rate_limiter()):
+            response = web_app.app.test_client().post('/api/analyze', json=SAMPLE_PROFILE)
+        self.assertEqual(response.status_code, 200)
+        body = response.get_json()
+        body.pop('session_id')
+        return body
+
+    def test_servers_replay_offline(self):
+        """Test that replays through both servers return the recorded analysis."""
+        with mock.patch.dict(os.environ, self.env, ANTHROPIC_CASSETTE_MODE='replay'):
+            flask_analyzer, asgi_analyzer = FinancialAnalyzer(), AsyncFinancialAnalyzer()
+
+        self.assertEqual(self.post_flask(flask_analyzer), self.recorded)
+        self.assertEqual(self.recorded['analysis']['risk_level'], 'Medium')
+
+        with mock.patch.object(asgi_app, 'analyzer', asgi_analyzer), \
+                mock.patch.object(asgi_app, 'rate_limiter', unlimited_rate_limiter()):
+            status, body = call_asgi('POST', '/api/analyze', SAMPLE_PROFILE)
+        body.pop('session_id')
+        self.assertEqual((status, body), (200, self.recorded))
+
+
+
+def free_port() -> int:
+    """An unused local TCP port."""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class TestBenchmarkServers(unittest.TestCase):
+    """Smoke-test the server benchmark against its stub analyzers."""
+
+    def test_stub_servers_answer_every_request(self):
+        """Test that a small benchmark run gets a 200 for every request on both servers."""
+        env = {'ANTHROPIC_API_KEY': 'test-key'}
+        with mock.patch.dict(os.environ, env):
+            os.environ.pop('ANTHROPIC_CASSETTE', None)
+            for server in ('flask', 'asgi'):
+                with self.subTest(server=server):
+                    results = benchmark_servers.benchmark(server, free_port(), concurrency=5, latency=0.05)
+                    self.assertEqual((results['ok'], results['failed']), (5, 0))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,334 @@
+"""
+Unit tests for the local calculation engines.
+These run entirely offline and never call the Anthropic API.
+"""
+
+import os
+import tempfile
+import unittest
+import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+from amortization import validate_loans, simulate_payoff, compare_strategies
+from projections import projection_for, simulate_projections, summarize_projection
+from risk_scoring import (
+    compute_metrics, risk_score, risk_levels, needs_llm_review, score_profile, grid_axis, sensitivity_grid
+)
+from score_customers import iter_batches, score_file
+
+
+class TestMonteCarloProjections(unittest.TestCase):
+    """Test the Monte Carlo projection engine."""
+
+    def setUp(self):
+        self.profile = {
+            "annual_income": 85000,
+            "total_savings": 25000,
+            "total_loans": 40000,
+            "monthly_expenses": 3200,
+            "investment_amount": 8000
+        }
+
+    def test_percentiles_are_ordered(self):
+        """Test that each yearly band satisfies p10 <= p50 <= p90."""
+        projection = simulate_projections(self.profile, n_paths=2000)
+
+        self.assertEqual(projection['years'], list(range(11)))
+        for name in ('savings', 'debt', 'investments', 'net_worth'):
+            bands = projection[name]
+            for p10, p50, p90 in zip(bands['p10'], bands['p50'], bands['p90']):
+                self.assertLessEqual(p10, p50)
+                self.assertLessEqual(p50, p90)
+
+    def test_starting_balances(self):
+        """Test that year 0 equals the inputs on every path."""
+        projection = simulate_projections(self.profile, n_paths=500)
+
+        self.assertEqual(projection['debt']['p50'][0], 40000)
+        self.assertEqual(projection['net_worth']['p10'][0], 25000 + 8000 - 40000)
+
+    def test_same_seed_is_deterministic(self):
+        """Test that the same inputs and seed give the same projection."""
+        first = simulate_projections(self.profile, n_paths=500, seed=7)
+        second = simulate_projections(self.profile, n_paths=500, seed=7)
+        self.assertEqual(first, second)
+
+    def test_surplus_pays_off_debt(self):
+        """Test that a healthy surplus clears debt and a deficit does not."""
+        healthy = simulate_projections(self.profile, n_paths=1000)
+        self.assertEqual(healthy['probability_debt_free'], 1.0)
+        self.assertIsNotNone(healthy['median_months_to_debt_free'])
+
+        stressed = simulate_projections(dict(
+            self.profile, annual_income=30000, total_savings=2000, monthly_expenses=3500
+        ), n_paths=1000)
+        self.assertEqual(stressed['probability_debt_free'], 0.0)
+        self.assertIsNone(stressed['median_months_to_debt_free'])
+        self.assertEqual(stressed['probability_savings_depleted'], 1.0)
+        self.assertGreater(stressed['debt']['p50'][-1], 40000)
+
+    def test_borrowing_again_is_not_debt_free(self):
+        """Test that a path which repays its debt and then borrows again doesn't count as debt-free."""
+        # Debt is repaid within the first year, then expenses jump past income
+        projection = simulate_projections(dict(
+            self.profile, annual_income=60000, total_savings=0, total_loans=5000,
+            monthly_expenses=4000, investment_amount=0
+        ), n_paths=200, assumptions={'income_growth': (0.0, 0.0), 'expense_inflation': (0.5, 0.0)})
+
+        self.assertEqual(projection['debt']['p50'][1], 0)
+        self.assertGreater(projection['debt']['p50'][-1], 5000)
+        self.assertEqual(projection['probability_debt_free'], 0.0)
+        self.assertIsNone(projection['median_months_to_debt_free'])
+
+    def test_projection_is_memoized_per_profile(self):
+        """Test that projection_for reuses the projection of an identical profile."""
+        first = projection_for(dict(self.profile, risk_tolerance='low'))
+        again = projection_for(dict(self.profile))
+        other = projection_for(dict(self.profile, annual_income=90000))
+
+        self.assertIs(first, again)
+        self.assertIsNot(first, other)
+        self.assertEqual(first, simulate_projections(self.profile))
+
+    def test_summary_mentions_key_numbers(self):
+        """Test the prompt summary of a projection."""
+        summary = summarize_projection(simulate_projections(self.profile, n_paths=500))
+
+        self.assertIn("500 paths", summary)
+        self.assertIn("Net worth in 10 years", summary)
+        self.assertIn("debt-free", summary)
+
+
+class TestAmortization(unittest.TestCase):
+    """Test the multi-loan payoff strategy engine."""
+
+    def setUp(self):
+        self.loans = validate_loans([
+            {"name": "Student", "balance": 30000, "apr": 4.5, "minimum_payment": 300},
+            {"name": "Credit Card", "balance": 8000, "apr": 22.9, "minimum_payment": 200},
+            {"name": "Medical", "balance": 2000, "apr": 0, "minimum_payment": 50},
+        ])
+
+    def test_single_loan_matches_closed_form(self):
+        """Test one loan against the standard amortization formula."""
+        months, interest = simulate_payoff([[12000]], [[6]], [[232]], [[0]], 0)
+
+        # 12,000 at 6% APR over 60 months needs a payment of about $231.99
+        self.assertEqual(months[0], 60)
+        self.assertAlmostEqual(interest[0], 232 * 60 - 12000, delta=60)
+
+    def test_avalanche_minimizes_interest(self):
+        """Test that avalanche never pays more interest than snowball."""
+        comparison = compare_strategies(self.loans, extra_payments=[0, 100, 500])
+
+        for avalanche, snowball in zip(comparison['avalanche']['total_interest'],
+                                       comparison['snowball']['total_interest']):
+            self.assertLessEqual(avalanche, snowball)
+        self.assertLess(comparison['avalanche']['total_interest'][2],
+                        comparison['snowball']['total_interest'][2])
+
+    def test_extra_payments_shorten_payoff(self):
+        """Test that more extra payment means fewer months and less interest."""
+        comparison = compare_strategies(self.loans)
+
+        months = comparison['avalanche']['months_to_payoff']
+        interest = comparison['avalanche']['total_interest']
+        self.assertEqual(months, sorted(months, reverse=True))
+        self.assertEqual(interest, sorted(interest, reverse=True))
+
+    def test_custom_order(self):
+        """Test that a custom order matching avalanche gives the same result."""
+        comparison = compare_strategies(self.loans, extra_payments=[200], custom_order=[1, 0, 2])
+        self.assertEqual(comparison['custom'], comparison['avalanche'])
+
+    def test_unpayable_debt(self):
+        """Test that debt whose payments don't cover interest never pays off."""
+        comparison = compare_strategies(
+            validate_loans([{"balance": 10000, "apr": 30, "minimum_payment": 100}]),
+            extra_payments=[0, 1000]
+        )
+
+        self.assertIsNone(comparison['avalanche']['months_to_payoff'][0])
+        self.assertIsNone(comparison['avalanche']['total_interest'][0])
+        self.assertIsNotNone(comparison['avalanche']['months_to_payoff'][1])
+
+    def test_batch_of_portfolios(self):
+        """Test that padded portfolios for many customers run in one call."""
+        balances = np.array([[5000, 0], [5000, 5000]])
+        months, _ = simulate_payoff(balances, [[10, 0], [10, 10]], [[500, 0], [500, 500]], [[0, 1], [0, 1]], 0)
+
+        self.assertEqual(months.shape, (2,))
+        self.assertEqual(months[0], months[1])
+
+    def test_validation(self):
+        """Test that malformed loans are rejected."""
+        for loans, message in [
+            ("not a list", "loans must be a list"),
+            ([{"balance": 1, "apr": 2}], "Missing field: loans[0].minimum_payment"),
+            ([{"balance": -1, "apr": 2, "minimum_payment": 3}], "loans[0].balance must be non-negative"),
+        ]:
+            with self.assertRaises(ValueError) as raised:
+                validate_loans(loans)
+            self.assertEqual(str(raised.exception), message)
+
+    def test_projection_uses_loan_apr(self):
+        """Test that itemized loans set the projection's loan APR."""
+        profile = {
+            "annual_income": 85000, "total_savings": 25000, "total_loans": 40000,
+            "monthly_expenses": 3200, "investment_amount": 8000, "loans": self.loans
+        }
+        projection = simulate_projections(profile, n_paths=200)
+
+        expected = (30000 * 4.5 + 8000 * 22.9) / 40000 / 100
+        self.assertAlmostEqual(projection['assumptions']['loan_apr'], expected)
+
+
+class TestRiskScoring(unittest.TestCase):
+    """Test the deterministic risk scoring and the offline scoring pipeline."""
+
+    def test_healthy_and_distressed_profiles(self):
+        """Test that the score spans the bands from healthy to distressed."""
+        healthy = score_profile({
+            "annual_income": 120000, "total_savings": 85000, "total_loans": 0,
+            "monthly_expenses": 4000, "investment_amount": 25000
+        })
+        distressed = score_profile({
+            "annual_income": 30000, "total_savings": 0, "total_loans": 90000,
+            "monthly_expenses": 3000, "investment_amount": 0
+        })
+
+        self.assertEqual(healthy['risk_score'], 0)
+        self.assertEqual(healthy['risk_level'], 'Low')
+        self.assertEqual(distressed['risk_score'], 100)
+        self.assertEqual(distressed['risk_level'], 'Critical')
+
+    def test_zero_denominators(self):
+        """Test that ratios over zero are infinite, or zero for 0/0."""
+        metrics = compute_metrics([50000, 50000], [0, 0], [1000, 0], [2000, 2000], [0, 0])
+
+        self.assertEqual(metrics['debt_to_savings_ratio'][0], np.inf)
+        self.assertEqual(metrics['debt_to_savings_ratio'][1], 0)
+        self.assertTrue(np.all(np.isfinite(risk_score(metrics))))
+
+    def test_sensitivity_grid(self):
+        """Test that every grid cell matches scoring that profile on its own."""
+        profile = {
+            "annual_income": 85000, "total_savings": 25000, "total_loans": 40000,
+            "monthly_expenses": 3200, "investment_amount": 8000
+        }
+        incomes = grid_axis(profile["annual_income"], steps=5)
+        expenses = grid_axis(profile["monthly_expenses"], steps=3, spread=0.25)
+        grid = sensitivity_grid(profile, "annual_income", incomes, "monthly_expenses", expenses)
+
+        self.assertEqual(grid["risk_score"].shape, (3, 5))
+        self.assertEqual(list(incomes), [42500, 63750, 85000, 106250, 127500])
+        self.assertEqual(list(expenses), [2200, 3200, 4200])
+        for row, expense in enumerate(expenses):
+            for column, income in enumerate(incomes):
+                single = score_profile(dict(profile, annual_income=income, monthly_expenses=expense))
+                self.assertEqual(grid["risk_score"][row, column], single["risk_score"])
+                self.assertEqual(grid["risk_level"][row, column], single["risk_level"])
+                self.assertAlmostEqual(grid["savings_rate"][row, column], single["savings_rate"])
+        # Metrics that depend on neither varied input are still full grids
+        self.assertEqual(grid["debt_to_assets_ratio"].shape, (3, 5))
+
+        self.assertEqual(grid_axis(0, steps=3).tolist(), [0, 500, 1000])
+        with self.assertRaises(ValueError):
+            sensitivity_grid(profile, "total_loans", incomes, "total_loans", incomes)
+
+    def test_bands_and_flags(self):
+        """Test band edges and which scores are flagged for the LLM."""
+        scores = np.array([0, 24.9, 25, 49.9, 50, 62, 75, 100])
+
+        self.assertEqual(list(risk_levels(scores)),
+                         ['Low', 'Low', 'Medium', 'Medium', 'High', 'High', 'Critical', 'Critical'])
+        self.assertEqual(list(needs_llm_review(scores)),
+                         [False, True, True, True, True, False, True, True])
+
+    def _write_customers(self, directory, rows):
+        table = pa.table({
+            'customer_id': np.arange(rows),
+            'annual_income': np.full(rows, 60000.0),
+            'total_savings': np.linspace(0, 60000, rows),
+            'total_loans': np.linspace(80000, 0, rows),
+            'monthly_expenses': np.full(rows, 3000.0),
+            'investment_amount': np.zeros(rows)
+        })
+        csv_path = os.path.join(directory, 'customers.csv')
+        parquet_path = os.path.join(directory, 'customers.parquet')
+        pa_csv.write_csv(table, csv_path)
+        pq.write_table(table, parquet_path)
+        return csv_path, parquet_path
+
+    def test_fixed_size_batches(self):
+        """Test that CSV and Parquet inputs are read in chunk-size batches."""
+        with tempfile.TemporaryDirectory() as directory:
+            for path in self._write_customers(directory, 2500):
+                sizes = [batch.num_rows for batch in iter_batches(path, chunk_size=1000)]
+                self.assertEqual(sizes, [1000, 1000, 500])
+
+    def test_score_file_matches_single_profile(self):
+        """Test that batch scores equal per-profile scores and flagged rows are split out."""
+        with tempfile.TemporaryDirectory() as directory:
+            csv_path, parquet_path = self._write_customers(directory, 300)
+            output = os.path.join(directory, 'scored.parquet')
+            flagged = os.path.join(directory, 'flagged.csv')
+
+            summary = score_file(csv_path, output, flagged, chunk_size=64)
+            scored = pq.read_table(output).to_pylist()
+            flagged_ids = pa_csv.read_csv(flagged).column('customer_id').to_pylist()
+
+        self.assertEqual(summary['rows'], 300)
+        self.assertEqual(sum(summary['risk_levels'].values()), 300)
+        self.assertEqual(flagged_ids, [row['customer_id'] for row in scored if row['needs_llm']])
+        self.assertEqual(summary['flagged'], len(flagged_ids))
+        for row in scored[::37]:
+            expected = score_profile(row)
+            self.assertEqual(row['risk_score'], expected['risk_score'])
+            self.assertEqual(row['risk_level'], expected['risk_level'])
+
+    def test_invalid_rows(self):
+        """Test that missing or negative inputs are marked invalid, not scored."""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'customers.csv')
+            with open(path, 'w') as f:
+                f.write("annual_income,total_savings,total_loans,monthly_expenses,investment_amount\n")
+                f.write("60000,1000,90000,3000,0\n")
+                f.write("60000,,90000,3000,0\n")
+                f.write("60000,1000,-5,3000,0\n")
+            output = os.path.join(directory, 'scored.csv')
+
+            summary = score_file(path, output)
+            scored = pa_csv.read_csv(output).to_pylist()
+
+        self.assertEqual(summary['invalid'], 2)
+        self.assertEqual([row['valid'] for row in scored], [True, False, False])
+        self.assertIsNone(scored[1]['risk_score'])
+        self.assertFalse(scored[2]['needs_llm'])
+
+    def test_non_numeric_cells(self):
+        """Test that a non-numeric cell marks its row invalid instead of failing the file."""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'customers.csv')
+            with open(path, 'w') as f:
+                f.write("customer_id,annual_income,total_savings,total_loans,monthly_expenses,investment_amount\n")
+                f.write("1,60000,1000,90000,3000,0\n")
+                f.write("2,60000,abc,90000,3000,0\n")
+                f.write("3, 6e4 ,1000.5,90000,n/a,0\n")
+                f.write("4,60000,1000,90000,3000,0\n")
+            output = os.path.join(directory, 'scored.parquet')
+
+            summary = score_file(path, output, chunk_size=2)
+            scored = pq.read_table(output).to_pylist()
+
+        self.assertEqual(summary['rows'], 4)
+        self.assertEqual(summary['invalid'], 2)
+        self.assertEqual([row['valid'] for row in scored], [True, False, False, True])
+        self.assertIsNone(scored[1]['total_savings'])
+        self.assertEqual(scored[2]['annual_income'], 60000.0)
+        self.assertEqual(scored[0]['risk_score'], score_profile(scored[0])['risk_score'])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
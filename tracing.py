@@ -0,0 +1,207 @@
+"""
+Request Tracing for Financial Analyzer
+Times each stage of a request (validation, prompt building, every LLM turn,
+serialization) as spans, reports them in a Server-Timing response header and
+exports sampled traces to the console or a JSON-lines file.
+
+Configured with:
+    TRACE_EXPORT=console         print each sampled trace as one JSON line
+    TRACE_EXPORT=traces.jsonl    append each sampled trace to a file
+    TRACE_SAMPLE_RATE=0.1        export one request in ten (default: all)
+"""
+
+import contextlib
+import contextvars
+import json
+import os
+import random
+import threading
+import time
+import uuid
+
+# The trace of the request being handled, and the innermost open span in it.
+# Context variables follow the request into awaited coroutines and threads
+# started with a copied context, but not into unrelated worker threads.
+_current_trace = contextvars.ContextVar('current_trace', default=None)
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+
+class Trace:
+    """The spans recorded while handling one request."""
+
+    def __init__(self, name: str, sampled: bool):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.sampled = sampled
+        self.started_at = time.time()
+        self.attributes = {}
+        self.spans = []
+        self.duration_ms = None
+        self._start = time.perf_counter()
+        self._token = None
+
+    def elapsed_ms(self) -> float:
+        """Milliseconds since the trace started."""
+        return (time.perf_counter() - self._start) * 1000
+
+    def server_timing(self) -> str:
+        """
+        Format the spans as a Server-Timing header value.
+
+        Spans with the same name, such as repeated prompt-building steps, are
+        summed. Nested spans are listed as well as their parents, and a
+        ``total`` entry covers the whole request so far.
+        """
+        totals = {}
+        for span_record in self.spans:
+            totals[span_record['name']] = totals.get(span_record['name'], 0.0) + span_record['duration_ms']
+        totals['total'] = self.elapsed_ms() if self.duration_ms is None else self.duration_ms
+        return ', '.join(f'{name};dur={duration:.2f}' for name, duration in totals.items())
+
+    def to_dict(self) -> dict:
+        """The trace as exported."""
+        return {
+            'trace_id': self.trace_id,
+            'name': self.name,
+            'started_at': round(self.started_at, 3),
+            'duration_ms': self.duration_ms,
+            'attributes': self.attributes,
+            'spans': self.spans
+        }
+
+
+@contextlib.contextmanager
+def span(name: str):
+    """
+    Time the enclosed block as a span of the current request's trace.
+
+    Does nothing outside a traced request, so library code can be
+    instrumented unconditionally.
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+
+    parent = _current_span.get()
+    token = _current_span.set(name)
+    start = trace.elapsed_ms()
+    try:
+        yield
+    finally:
+        _current_span.reset(token)
+        trace.spans.append({
+            'name': name,
+            'parent': parent,
+            'start_ms': round(start, 3),
+            'duration_ms': round(trace.elapsed_ms() - start, 3)
+        })
+
+
+class ConsoleExporter:
+    """Print each trace as a JSON line."""
+
+    def export(self, trace: Trace):
+        print(json.dumps(trace.to_dict()))
+
+
+class FileExporter:
+    """Append each trace as a JSON line to a file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, trace: Trace):
+        line = json.dumps(trace.to_dict()) + '\n'
+        with self._lock:
+            with open(self.path, 'a') as f:
+                f.write(line)
+
+
+class Tracer:
+    """
+    Starts and finishes request traces.
+
+    Every request is traced so it can carry a Server-Timing header, which
+    costs a few microseconds per span; ``sample_rate`` only controls which
+    finished traces are exported.
+    """
+
+    def __init__(self, exporter=None, sample_rate: float = 1.0, rng=random.random):
+        """
+        Args:
+            exporter: Object with an ``export(trace)`` method, or None to
+                export nothing
+            sample_rate: Fraction of traces to export, from 0 to 1
+        """
+        if not 0 <= sample_rate <= 1:
+            raise ValueError(f"sample_rate must be between 0 and 1, got {sample_rate}")
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self.rng = rng
+
+    @classmethod
+    def from_env(cls):
+        """Create a tracer configured from TRACE_* environment variables."""
+        target = os.getenv('TRACE_EXPORT', '')
+        if not target:
+            exporter = None
+        elif target == 'console':
+            exporter = ConsoleExporter()
+        else:
+            exporter = FileExporter(target)
+        return cls(exporter, sample_rate=float(os.getenv('TRACE_SAMPLE_RATE', '1')))
+
+    def start(self, name: str) -> Trace:
+        """Start a trace and make it current for spans in this context."""
+        sampled = self.exporter is not None and self.rng() < self.sample_rate
+        trace = Trace(name, sampled)
+        trace._token = _current_trace.set(trace)
+        return trace
+
+    def finish(self, trace: Trace, **attributes):
+        """Stop a trace, detach it from this context and export it if sampled."""
+        trace.duration_ms = round(trace.elapsed_ms(), 3)
+        trace.attributes.update(attributes)
+        if trace._token is not None:
+            _current_trace.reset(trace._token)
+            trace._token = None
+        if trace.sampled:
+            try:
+                self.exporter.export(trace)
+            except Exception as e:
+                print(f"Trace export failed: {str(e)}")
+
+
+class ServerTimingMiddleware:
+    """
+    ASGI middleware that traces each HTTP request and adds a Server-Timing
+    header to its response.
+    """
+
+    def __init__(self, app, tracer: Tracer = None):
+        self.app = app
+        self.tracer = tracer or Tracer.from_env()
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        trace = self.tracer.start(f"{scope['method']} {scope['path']}")
+        status = None
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                headers = list(message.get('headers', []))
+                headers.append((b'server-timing', trace.server_timing().encode('latin-1')))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            self.tracer.finish(trace, status=status)